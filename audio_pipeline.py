@@ -0,0 +1,202 @@
+import os
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from audio_tagging import sr, frame_windows, iter_batches, tag_batches, get_labels, inference_batch_size
+
+# === Parameters ===
+decode_workers = max(1, (os.cpu_count() or 2) - 1)
+queue_size = 8  # decoded clips waiting for the tagger before decoding pauses
+
+_DONE = object()
+
+
+# === Decode Stage (worker processes) ===
+def _decode_to_shared_memory(audio_path):
+    import librosa
+    start = time.perf_counter()
+    audio, _ = librosa.load(audio_path, sr=sr, mono=True)
+    audio = np.ascontiguousarray(audio, dtype=np.float32)
+    shm = shared_memory.SharedMemory(create=True, size=max(audio.nbytes, 1))
+    try:
+        # The parent unlinks the block; keep this worker's tracker from removing it on exit
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+    np.ndarray(audio.shape, dtype=np.float32, buffer=shm.buf)[:] = audio
+    shm.close()
+    return audio_path, shm.name, len(audio), time.perf_counter() - start
+
+
+def _open_shared_audio(name, length):
+    """(block, window view) of a decoded clip; the windows look straight into shared memory."""
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, frame_windows(np.ndarray((length,), dtype=np.float32, buffer=shm.buf))
+
+
+def _release_shared_audio(shm):
+    shm.unlink()
+    try:
+        shm.close()
+    except BufferError:
+        # A view is still referenced (e.g. from a traceback); the mapping goes when it is collected
+        pass
+
+
+def _produce(audio_paths, pool, workers, out_queue, stats, stop):
+    # Futures are collected in submission order so clips come out deterministically
+    pending = deque()
+    paths = iter(audio_paths)
+    try:
+        while not stop.is_set():
+            while len(pending) < workers:
+                path = next(paths, None)
+                if path is None:
+                    break
+                pending.append(pool.submit(_decode_to_shared_memory, path))
+            if not pending:
+                break
+            item = pending.popleft().result()
+            stats['decode_seconds'] += item[3]
+            blocked = time.perf_counter()
+            out_queue.put(item)
+            stats['producer_blocked_seconds'] += time.perf_counter() - blocked
+    except BaseException as exc:
+        out_queue.put(exc)
+    finally:
+        # Hand finished-but-undelivered clips to the consumer so their shared memory is released
+        for future in pending:
+            if not future.cancel():
+                try:
+                    out_queue.put(future.result())
+                except Exception:
+                    pass
+        out_queue.put(_DONE)
+
+
+# === Pipeline ===
+def iter_tagged_audio(audio_paths, workers=decode_workers, max_queued=queue_size,
+                      batch_size=inference_batch_size, at=None, stats=None):
+    """Yield (audio_path, window_probs) in input order.
+
+    A process pool decodes and resamples clips into shared memory while the tagger runs; a
+    bounded queue between the two applies backpressure. Windows are views into the shared blocks
+    and only the batch passed to the tagger is copied; a block is released once all windows of
+    its clip have been tagged. Windows of consecutive clips are packed into full batches of
+    batch_size. Per-stage timings are accumulated into stats.
+    """
+    stats = {} if stats is None else stats
+    for key in ('clips', 'windows', 'batches', 'decode_seconds', 'tag_seconds',
+                'tagger_wait_seconds', 'producer_blocked_seconds'):
+        stats[key] = 0
+    started = time.perf_counter()
+
+    out_queue = queue.Queue(maxsize=max_queued)
+    stop = threading.Event()
+    window_views = deque()  # untagged window views, across clip boundaries
+    buffered = 0
+    tagged = []  # probabilities not yet handed out
+    waiting = deque()  # (audio_path, num_windows, shared block) in input order
+
+    def tag_pending(flush):
+        nonlocal buffered, tagged
+        num_windows = buffered if flush else (buffered // batch_size) * batch_size
+        if num_windows:
+            views, taken = [], 0
+            while taken < num_windows:
+                view = window_views.popleft()
+                take = min(len(view), num_windows - taken)
+                views.append(view[:take])
+                if take < len(view):
+                    window_views.appendleft(view[take:])
+                taken += take
+            tag_start = time.perf_counter()
+            tagged.append(tag_batches(iter_batches(views, batch_size), at))
+            stats['tag_seconds'] += time.perf_counter() - tag_start
+            del views, view  # the blocks of finished clips are released below
+            stats['batches'] += -(-num_windows // batch_size)
+            buffered -= num_windows
+
+        # Hand out every clip whose windows are all tagged
+        available = sum(len(p) for p in tagged)
+        if not waiting or waiting[0][1] > available:
+            return []
+        # Clips without windows still get (0, num_labels); before any batch is tagged the width comes from the labels
+        probs = np.concatenate(tagged) if tagged else np.zeros((0, len(get_labels())), dtype=np.float32)
+        finished, offset = [], 0
+        while waiting and waiting[0][1] <= available - offset:
+            audio_path, count, shm = waiting.popleft()
+            _release_shared_audio(shm)
+            finished.append((audio_path, probs[offset:offset + count]))
+            offset += count
+        tagged = [probs[offset:]]
+        return finished
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        producer = threading.Thread(target=_produce, args=(audio_paths, pool, workers, out_queue, stats, stop), daemon=True)
+        producer.start()
+        try:
+            while True:
+                wait_start = time.perf_counter()
+                item = out_queue.get()
+                stats['tagger_wait_seconds'] += time.perf_counter() - wait_start
+                if item is _DONE:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                audio_path, name, length, _ = item
+                shm, windows = _open_shared_audio(name, length)
+                num_windows = len(windows)
+                window_views.append(windows)
+                del windows
+                buffered += num_windows
+                waiting.append((audio_path, num_windows, shm))
+                stats['clips'] += 1
+                stats['windows'] += num_windows
+                yield from tag_pending(flush=False)
+            yield from tag_pending(flush=True)
+        finally:
+            stop.set()
+            window_views.clear()
+            for _, _, shm in waiting:
+                _release_shared_audio(shm)
+            # Drain so a producer blocked on put() can finish, releasing undelivered shared memory
+            while producer.is_alive() or not out_queue.empty():
+                try:
+                    item = out_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if isinstance(item, tuple):
+                    _release_shared_audio(shared_memory.SharedMemory(name=item[1]))
+            producer.join()
+
+    wall = time.perf_counter() - started
+    stats['wall_seconds'] = wall
+    stats['decode_utilization'] = stats['decode_seconds'] / (wall * workers) if wall else 0.0
+    stats['tagger_utilization'] = stats['tag_seconds'] / wall if wall else 0.0
+
+
+def tag_audio_files(audio_paths, **kwargs):
+    """List version of iter_tagged_audio; returns (results, stats)."""
+    stats = {}
+    results = list(iter_tagged_audio(audio_paths, stats=stats, **kwargs))
+    return results, stats
+
+
+if __name__ == "__main__":
+    from audio_tagging import audio_folder, top_tags
+
+    audio_paths = [os.path.join(audio_folder, f) for f in sorted(os.listdir(audio_folder)) if f.endswith('.wav')]
+    stats = {}
+    for audio_path, window_probs in iter_tagged_audio(audio_paths, stats=stats):
+        _, clipwise_tags = top_tags(window_probs)
+        print(f"{os.path.basename(audio_path)}: {[(label, round(float(score), 3)) for label, score in clipwise_tags]}")
+
+    print(f"\n{stats['clips']} clips, {stats['windows']} windows, {stats['batches']} batches in {stats['wall_seconds']:.1f}s")
+    print(f"decode utilization {stats['decode_utilization']:.0%}, tagger utilization {stats['tagger_utilization']:.0%}, "
+          f"tagger waited {stats['tagger_wait_seconds']:.1f}s, decoders blocked {stats['producer_blocked_seconds']:.1f}s")
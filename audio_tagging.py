@@ -0,0 +1,273 @@
+import os
+import struct
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# === Paths ===
+audio_folder = './data/test_audio_output'
+
+# === Parameters ===
+num_clips = 5  # Number of audio clips to process
+sr = 32000  # Sample rate
+clip_duration = 5  # Audio segment length (s)
+overlap = 2  # Overlap in audio (s)
+top_n_tags = 3  # Take the top 3 tags regardless of confidence
+inference_batch_size = 32  # Windows per AudioTagging call
+stream_decode = False  # True reads WAVs through memmap/soxr streaming instead of librosa.load (check with decode_parity)
+stream_chunk_seconds = 30  # Read size when a file has to be resampled while streaming
+parity_sample_atol = 1e-3  # largest sample difference decode_parity accepts against librosa
+parity_prob_atol = 1e-2  # largest tag probability difference decode_parity accepts
+device = 'cpu'
+
+_audio_tagger = None
+
+
+# === Model ===
+def get_audio_tagger():
+    global _audio_tagger
+    if _audio_tagger is None:
+        from panns_inference import AudioTagging
+        _audio_tagger = AudioTagging(checkpoint_path=None, device=device)
+    return _audio_tagger
+
+
+def get_labels():
+    from panns_inference import labels
+    return labels
+
+
+# === Windowing ===
+def window_params():
+    segment_length = int(clip_duration * sr)
+    hop_length = int((clip_duration - overlap) * sr)
+    return segment_length, hop_length
+
+
+def frame_windows(audio):
+    """Strided (num_windows, segment_length) view with the windows of the per-segment loop; nothing is copied.
+
+    A (frames, channels) array gives (num_windows, channels, segment_length).
+    """
+    segment_length, hop_length = window_params()
+    if len(audio) < segment_length:
+        return np.zeros((0,) + audio.shape[1:] + (segment_length,), dtype=np.float32)
+    return sliding_window_view(audio, segment_length, axis=0)[::hop_length]
+
+
+def pcm_to_float(windows):
+    """float32 mono windows, scaled like soundfile/librosa, from PCM or multichannel windows."""
+    if windows.dtype == np.int16:
+        windows = windows.astype(np.float32) / 32768.0
+    elif windows.dtype == np.int32:
+        windows = windows.astype(np.float32) / 2147483648.0
+    elif windows.dtype == np.uint8:
+        windows = (windows.astype(np.float32) - 128.0) / 128.0
+    else:
+        windows = windows.astype(np.float32, copy=False)
+    if windows.ndim == 3:  # (num_windows, channels, samples), downmix like librosa's to_mono
+        windows = windows.mean(axis=1)
+    return np.ascontiguousarray(windows)
+
+
+def iter_batches(window_views, batch_size=inference_batch_size):
+    """Yield float32 batches of batch_size windows drawn in order from a sequence of window views.
+
+    Only the batch being yielded is materialized, so overlapping windows are never copied as a whole.
+    """
+    parts, count = [], 0
+    for view in window_views:
+        start = 0
+        while start < len(view):
+            take = min(batch_size - count, len(view) - start)
+            parts.append(view[start:start + take])
+            count += take
+            start += take
+            if count == batch_size:
+                yield pcm_to_float(np.concatenate(parts) if len(parts) > 1 else parts[0])
+                parts, count = [], 0
+    if parts:
+        yield pcm_to_float(np.concatenate(parts) if len(parts) > 1 else parts[0])
+
+
+# === WAV Reading ===
+def open_wav_memmap(audio_path):
+    """(samples, sample_rate) with samples memory-mapped from a PCM/float WAV; (None, None) for other files.
+
+    Mono files give a 1-D map, multichannel files a (frames, channels) map.
+    """
+    with open(audio_path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            return None, None
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None, None
+            chunk_id, chunk_size = chunk[:4], struct.unpack('<I', chunk[4:])[0]
+            if chunk_id == b'fmt ':
+                body = f.read(chunk_size)
+                format_tag, channels, sample_rate = struct.unpack('<HHI', body[:8])
+                bits = struct.unpack('<H', body[14:16])[0]
+                if format_tag == 0xFFFE and len(body) >= 26:  # WAVE_FORMAT_EXTENSIBLE
+                    format_tag = struct.unpack('<H', body[24:26])[0]
+                fmt = (format_tag, channels, sample_rate, bits)
+                f.seek(chunk_size % 2, 1)
+            elif chunk_id == b'data':
+                data_offset = f.tell()
+                break
+            else:
+                f.seek(chunk_size + chunk_size % 2, 1)
+
+    dtype = {(1, 8): np.uint8, (1, 16): np.int16, (1, 32): np.int32, (3, 32): np.float32}.get((fmt[0], fmt[3])) if fmt else None
+    if dtype is None:
+        return None, None
+    format_tag, channels, sample_rate, bits = fmt
+    data_bytes = min(chunk_size, os.path.getsize(audio_path) - data_offset)
+    frames = data_bytes // (np.dtype(dtype).itemsize * channels)
+    samples = np.memmap(audio_path, dtype=dtype, mode='r', offset=data_offset, shape=(frames, channels))
+    return (samples[:, 0] if channels == 1 else samples), sample_rate
+
+
+def iter_resampled_windows(audio_path):
+    """Window views of a file that is not at the tagger rate, decoded and resampled chunk by chunk."""
+    import soundfile as sf
+    import soxr
+    segment_length, hop_length = window_params()
+    with sf.SoundFile(audio_path) as f:
+        chunk_frames = int(stream_chunk_seconds * f.samplerate)
+        resampler = soxr.ResampleStream(f.samplerate, sr, 1, dtype='float32') if f.samplerate != sr else None
+        buffer = np.zeros(0, dtype=np.float32)
+        while True:
+            block = f.read(chunk_frames, dtype='float32', always_2d=True)
+            last = len(block) < chunk_frames
+            mono = block.mean(axis=1)
+            if resampler is not None:
+                mono = resampler.resample_chunk(mono, last=last)
+            buffer = np.concatenate([buffer, mono])
+            windows = frame_windows(buffer)
+            if len(windows):
+                yield windows
+                buffer = buffer[len(windows) * hop_length:]
+            if last:
+                break
+
+
+def load_audio(audio_path):
+    """Reference decoding: the whole file through librosa, resampled to sr and downmixed."""
+    import librosa
+    audio, _ = librosa.load(audio_path, sr=sr, mono=True)
+    return audio
+
+
+def iter_file_batches(audio_path, batch_size=inference_batch_size, stream=None):
+    """Window batches of an audio file.
+
+    By default the file is decoded with librosa.load. With stream (default stream_decode) a WAV is
+    read with memory bounded by the batch, however long the recording is: memory-mapped when it
+    is already at sr, otherwise resampled chunk by chunk with soxr. A memory-mapped WAV gives the
+    samples librosa gives; a streamed resample differs from librosa's one-shot resample by
+    filter edge effects at chunk boundaries and at the ends, see decode_parity.
+    """
+    stream = stream_decode if stream is None else stream
+    if not stream:
+        return iter_batches([frame_windows(load_audio(audio_path))], batch_size)
+    samples, sample_rate = open_wav_memmap(audio_path)
+    if samples is not None and sample_rate == sr:
+        return iter_batches([frame_windows(samples)], batch_size)
+    return iter_batches(iter_resampled_windows(audio_path), batch_size)
+
+
+# === Batched Inference ===
+def tag_batches(batches, at=None):
+    """Per-window clipwise probabilities, shape (num_windows, num_labels), one AudioTagging call per batch.
+
+    PANNs runs in eval mode, so each row matches at.inference(window[None, :]).
+    """
+    at = get_audio_tagger() if at is None else at
+    outputs = []
+    for batch in batches:
+        clipwise_output, _ = at.inference(batch)
+        outputs.append(np.asarray(clipwise_output, dtype=np.float32))
+    if not outputs:
+        return np.zeros((0, len(get_labels())), dtype=np.float32)
+    return np.concatenate(outputs)
+
+
+def tag_windows(windows, batch_size=inference_batch_size, at=None):
+    return tag_batches(iter_batches([windows], batch_size), at)
+
+
+def tag_clips(audios, batch_size=inference_batch_size, at=None):
+    """Tag many clips at once; windows of consecutive clips share batches. Returns one matrix per clip."""
+    windows = [frame_windows(audio) for audio in audios]
+    offsets = np.cumsum([0] + [len(w) for w in windows])
+    probs = tag_batches(iter_batches(windows, batch_size), at)
+    return [probs[offsets[i]:offsets[i + 1]] for i in range(len(windows))]
+
+
+def top_tags(window_probs):
+    """Top-n (label, score) per window, and each label's max score over windows sorted by confidence."""
+    labels = get_labels()
+    tags_list = []
+    clipwise_confidences = {}
+    for scores in window_probs:
+        sorted_indices = np.argsort(scores)[::-1][:top_n_tags]
+        tags = [(labels[i], scores[i]) for i in sorted_indices]
+        tags_list.append(tags)
+        for label, confidence in tags:
+            if label not in clipwise_confidences or confidence > clipwise_confidences[label]:
+                clipwise_confidences[label] = confidence
+    clipwise_tags = sorted(clipwise_confidences.items(), key=lambda x: x[1], reverse=True)
+    return tags_list, clipwise_tags
+
+
+def process_audio(audio_path, batch_size=inference_batch_size, stream=None):
+    window_probs = tag_batches(iter_file_batches(audio_path, batch_size, stream))
+    return top_tags(window_probs)
+
+
+# === Decoding Parity ===
+def decode_parity(audio_path, at=None, sample_atol=parity_sample_atol, prob_atol=parity_prob_atol):
+    """Compare the streamed decoding of a file with librosa.load, on the samples and on the tags.
+
+    Returns the window counts of both, the largest sample and probability differences over the
+    windows both have, the share of windows whose top-n labels differ, and ok when the counts
+    agree, both differences are within tolerance and no top-n labels differ.
+    """
+    reference = pcm_to_float(frame_windows(load_audio(audio_path)))
+    streamed = list(iter_file_batches(audio_path, stream=True))
+    streamed = np.concatenate(streamed) if streamed else np.zeros_like(reference)
+    common = min(len(reference), len(streamed))
+    sample_diff = float(np.abs(reference[:common] - streamed[:common]).max()) if common else 0.0
+
+    reference_probs = tag_windows(reference[:common], at=at)
+    streamed_probs = tag_windows(streamed[:common], at=at)
+    prob_diff = float(np.abs(reference_probs - streamed_probs).max()) if common else 0.0
+    reference_top = np.sort(np.argsort(reference_probs, axis=1)[:, ::-1][:, :top_n_tags], axis=1)
+    streamed_top = np.sort(np.argsort(streamed_probs, axis=1)[:, ::-1][:, :top_n_tags], axis=1)
+    top_mismatch = float((reference_top != streamed_top).any(axis=1).mean()) if common else 0.0
+
+    return {
+        'reference_windows': len(reference),
+        'streamed_windows': len(streamed),
+        'max_sample_diff': sample_diff,
+        'max_prob_diff': prob_diff,
+        'top_tag_mismatch': top_mismatch,
+        'ok': len(reference) == len(streamed) and sample_diff <= sample_atol and prob_diff <= prob_atol
+              and top_mismatch == 0.0,
+    }
+
+
+if __name__ == "__main__":
+    audio_paths = [
+        os.path.join(audio_folder, file_name)
+        for file_name in sorted(os.listdir(audio_folder)) if file_name.endswith('.wav')
+    ][:num_clips]
+
+    for audio_path in audio_paths:
+        segment_tags, clipwise_tags = process_audio(audio_path)
+        print(f"\n{os.path.basename(audio_path)}")
+        for j, tags in enumerate(segment_tags):
+            print(f"  Segment {j + 1}: {[(label, round(float(score), 3)) for label, score in tags]}")
+        print(f"  Clipwise: {[(label, round(float(score), 3)) for label, score in clipwise_tags]}")
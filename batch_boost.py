@@ -0,0 +1,164 @@
+from collections import namedtuple
+import numpy as np
+from instrumentation import recorder
+
+# === Ragged Inputs ===
+# Every clip owns a contiguous slice of the tag arrays and of the phrase arrays (CSR layout):
+#   tags of clip c    -> tag_ids[tag_offsets[c]:tag_offsets[c + 1]], tag_confs[...]
+#   phrases of clip c -> phrase_ids[phrase_offsets[c]:phrase_offsets[c + 1]]
+# Ids index into tag_vocab / phrase_vocab, so each distinct string is embedded once.
+RaggedBatch = namedtuple('RaggedBatch', [
+    'clip_ids', 'tag_offsets', 'tag_ids', 'tag_confs',
+    'phrase_offsets', 'phrase_ids', 'num_captions', 'tag_vocab', 'phrase_vocab',
+])
+
+
+def build_ragged_batch(clips):
+    """clips: iterable of (clip_id, audio_tags, caption_elements, num_captions) as passed to boost_confidence_ratio."""
+    clip_ids, num_captions = [], []
+    tag_offsets, tag_ids, tag_confs = [0], [], []
+    phrase_offsets, phrase_ids = [0], []
+    tag_vocab, phrase_vocab = {}, {}
+
+    for clip_id, audio_tags, caption_elements, clip_num_captions in clips:
+        # Same collapsing of repeated tags as the results dict in boost_confidence_ratio
+        for tag, audio_conf in dict(audio_tags).items():
+            tag_ids.append(tag_vocab.setdefault(tag, len(tag_vocab)))
+            tag_confs.append(float(audio_conf))
+        for phrase in caption_elements:
+            phrase_ids.append(phrase_vocab.setdefault(phrase, len(phrase_vocab)))
+        clip_ids.append(clip_id)
+        num_captions.append(clip_num_captions)
+        tag_offsets.append(len(tag_ids))
+        phrase_offsets.append(len(phrase_ids))
+
+    return RaggedBatch(
+        clip_ids=clip_ids,
+        tag_offsets=np.array(tag_offsets, dtype=np.int64),
+        tag_ids=np.array(tag_ids, dtype=np.int64),
+        tag_confs=np.array(tag_confs, dtype=np.float64),
+        phrase_offsets=np.array(phrase_offsets, dtype=np.int64),
+        phrase_ids=np.array(phrase_ids, dtype=np.int64),
+        num_captions=np.array(num_captions, dtype=np.int64),
+        tag_vocab=list(tag_vocab),
+        phrase_vocab=list(phrase_vocab),
+    )
+
+
+def tag_clip_index(batch):
+    """Clip index of every tag entry."""
+    return np.repeat(np.arange(len(batch.clip_ids)), np.diff(batch.tag_offsets))
+
+
+# === Similarity ===
+def cosine_similarity_matrix(a, b):
+    if hasattr(a, 'cosine') or hasattr(b, 'cosine'):
+        # float16/int8 embeddings from quantized_embeddings bring their own kernel
+        from quantized_embeddings import as_quantized
+        return as_quantized(a).cosine(as_quantized(b))
+    # Same normalization as sentence_transformers.util.cos_sim
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return a @ b.T
+
+
+def pair_index(batch):
+    """Expand every clip into its tag x phrase pairs.
+
+    Returns (pair_tag, pair_phrase, tag_pair_offsets): the tag entry and phrase entry of
+    each pair, and CSR offsets of the pairs belonging to each tag entry.
+    """
+    phrases_per_clip = np.diff(batch.phrase_offsets)
+    tag_clip = tag_clip_index(batch)
+    pairs_per_tag = phrases_per_clip[tag_clip]
+    tag_pair_offsets = np.zeros(len(tag_clip) + 1, dtype=np.int64)
+    np.cumsum(pairs_per_tag, out=tag_pair_offsets[1:])
+
+    pair_tag = np.repeat(np.arange(len(tag_clip)), pairs_per_tag)
+    within = np.arange(tag_pair_offsets[-1]) - tag_pair_offsets[:-1][pair_tag]
+    pair_phrase = batch.phrase_offsets[:-1][tag_clip][pair_tag] + within
+    return pair_tag, pair_phrase, tag_pair_offsets
+
+
+def compute_pair_similarities(batch, embed_fn):
+    """Cosine similarity of every (tag, phrase) pair in the batch, plus the per-tag pair offsets.
+
+    embed_fn maps a list of strings to an (n, dim) array, e.g. get_embeddings_with_cache.
+    """
+    with recorder.stage('similarity'):
+        embeddings = embed_fn(batch.tag_vocab + batch.phrase_vocab)
+        num_tags = len(batch.tag_vocab)
+        sim = cosine_similarity_matrix(embeddings[:num_tags], embeddings[num_tags:])
+        pair_tag, pair_phrase, tag_pair_offsets = pair_index(batch)
+        pair_sims = sim[batch.tag_ids[pair_tag], batch.phrase_ids[pair_phrase]]
+    recorder.add_items('similarity', len(pair_sims))
+    return pair_sims, tag_pair_offsets
+
+
+# === Boosting ===
+def segment_sum(values, offsets):
+    """Sum the last axis of values over CSR segments; empty segments give 0."""
+    values = np.asarray(values)
+    cumulative = np.zeros(values.shape[:-1] + (values.shape[-1] + 1,), dtype=np.result_type(values.dtype, np.int64))
+    np.cumsum(values, axis=-1, out=cumulative[..., 1:])
+    return cumulative[..., offsets[1:]] - cumulative[..., offsets[:-1]]
+
+
+def count_matches(pair_sims, tag_pair_offsets, caption_similarity_threshold):
+    # Compare in float64 like float(util.cos_sim(...)) > threshold does
+    above = pair_sims.astype(np.float64) > caption_similarity_threshold
+    return segment_sum(above, tag_pair_offsets)
+
+
+def match_ratios(match_counts, tag_num_captions):
+    safe = np.maximum(tag_num_captions, 1)
+    return np.where(tag_num_captions > 0, np.minimum(1.0, match_counts / safe), 0.0)
+
+
+def boost_from_ratios(match_ratio, tag_confs, alpha):
+    return np.minimum(1.0, alpha * match_ratio + (1 - alpha) * tag_confs)
+
+
+def boost_confidence_batch(batch, embed_fn, alpha=0.5, caption_similarity_threshold=0.5, pair_similarities=None):
+    """Dataset-wide boost_confidence_ratio. Returns arrays aligned with the tag entries of the batch.
+
+    Pass pair_similarities (the result of compute_pair_similarities) to skip the encoding step.
+    Boosted confidences are float64 like batch.tag_confs, so ties with a confidence threshold fall
+    the same way as in the per-clip Python float path.
+    """
+    if pair_similarities is None:
+        pair_similarities = compute_pair_similarities(batch, embed_fn)
+    pair_sims, tag_pair_offsets = pair_similarities
+    tag_num_captions = batch.num_captions[tag_clip_index(batch)]
+
+    with recorder.stage('boosting', len(batch.tag_ids)):
+        matches = count_matches(pair_sims, tag_pair_offsets, caption_similarity_threshold)
+        ratio = match_ratios(matches, tag_num_captions)
+        boosted = boost_from_ratios(ratio, batch.tag_confs, alpha)
+    return {
+        'original': batch.tag_confs,
+        'boosted': boosted,
+        'matches': matches,
+        'match_ratio': ratio,
+    }
+
+
+def unpack_boosted_results(batch, batch_results):
+    """Per-clip {clip_id: results} dicts in the same format as boost_confidence_ratio."""
+    per_clip = {}
+    for c, clip_id in enumerate(batch.clip_ids):
+        num_captions = int(batch.num_captions[c])
+        results = {}
+        for i in range(batch.tag_offsets[c], batch.tag_offsets[c + 1]):
+            match_count = int(batch_results['matches'][i])
+            match_ratio = float(batch_results['match_ratio'][i])
+            results[batch.tag_vocab[batch.tag_ids[i]]] = {
+                'original': float(batch_results['original'][i]),
+                'boosted': float(batch_results['boosted'][i]),
+                'matches': match_count,
+                'match_ratio': f"{match_count}/{num_captions} ({match_ratio:.3f})",
+            }
+        per_clip[clip_id] = results
+    return per_clip
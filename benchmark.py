@@ -0,0 +1,416 @@
+import os
+import sys
+import csv
+import json
+import time
+import random
+import hashlib
+import argparse
+import platform
+import subprocess
+import tempfile
+import numpy as np
+
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, repo_dir)
+
+import phrase_f1
+import audio_tagging
+from batch_boost import boost_confidence_batch, cosine_similarity_matrix
+from grid_search import grid_search, semantic_pairs
+from label_index import LabelIndex, normalize_rows
+from threshold_sweep import optimize_thresholds
+from parallel_grid import parallel_grid_search, grid_workers
+from phrase_extraction import extract_phrase_lists
+from predictions_loader import load_label_vocabulary, load_predictions, build_prediction_batch
+
+# === Parameters ===
+default_sizes = [100, 10000, 100000]
+seed = 1234
+tags_per_clip = 10
+captions_per_clip = 5
+ground_truth_per_clip = 3
+per_clip_sample = 1000  # per-clip reference functions are timed on at most this many clips
+encoder_sample = 2000  # clips whose captions are encoded cold by every encoder backend (--real-models only)
+stream_sizes = [10000, 40000]  # corpus sizes streamed in fresh processes, to check memory stays flat
+stream_cached_clips = 1000  # BoundedPhraseCache size of the streaming runs
+audio_seconds = 60
+embedding_dim = 384
+alpha_values = [0.0, 0.1, 0.3, 0.5, 0.7, 0.9]
+confidence_thresholds = [0.3, 0.5]
+caption_similarity_thresholds = [0.3, 0.5]
+
+subjects = ["man", "woman", "child", "dog", "car", "crowd", "bird", "engine", "baby", "train", "wind", "water"]
+verbs = ["speaking", "barking", "singing", "running", "laughing", "talking", "chirping", "playing", "crying", "passing"]
+objects = ["music", "guitar", "street", "background", "rain", "traffic", "door", "piano", "waves", "bell"]
+stop_words = {"a", "an", "the", "in", "on", "with", "and", "while", "is", "are", "to", "of"}
+
+
+# === Synthetic Data ===
+def make_captions(num_clips, rng):
+    captions_data = {}
+    for c in range(num_clips):
+        audio_captions = []
+        for _ in range(captions_per_clip):
+            caption = (f"a {rng.choice(subjects)} is {rng.choice(verbs)} "
+                       f"with {rng.choice(objects)} {rng.choice(objects)} in the background")
+            audio_captions.append(caption)
+        captions_data[f"{1000000 + c}"] = {"audio_captions": audio_captions}
+    return captions_data
+
+
+def write_predictions_csv(path, clip_ids, vocab, rng):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        header = ['filename']
+        for i in range(1, tags_per_clip + 1):
+            header += [f'tag{i}', f'tag{i}prob']
+        writer.writerow(header)
+        for clip_id in clip_ids:
+            row = [f"{clip_id}.wav"]
+            for tag in rng.sample(vocab, tags_per_clip):
+                row += [tag, f"{rng.random():.6f}"]
+            writer.writerow(row)
+
+
+def make_ground_truth(clip_ids, vocab, rng):
+    return {f"{clip_id}.wav": rng.sample(vocab, ground_truth_per_clip) for clip_id in clip_ids}
+
+
+def make_unique_captions(num_clips, rng):
+    """make_captions with a clip-specific noun in every caption, so the distinct texts grow with the corpus."""
+    captions_data = make_captions(num_clips, rng)
+    for clip_id, record in captions_data.items():
+        record["audio_captions"] = [f"{caption} near site{clip_id}" for caption in record["audio_captions"]]
+    return captions_data
+
+
+# === Stub Encoder and Parser ===
+def stub_encode(texts):
+    """Deterministic pseudo-embeddings: each text seeds its own random vector."""
+    out = np.empty((len(texts), embedding_dim), dtype=np.float32)
+    for i, text in enumerate(texts):
+        text_seed = int.from_bytes(hashlib.sha1(text.encode('utf-8')).digest()[:8], 'little')
+        out[i] = np.random.default_rng(text_seed).standard_normal(embedding_dim)
+    return out
+
+
+class StubToken:
+    def __init__(self, doc, i, text, pos):
+        self.doc, self.i, self.text, self.pos_ = doc, i, text, pos
+        self.dep_, self.head_i = "dep", i
+        self.is_stop = text in stop_words
+        self.is_punct = False
+
+    @property
+    def head(self):
+        return self.doc.tokens[self.head_i]
+
+    @property
+    def children(self):
+        return [t for t in self.doc.tokens if t.head_i == self.i and t.i != self.i]
+
+
+class StubDoc:
+    """Rule-based stand-in for a parsed caption with the attributes the phrase rules read."""
+
+    def __init__(self, text):
+        words = text.split()
+        self.tokens = []
+        for i, word in enumerate(words):
+            pos = "VERB" if word in verbs else "DET" if word in ("a", "an", "the") else "ADP" if word in stop_words else "NOUN"
+            self.tokens.append(StubToken(self, i, word, pos))
+        verb = next((t for t in self.tokens if t.pos_ == "VERB"), None)
+        prep = None
+        for t in self.tokens:
+            if verb is None or t is verb:
+                continue
+            nxt = self.tokens[t.i + 1] if t.i + 1 < len(self.tokens) else None
+            if t.pos_ == "NOUN" and nxt is not None and nxt.pos_ == "NOUN":
+                t.dep_, t.head_i = "compound", nxt.i
+            elif t.pos_ == "NOUN" and t.i < verb.i:
+                t.dep_, t.head_i = "nsubj", verb.i
+            elif t.pos_ == "NOUN":
+                t.dep_, t.head_i = ("pobj", prep.i) if prep is not None else ("dobj", verb.i)
+            elif t.pos_ == "DET" and nxt is not None:
+                t.dep_, t.head_i = "det", nxt.i
+            elif t.pos_ == "ADP" and t.i > verb.i:
+                t.dep_, t.head_i, prep = "prep", verb.i, t
+
+    def __iter__(self):
+        return iter(self.tokens)
+
+    @property
+    def noun_chunks(self):
+        chunks, current = [], []
+        for t in self.tokens:
+            if t.pos_ in ("DET", "NOUN"):
+                current.append(t)
+            elif current:
+                chunks.append(current)
+                current = []
+        if current:
+            chunks.append(current)
+        return [chunk for chunk in chunks if any(t.pos_ == "NOUN" for t in chunk)]
+
+
+class StubNlp:
+    pipe_names = []
+
+    def pipe(self, texts, batch_size=64, n_process=1, disable=()):
+        return (StubDoc(text) for text in texts)
+
+
+class StubTagger:
+    """Random projection standing in for AudioTagging.inference."""
+
+    def __init__(self, num_labels=527):
+        self.weights = np.random.default_rng(seed).standard_normal((64, num_labels)).astype(np.float32)
+
+    def inference(self, batch):
+        features = batch.reshape(len(batch), 64, -1).mean(axis=2)
+        return 1 / (1 + np.exp(-(features @ self.weights))), None
+
+
+# === Timing ===
+def timed(results, size, stage, items, fn, *args, **kwargs):
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    value = fn(*args, **kwargs)
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    results.append({
+        'size': size, 'stage': stage, 'items': items, 'wall_seconds': wall, 'cpu_seconds': cpu,
+        'items_per_second': items / wall if wall > 0 else None,
+    })
+    print(f"{size:>7} {stage:<28} {items:>9} items {wall:9.3f}s wall {cpu:9.3f}s cpu")
+    return value
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_dir, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_size(size, results, encode_fn, nlp, vocab, workdir, real_models=False):
+    rng = random.Random(seed + size)
+    captions_data = make_captions(size, rng)
+    clip_ids = list(captions_data)
+    csv_path = os.path.join(workdir, f'predictions_{size}.csv')
+    write_predictions_csv(csv_path, clip_ids, vocab, rng)
+    ground_truth = make_ground_truth(clip_ids, vocab, rng)
+    phrase_f1.ground_truth_tags_dict = ground_truth
+    phrase_f1.encode_texts = encode_fn
+    phrase_f1.embedding_cache.clear()
+    if not real_models:
+        # A fresh store per size, so every size starts with a cold embedding cache
+        phrase_f1.sbert_model_name = f'benchmark-stub-{size}'
+
+    predictions = timed(results, size, 'load_predictions', size, load_predictions, csv_path, list(vocab))
+    phrase_f1.predictions = predictions
+    caption_lists = [captions_data[c]["audio_captions"] for c in clip_ids]
+    phrase_lists = timed(results, size, 'extract_caption_phrases', size * captions_per_clip,
+                         extract_phrase_lists, caption_lists, nlp)
+
+    fnames = [f"{c}.wav" for c in clip_ids]
+    batch = build_prediction_batch(predictions, fnames, phrase_lists, [captions_per_clip] * size)
+    ground_truth_lists = [ground_truth[f] for f in fnames]
+    embed_fn = phrase_f1.get_embeddings_with_cache
+    timed(results, size, 'encode_vocabulary', len(batch.tag_vocab) + len(batch.phrase_vocab),
+          embed_fn, batch.tag_vocab + batch.phrase_vocab)
+
+    # Label index against the brute-force alternatives: every label re-embedded and fully sorted per query,
+    # and semantic matches that look labels up through embed_fn
+    label_index = timed(results, size, 'build_label_index', len(vocab),
+                        lambda: LabelIndex(vocab, normalize_rows(embed_fn(list(vocab)))))
+    phrase_embeddings = np.asarray(embed_fn(batch.phrase_vocab))
+    timed(results, size, 'label_index_top_k', len(batch.phrase_vocab), label_index.top_k, phrase_embeddings, 5)
+    timed(results, size, 'brute_force_top_k', len(batch.phrase_vocab),
+          lambda: np.argsort(-cosine_similarity_matrix(phrase_embeddings, embed_fn(list(vocab))), axis=1)[:, :5])
+    timed(results, size, 'semantic_pairs', size, semantic_pairs, batch, ground_truth_lists, embed_fn)
+    timed(results, size, 'semantic_pairs_label_index', size, semantic_pairs, batch, ground_truth_lists,
+          lambda labels: label_index.embeddings(labels, embed_fn))
+
+    # Per-clip reference path on a sample, warm cache
+    sample = min(size, per_clip_sample)
+    per_clip = [(phrase_f1.clipwise_tags_for(fnames[c]), ground_truth_lists[c], phrase_lists[c], caption_lists[c])
+                for c in range(sample)]
+    timed(results, size, 'boost_confidence_ratio', sample,
+          lambda: [phrase_f1.boost_confidence_ratio(t, p, a, 0.5, 0.5) for t, _, p, a in per_clip])
+    timed(results, size, 'evaluate_combination', sample,
+          lambda: [phrase_f1.evaluate_combination(t, g, p, a, 0.5, 0.5, 0.5) for t, g, p, a in per_clip])
+
+    timed(results, size, 'boost_confidence_batch', size, boost_confidence_batch, batch, embed_fn, 0.5, 0.5)
+    num_points = len(alpha_values) * len(confidence_thresholds) * len(caption_similarity_thresholds)
+    timed(results, size, 'grid_search', size * num_points, grid_search, batch, ground_truth_lists,
+          alpha_values, confidence_thresholds, caption_similarity_thresholds, embed_fn=embed_fn)
+    timed(results, size, f'parallel_grid_search_{grid_workers}w', size * num_points, parallel_grid_search, batch,
+          ground_truth_lists, alpha_values, confidence_thresholds, caption_similarity_thresholds, embed_fn=embed_fn)
+    timed(results, size, 'optimize_thresholds', size * len(alpha_values) * len(caption_similarity_thresholds),
+          optimize_thresholds, batch, ground_truth_lists, alpha_values, caption_similarity_thresholds, embed_fn=embed_fn)
+
+
+def run_audio(results, tagger):
+    audio = np.random.default_rng(seed).uniform(-0.5, 0.5, audio_tagging.sr * audio_seconds).astype(np.float32)
+    windows = timed(results, audio_seconds, 'frame_windows', 1, audio_tagging.frame_windows, audio)
+    batches = timed(results, audio_seconds, 'window_batches', len(windows),
+                    lambda: list(audio_tagging.iter_batches([windows])))
+    timed(results, audio_seconds, 'tag_windows', len(windows), audio_tagging.tag_batches, batches, tagger)
+
+
+def encoder_step(backend, step):
+    """Result rows of one encoder step, run in this process: 'export' (ONNX export and quantization) or 'run'.
+
+    Every row carries the peak memory of the process, so each step should get a fresh process.
+    """
+    from instrumentation import peak_memory_mb
+    from models import sbert_model_name, get_sbert_model, get_encoding_scheduler
+    from encoder_backends import check_backend, export_onnx, quantize_onnx, onnx_model_dir, onnx_model_path
+    check_backend(backend)
+    results = []
+    if step == 'export':
+        if not os.path.exists(onnx_model_path(sbert_model_name, 'onnx')):
+            timed(results, encoder_sample, 'export_onnx', 1, export_onnx, sbert_model_name, onnx_model_dir(sbert_model_name))
+        if backend == 'onnx-int8' and not os.path.exists(onnx_model_path(sbert_model_name, backend)):
+            timed(results, encoder_sample, 'quantize_onnx_int8', 1, quantize_onnx, onnx_model_dir(sbert_model_name))
+    else:
+        captions = make_captions(encoder_sample, random.Random(seed))
+        texts = list(dict.fromkeys(c for clip in captions.values() for c in clip["audio_captions"]))
+        # ONNX models were exported by an earlier step, so this times the session load alone
+        timed(results, encoder_sample, f'load_encoder_{backend}', 1, get_sbert_model, backend=backend)
+        timed(results, encoder_sample, f'encode_{backend}', len(texts), get_encoding_scheduler(backend=backend).encode, texts)
+    for row in results:
+        row['backend'] = backend
+        row['peak_memory_mb'] = peak_memory_mb()
+    return results
+
+
+def stream_step(size, workdir):
+    """Result row of stream_evaluate over the inputs run_stream wrote for size, run in this process.
+
+    traced_peak_mb is the tracemalloc peak of stream_evaluate alone; the loaded predictions and ground
+    truth are not counted, so it should not grow with the corpus.
+    """
+    import tracemalloc
+    from instrumentation import peak_memory_mb
+    from embedding_store import EmbeddingStore
+    from phrase_cache import BoundedPhraseCache
+    from streaming_pipeline import stream_evaluate
+    predictions = load_predictions(os.path.join(workdir, f'stream_{size}.csv'), list(load_label_vocabulary(
+        os.path.join(repo_dir, 'audioset_ontology.json'))))
+    with open(os.path.join(workdir, f'stream_{size}_ground_truth.json'), 'r') as f:
+        ground_truth = json.load(f)
+    phrase_cache = BoundedPhraseCache(StubNlp, max_clips=stream_cached_clips)
+    store = EmbeddingStore(f'benchmark-stream-{size}', disk_index=True)
+
+    results = []
+    tracemalloc.start()
+    timed(results, size, 'stream_evaluate', size, stream_evaluate, os.path.join(workdir, f'stream_{size}.json'),
+          predictions, ground_truth, phrase_cache, lambda texts: store.get_or_encode(texts, stub_encode),
+          alpha_values, confidence_thresholds, caption_similarity_thresholds,
+          output_path=os.path.join(workdir, f'stream_{size}_clips.jsonl'))
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    for row in results:
+        row['traced_peak_mb'] = traced_peak / 2 ** 20
+        row['peak_memory_mb'] = peak_memory_mb()
+    return results
+
+
+def run_stream(results, sizes, vocab, workdir):
+    """stream_evaluate with stubs at every size, each in a fresh process so peak memory is its own."""
+    for size in sizes:
+        rng = random.Random(seed + size)
+        captions_data = make_unique_captions(size, rng)
+        clip_ids = list(captions_data)
+        with open(os.path.join(workdir, f'stream_{size}.json'), 'w') as f:
+            json.dump(captions_data, f)
+        write_predictions_csv(os.path.join(workdir, f'stream_{size}.csv'), clip_ids, vocab, rng)
+        with open(os.path.join(workdir, f'stream_{size}_ground_truth.json'), 'w') as f:
+            json.dump(make_ground_truth(clip_ids, vocab, rng), f)
+        del captions_data, clip_ids
+        step_path = os.path.join(workdir, f'stream_{size}_rows.json')
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--stream-step', str(size), workdir,
+                        '--output', step_path], check=True)
+        with open(step_path, 'r') as f:
+            results.extend(json.load(f))
+
+
+def run_encoders(results, backends):
+    """Time every backend step in its own process, so no backend finds torch or a model already loaded.
+
+    The processes inherit the working directory, so exports land in the scratch ./cache.
+    """
+    for backend in backends:
+        for step in (['run'] if backend == 'torch' else ['export', 'run']):
+            with tempfile.TemporaryDirectory() as step_dir:
+                step_path = os.path.join(step_dir, 'rows.json')
+                subprocess.run([sys.executable, os.path.abspath(__file__), '--encoder-step', backend, step,
+                                '--output', step_path], check=True)
+                with open(step_path, 'r') as f:
+                    results.extend(json.load(f))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seeded benchmarks for every pipeline stage")
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes)
+    parser.add_argument('--real-models', action='store_true', help="use SBERT, spaCy and PANNs instead of stubs")
+    parser.add_argument('--encoder-backends', nargs='+', default=['torch'],
+                        help="sentence encoder backends timed with --real-models: torch, onnx, onnx-int8")
+    parser.add_argument('--encoder-step', nargs=2, metavar=('BACKEND', 'STEP'), help=argparse.SUPPRESS)
+    parser.add_argument('--stream-sizes', type=int, nargs='*', default=stream_sizes,
+                        help="corpus sizes of the streaming memory check, none to skip it")
+    parser.add_argument('--stream-step', nargs=2, metavar=('SIZE', 'WORKDIR'), help=argparse.SUPPRESS)
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args()
+    output_path = os.path.abspath(args.output)
+
+    if args.encoder_step:
+        # Child process of run_encoders: one step of one backend, rows written to --output
+        with open(output_path, 'w') as f:
+            json.dump(encoder_step(*args.encoder_step), f)
+        sys.exit(0)
+    if args.stream_step:
+        # Child process of run_stream, inside its scratch directory
+        os.chdir(args.stream_step[1])
+        with open(output_path, 'w') as f:
+            json.dump(stream_step(int(args.stream_step[0]), args.stream_step[1]), f)
+        sys.exit(0)
+
+    vocab = load_label_vocabulary(os.path.join(repo_dir, 'audioset_ontology.json'))
+    if args.real_models:
+        from models import sbert_encoder, get_nlp
+        encode_fn, nlp, tagger = sbert_encoder(), get_nlp(), audio_tagging.get_audio_tagger()
+    else:
+        encode_fn, nlp, tagger = stub_encode, StubNlp(), StubTagger()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        # Every ./cache path resolves inside the scratch directory, so runs start cold and never touch real caches
+        os.chdir(workdir)
+        for size in args.sizes:
+            run_size(size, results, encode_fn, nlp, vocab, workdir, args.real_models)
+        run_audio(results, tagger)
+        run_stream(results, args.stream_sizes, vocab, workdir)
+        if args.real_models:
+            run_encoders(results, args.encoder_backends)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'seed': seed,
+            'sizes': args.sizes,
+            'stream_sizes': args.stream_sizes,
+            'real_models': args.real_models,
+            'encoder_backends': args.encoder_backends if args.real_models else [],
+        },
+        'results': results,
+    }
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"\nResults written to {output_path}")
@@ -1,12 +1,15 @@
 import os
+import sys
 import json
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
-from sentence_transformers import SentenceTransformer, util
-import spacy
 from collections import defaultdict
+from batch_boost import cosine_similarity_matrix
+from predictions_loader import load_predictions, clip_tags
+from multihot_metrics import load_ground_truth
+from models import sbert_encoder, get_embedding_store, get_phrase_cache, set_cache_only, set_encoder_backend
 
 # === Paths ===
 json_file_path = './data/val_captions.json'
@@ -16,41 +19,44 @@ csv_predictions_path = './MTURK/mturk_audio_tags_dynamic.csv'
 boost_alpha = 0.5
 semantic_similarity_threshold = 0.5
 
-# === Models ===
-sbert_model = SentenceTransformer('all-MiniLM-L6-v2', device='cpu')
-nlp = spacy.load('en_core_web_trf')
+# === Models (loaded on first use) ===
+sbert_model_name = 'all-MiniLM-L6-v2'
+spacy_model_name = 'en_core_web_trf'
 embedding_cache = {}
+encode_texts = sbert_encoder(sbert_model_name)
 
 # === Load Data ===
-with open(json_file_path, 'r') as f:
-    captions_data = json.load(f)
-
-predictions_df = pd.read_csv(csv_predictions_path)
-predictions_df.set_index('filename', inplace=True)
-
-# === Dummy ground truth for illustration ===
-ground_truth_tags_dict = {
-    "5265004457.wav": ['Conversation', 'Female speech, woman speaking', 'Male speech, man speaking', 'Speech'],
-}
+def load_data():
+    with open(json_file_path, 'r') as f:
+        captions_data = json.load(f)
+    predictions = load_predictions(csv_predictions_path)
+    return captions_data, predictions
 
 # === Embedding Cache ===
 def get_embedding_with_cache(text):
     if text in embedding_cache:
         return embedding_cache[text]
-    embedding = sbert_model.encode([text], show_progress_bar=False)
+    embedding = get_embedding_store(sbert_model_name).get_or_encode([text], encode_texts)
     embedding_cache[text] = embedding
     return embedding
 
+def prefetch_embeddings(texts):
+    # Encodes every uncached text in one scheduled call instead of one call per text
+    missing = [text for text in texts if text not in embedding_cache]
+    if missing:
+        get_embedding_store(sbert_model_name).encode_missing(missing, encode_texts)
+
 # === Similarity Computation ===
 def compute_similarity(text1, text2):
     emb1 = get_embedding_with_cache(text1)
     emb2 = get_embedding_with_cache(text2)
-    return float(util.cos_sim(emb1, emb2)[0][0])
+    return float(cosine_similarity_matrix(emb1, emb2)[0][0])
 
 # === Confidence Boosting (No threshold logic) ===
 def boost_confidence_ratio(audio_tags, caption_elements, audio_captions, alpha=0.1, caption_similarity_threshold=0.3):
     num_captions = len(audio_captions)
     results = {}
+    prefetch_embeddings(list(caption_elements) + [tag for tag, _ in audio_tags])
     for tag, audio_conf in audio_tags:
         match_count = sum(1 for word in caption_elements if compute_similarity(word, tag) > caption_similarity_threshold)
         match_ratio = min(1, match_count / num_captions) if num_captions > 0 else 0
@@ -64,58 +70,8 @@ def boost_confidence_ratio(audio_tags, caption_elements, audio_captions, alpha=0
 
 # === Phrase Extraction ===
 def extract_caption_phrases(audio_captions):
-    unique_phrases = set()
-    used_token_idxs = set()
-    for caption in audio_captions:
-        doc = nlp(caption)
-
-        # SVO Triplets
-        for token in doc:
-            if token.pos_ == "VERB":
-                subj = [child for child in token.children if child.dep_ in ("nsubj", "nsubjpass")]
-                obj = [child for child in token.children if child.dep_ in ("dobj", "attr", "prep", "pobj")]
-                if subj and obj:
-                    all_tokens = subj + [token] + obj
-                elif subj:
-                    all_tokens = subj + [token]
-                elif obj:
-                    all_tokens = [token] + obj
-                else:
-                    continue
-
-                token_idxs = {t.i for t in all_tokens}
-                if not token_idxs & used_token_idxs:
-                    phrase = " ".join(
-                        t.text.lower() for t in all_tokens
-                        if not t.is_stop and not t.is_punct
-                    ).strip()
-                    if phrase:
-                        unique_phrases.add(phrase)
-                        used_token_idxs.update(token_idxs)
-
-        # Noun chunks
-        for chunk in doc.noun_chunks:
-            token_idxs = {t.i for t in chunk}
-            if not token_idxs & used_token_idxs:
-                phrase = " ".join(
-                    t.text.lower() for t in chunk
-                    if not t.is_stop and not t.is_punct
-                ).strip()
-                if phrase:
-                    unique_phrases.add(phrase)
-                    used_token_idxs.update(token_idxs)
-
-        # Compound nouns
-        for token in doc:
-            if token.dep_ == "compound" and token.head.pos_ == "NOUN":
-                token_idxs = {token.i, token.head.i}
-                if not token_idxs & used_token_idxs:
-                    if not token.is_stop and not token.is_punct and not token.head.is_stop and not token.head.is_punct:
-                        phrase = f"{token.text.lower()} {token.head.text.lower()}".strip()
-                        unique_phrases.add(phrase)
-                        used_token_idxs.update(token_idxs)
-
-    return list(unique_phrases)
+    # One used-token set across all captions, as before
+    return get_phrase_cache(spacy_model_name, shared_token_idxs=True).extract([audio_captions])[0]
 
 # === Plotting (no threshold markers) ===
 def plot_boosting_results(results, file_name, alpha, caption_words, ground_truth, sim_threshold):
@@ -151,13 +107,21 @@ def plot_boosting_results(results, file_name, alpha, caption_words, ground_truth
 
 # === Main Clipwise Analysis ===
 if __name__ == "__main__":
+    if "--from-cache" in sys.argv:
+        set_cache_only(True)
+    for arg in sys.argv:
+        if arg.startswith("--encoder-backend="):
+            set_encoder_backend(arg.split("=", 1)[1])
+    captions_data, predictions = load_data()
+    ground_truth_tags_dict = load_ground_truth()
+
     target_files = [
         "5265004457.wav",
     ]
     
     for file_name in target_files:
         file_id = file_name.replace(".wav", "")
-        if file_id not in captions_data or file_name not in predictions_df.index:
+        if file_id not in captions_data or file_name not in predictions.row_index:
             print(f"Missing data for {file_name}")
             continue
 
@@ -166,13 +130,7 @@ if __name__ == "__main__":
         print(f"audio_captions: {audio_captions}")
         print(f"caption_phrases: {caption_phrases}")
 
-        row = predictions_df.loc[file_name]
-        audio_tags = []
-        for i in range(1, 11):  # tag1 to tag10
-            tag = row.get(f'tag{i}')
-            prob = row.get(f'tag{i}prob')
-            if isinstance(tag, str) and pd.notna(prob):
-                audio_tags.append((tag, float(prob)))
+        audio_tags = clip_tags(predictions, file_name)
 
         boosted_results = boost_confidence_ratio(audio_tags, caption_phrases, audio_captions, alpha=boost_alpha, caption_similarity_threshold=semantic_similarity_threshold)
 
@@ -0,0 +1,231 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from batch_boost import tag_clip_index, match_ratios
+from grid_search import ground_truth_arrays, macro_rows
+from multihot_metrics import prf_from_counts
+
+# === Paths ===
+clip_results_dir = './results/val_4.1'
+
+# === Parameters ===
+columnar_format = 'parquet'  # or 'arrow' for Arrow IPC files
+partition_columns = ('alpha', 'caption_sim_thresh')
+grid_file = '_grid.json'  # grid, clip count and format of a dataset; ignored by dataset readers
+
+_suffixes = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+
+def require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Columnar output (--columnar) needs pyarrow, which is optional: pip install pyarrow") from None
+    return pyarrow
+
+
+def selected_column(conf_thresh):
+    return f'selected@{conf_thresh}'
+
+
+# === Records ===
+def chunk_columns(chunk, alpha_values, confidence_thresholds, caption_similarity_thresholds):
+    """((alpha, caption_sim_thresh), columns) for every grid point of a ChunkResult.
+
+    One record per clip and tag: original and boosted confidence, matching phrases and match
+    ratio, whether the tag is selected at each confidence threshold, and the ground truth counts
+    that the metrics are re-aggregated from.
+    """
+    batch = chunk.batch
+    tag_clip = tag_clip_index(batch)
+    gt_multiplicity, gt_counts = ground_truth_arrays(batch, chunk.ground_truth_lists)
+    tag_num_captions = batch.num_captions[tag_clip]
+    shared = {
+        'clip': np.asarray(batch.clip_ids, dtype=object)[tag_clip],
+        'tag': np.asarray(batch.tag_vocab, dtype=object)[batch.tag_ids],
+        'original': np.asarray(batch.tag_confs, dtype=np.float64),
+        'num_captions': tag_num_captions.astype(np.int64),
+        'gt_multiplicity': gt_multiplicity,  # occurrences of the tag in its clip's ground truth
+        'gt_count': gt_counts[tag_clip],  # ground truth length of the clip
+    }
+    for a, alpha in enumerate(alpha_values):
+        for s, cap_sim_thresh in enumerate(caption_similarity_thresholds):
+            boosted = chunk.boosted[a, s]
+            columns = dict(shared)
+            columns['boosted'] = boosted
+            columns['matches'] = chunk.matches[s].astype(np.int64)
+            columns['match_ratio'] = match_ratios(chunk.matches[s], tag_num_captions)
+            for conf_thresh in confidence_thresholds:
+                columns[selected_column(conf_thresh)] = boosted >= conf_thresh
+            yield (alpha, cap_sim_thresh), columns
+
+
+def record_schema(confidence_thresholds):
+    pa = require_pyarrow()
+    return pa.schema(
+        [('clip', pa.string()), ('tag', pa.string()), ('original', pa.float64()), ('num_captions', pa.int64()),
+         ('gt_multiplicity', pa.int64()), ('gt_count', pa.int64()), ('boosted', pa.float64()),
+         ('matches', pa.int64()), ('match_ratio', pa.float64())]
+        + [(selected_column(conf_thresh), pa.bool_()) for conf_thresh in confidence_thresholds]
+    )
+
+
+class ClipResultsWriter:
+    """Per-clip, per-tag records in a dataset partitioned by alpha and caption_sim_thresh.
+
+    Every partition (hive style, alpha=0.3/caption_sim_thresh=0.5) is one file and every chunk is
+    appended to it as a row group, so only the chunk being written is held in memory. An existing
+    dataset at root is replaced.
+    """
+
+    def __init__(self, alpha_values, confidence_thresholds, caption_similarity_thresholds, root=clip_results_dir,
+                 fmt=columnar_format):
+        if fmt not in _suffixes:
+            raise ValueError(f"Unknown columnar format {fmt!r}, expected one of {tuple(_suffixes)}")
+        self.pa = require_pyarrow()
+        self.alpha_values = list(alpha_values)
+        self.confidence_thresholds = list(confidence_thresholds)
+        self.caption_similarity_thresholds = list(caption_similarity_thresholds)
+        self.root = root
+        self.fmt = fmt
+        self.schema = record_schema(self.confidence_thresholds)
+        self.writers = {}
+        self.num_clips = 0
+        if os.path.exists(os.path.join(root, grid_file)):
+            shutil.rmtree(root)
+        os.makedirs(root, exist_ok=True)
+
+    def _writer(self, alpha, cap_sim_thresh):
+        key = (alpha, cap_sim_thresh)
+        if key not in self.writers:
+            # partition_value gives the float64 that readers parse back from these names
+            directory = os.path.join(self.root, f'alpha={alpha}', f'caption_sim_thresh={cap_sim_thresh}')
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'part-0.{_suffixes[self.fmt]}')
+            if self.fmt == 'parquet':
+                import pyarrow.parquet as pq
+                self.writers[key] = pq.ParquetWriter(path, self.schema)
+            else:
+                self.writers[key] = self.pa.ipc.new_file(path, self.schema)
+        return self.writers[key]
+
+    def write_chunk(self, chunk):
+        for (alpha, cap_sim_thresh), columns in chunk_columns(
+                chunk, self.alpha_values, self.confidence_thresholds, self.caption_similarity_thresholds):
+            self._writer(alpha, cap_sim_thresh).write_table(self.pa.table(columns, schema=self.schema))
+        self.num_clips += len(chunk.batch.clip_ids)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+        with open(os.path.join(self.root, grid_file), 'w') as f:
+            json.dump({
+                'format': self.fmt,
+                'num_clips': self.num_clips,
+                'grid': {
+                    'alpha': self.alpha_values,
+                    'conf_thresh': self.confidence_thresholds,
+                    'caption_sim_thresh': self.caption_similarity_thresholds,
+                },
+            }, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# === Queries ===
+def open_clip_results(root=clip_results_dir):
+    """(pyarrow dataset, grid metadata) of a dataset written by ClipResultsWriter."""
+    pa = require_pyarrow()
+    import pyarrow.dataset as ds
+    with open(os.path.join(root, grid_file), 'r') as f:
+        meta = json.load(f)
+    partitioning = ds.partitioning(pa.schema([(name, pa.float64()) for name in partition_columns]), flavor='hive')
+    dataset = ds.dataset(root, format='parquet' if meta['format'] == 'parquet' else 'ipc', partitioning=partitioning)
+    return dataset, meta
+
+
+def read_clip_results(root=clip_results_dir, columns=None, filter=None):
+    """Records as a DataFrame, reading only the given columns and the partitions that match filter.
+
+    e.g. read_clip_results(columns=['clip', 'tag', 'boosted'], filter=pyarrow.dataset.field('alpha') == 0.5)
+    """
+    dataset, _ = open_clip_results(root)
+    return dataset.to_table(columns=columns, filter=filter).to_pandas()
+
+
+def partition_value(value):
+    """A grid value as read back from its hive directory name: the float64 parsed from f'{value}'.
+
+    Grid values that only compare equal after the round trip (float32 values, ints) still find
+    their partition.
+    """
+    return float(f'{value}')
+
+
+def grid_rows_from_records(records, alpha_values, confidence_thresholds, caption_similarity_thresholds, num_clips):
+    """grid_search rows from per-clip, per-tag records (partition, clip, ground truth and selected@ columns)."""
+    hits = records['gt_multiplicity'].to_numpy() > 0
+    # Both sides normalized, the grid like the directory names it was written under
+    grid_points = pd.MultiIndex.from_product([[partition_value(alpha) for alpha in alpha_values],
+                                              [partition_value(sim) for sim in caption_similarity_thresholds]])
+    partitions = {name: records[name].to_numpy(dtype=np.float64) for name in partition_columns}
+    macro = np.zeros((3, len(alpha_values), len(confidence_thresholds), len(caption_similarity_thresholds)))
+    for k, conf_thresh in enumerate(confidence_thresholds):
+        selected = records[selected_column(conf_thresh)].to_numpy()
+        per_clip = pd.DataFrame({
+            'alpha': partitions['alpha'],
+            'caption_sim_thresh': partitions['caption_sim_thresh'],
+            'clip': records['clip'],
+            'tp': selected & hits,
+            'fp': selected & ~hits,
+            'credited': selected * records['gt_multiplicity'].to_numpy(),
+            'gt_count': records['gt_count'],
+        }).groupby(['alpha', 'caption_sim_thresh', 'clip'], sort=False).agg(
+            tp=('tp', 'sum'), fp=('fp', 'sum'), credited=('credited', 'sum'), gt_count=('gt_count', 'first'))
+        precision, recall, f1 = prf_from_counts(
+            per_clip['tp'].to_numpy(), per_clip['fp'].to_numpy(), (per_clip['gt_count'] - per_clip['credited']).to_numpy())
+        # Clips without any tag score 0 and only count in the denominator
+        sums = pd.DataFrame({'precision': precision, 'recall': recall, 'f1': f1}, index=per_clip.index) \
+            .groupby(level=['alpha', 'caption_sim_thresh']).sum()
+        unknown = sums.index.difference(grid_points)
+        if len(unknown):
+            raise ValueError(f"Records for grid points outside the grid, e.g. {unknown[0]}")
+        sums = sums.reindex(grid_points, fill_value=0.0)
+        macro[:, :, k, :] = sums.to_numpy().T.reshape(3, len(alpha_values), len(caption_similarity_thresholds)) / num_clips
+    return macro_rows(macro, alpha_values, confidence_thresholds, caption_similarity_thresholds)
+
+
+def aggregate_grid(root=clip_results_dir, confidence_thresholds=None):
+    """grid_search rows re-aggregated from a stored dataset, reading only the columns the counts need.
+
+    confidence_thresholds defaults to every selected@ column that was written.
+    """
+    dataset, meta = open_clip_results(root)
+    confidence_thresholds = list(confidence_thresholds or meta['grid']['conf_thresh'])
+    columns = list(partition_columns) + ['clip', 'gt_multiplicity', 'gt_count'] \
+        + [selected_column(conf_thresh) for conf_thresh in confidence_thresholds]
+    records = dataset.to_table(columns=columns).to_pandas()
+    return grid_rows_from_records(records, meta['grid']['alpha'], confidence_thresholds,
+                                  meta['grid']['caption_sim_thresh'], meta['num_clips'])
+
+
+# === Sweep Summaries ===
+def sweep_curve_columns(curves):
+    """Long-format columns of optimize_thresholds curves: one row per (alpha, caption_sim_thresh, cutoff)."""
+    keys = list(curves)
+    lengths = [len(curves[key]['threshold']) for key in keys]
+    columns = {
+        'alpha': np.repeat([alpha for alpha, _ in keys], lengths).astype(np.float64),
+        'caption_sim_thresh': np.repeat([sim for _, sim in keys], lengths).astype(np.float64),
+    }
+    metric_names = list(curves[keys[0]]) if keys else []
+    for name in metric_names:
+        columns[name] = np.concatenate([curves[key][name] for key in keys])
+    return columns
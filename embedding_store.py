@@ -0,0 +1,343 @@
+import os
+import json
+import hashlib
+import sqlite3
+import numpy as np
+from collections import OrderedDict
+from instrumentation import recorder
+from quantized_embeddings import QuantizedEmbeddings, quantize, dtype_suffixes
+
+try:
+    import fcntl
+except ImportError:  # no advisory locks on Windows, single-process use only
+    fcntl = None
+
+# === Paths ===
+embedding_store_dir = './cache/embeddings'
+
+# === Parameters ===
+max_cached_texts = 50000  # texts whose embeddings a BoundedEmbeddingCache keeps in memory
+
+
+# === Store Key ===
+def store_key(model_name, normalize_embeddings=False, dtype='float32'):
+    """Directory name for a model + normalization setting, so different encoders never share rows."""
+    settings = json.dumps({'model': model_name, 'normalize': bool(normalize_embeddings), 'dtype': dtype}, sort_keys=True)
+    digest = hashlib.sha1(settings.encode('utf-8')).hexdigest()[:12]
+    return f"{model_name.replace('/', '_')}-{digest}"
+
+
+class StoreLock:
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+
+    def __enter__(self):
+        self.handle = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+        self.handle.close()
+
+
+# === Text Index ===
+class SqliteTextIndex:
+    """text -> row lookup kept in index.sqlite next to index.jsonl, for processes that must not hold the
+    whole index in memory. index.jsonl stays the source of truth; sync() copies the lines past the last
+    synced offset, so an index can always be rebuilt by deleting index.sqlite.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=60)
+        self.db.execute('CREATE TABLE IF NOT EXISTS texts (text TEXT PRIMARY KEY, row INTEGER) WITHOUT ROWID')
+        self.db.execute('CREATE TABLE IF NOT EXISTS progress (offset INTEGER, rows INTEGER)')
+        self.db.execute('INSERT INTO progress SELECT 0, 0 WHERE NOT EXISTS (SELECT 1 FROM progress)')
+
+    def __contains__(self, text):
+        return self.get(text) is not None
+
+    def get(self, text, default=None):
+        found = self.db.execute('SELECT row FROM texts WHERE text = ?', (text,)).fetchone()
+        return default if found is None else found[0]
+
+    def sync(self, index_path, batch_lines=10000):
+        """Add the complete index.jsonl lines not synced yet, a batch at a time. Returns the number of rows."""
+        offset, rows = self.db.execute('SELECT offset, rows FROM progress').fetchone()
+        if os.path.getsize(index_path) == offset:
+            return rows
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            # Re-read under the write lock, another process may have synced in between
+            offset, rows = self.db.execute('SELECT offset, rows FROM progress').fetchone()
+            with open(index_path, 'rb') as f:
+                f.seek(offset)
+                pending = []
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # a partially written last line
+                    # The first occurrence of a text keeps its row, like the in-memory index
+                    pending.append((json.loads(line), rows))
+                    rows += 1
+                    offset += len(line)
+                    if len(pending) >= batch_lines:
+                        self.db.executemany('INSERT OR IGNORE INTO texts VALUES (?, ?)', pending)
+                        pending = []
+                self.db.executemany('INSERT OR IGNORE INTO texts VALUES (?, ?)', pending)
+            self.db.execute('UPDATE progress SET offset = ?, rows = ?', (offset, rows))
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        return rows
+
+
+# === Embedding Store ===
+class EmbeddingStore:
+    """Append-only embedding matrix on disk, read through a memory map.
+
+    Layout of the store directory:
+        vectors.f32  raw float32 rows, one per text (vectors.f16 / vectors.i8 for the compact dtypes)
+        scales.f32   per-row scales, int8 stores only
+        index.jsonl  one JSON-encoded text per line, line number == row number
+        meta.json    model name, normalization flag, dtype and embedding dimension
+
+    Writers take an exclusive lock, write the vectors first and only then the
+    index lines, so a reader never sees an index entry without its vector.
+
+    With disk_index the text -> row lookup lives in index.sqlite (SqliteTextIndex) instead of a dict,
+    so memory stays flat however many texts the store holds; lookups cost a query per text.
+    """
+
+    def __init__(self, model_name, normalize_embeddings=False, root=embedding_store_dir, dtype='float32',
+                 disk_index=False):
+        self.model_name = model_name
+        self.normalize_embeddings = normalize_embeddings
+        self.dtype = dtype
+        self.path = os.path.join(root, store_key(model_name, normalize_embeddings, dtype))
+        os.makedirs(self.path, exist_ok=True)
+        self.vectors_path = os.path.join(self.path, f'vectors.{dtype_suffixes[dtype]}')
+        self.scales_path = os.path.join(self.path, 'scales.f32')
+        self.index_path = os.path.join(self.path, 'index.jsonl')
+        self.meta_path = os.path.join(self.path, 'meta.json')
+        self.lock_path = os.path.join(self.path, 'lock')
+
+        self.dim = None
+        self.disk_index = disk_index
+        self.index = SqliteTextIndex(os.path.join(self.path, 'index.sqlite')) if disk_index else {}
+        self.num_rows = 0
+        self._index_offset = 0
+        self._matrix = None
+        self._scales = None
+        self.refresh()
+
+    def __len__(self):
+        return self.num_rows
+
+    def __contains__(self, text):
+        return text in self.index
+
+    def _read_meta(self):
+        if self.dim is None and os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                self.dim = json.load(f)['dim']
+
+    def refresh(self):
+        """Pick up rows appended by other processes since the last read."""
+        self._read_meta()
+        if not os.path.exists(self.index_path):
+            return
+        if self.disk_index:
+            self.num_rows = self.index.sync(self.index_path)
+            return
+        with open(self.index_path, 'rb') as f:
+            f.seek(self._index_offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1  # ignore a partially written last line
+        for line in data[:end].splitlines():
+            self.index.setdefault(json.loads(line), self.num_rows)
+            self.num_rows += 1
+        self._index_offset += end
+
+    @property
+    def matrix(self):
+        """Read-only (num_rows, dim) memmap over the stored vectors, in the store dtype."""
+        if self.num_rows == 0:
+            return np.zeros((0, self.dim or 0), dtype=self.dtype)
+        if self._matrix is None or self._matrix.shape[0] != self.num_rows:
+            self._matrix = np.memmap(self.vectors_path, dtype=self.dtype, mode='r', shape=(self.num_rows, self.dim))
+        return self._matrix
+
+    @property
+    def scales(self):
+        if self.dtype != 'int8':
+            return np.ones(self.num_rows, dtype=np.float32)
+        if self._scales is None or self._scales.shape[0] != self.num_rows:
+            self._scales = np.memmap(self.scales_path, dtype=np.float32, mode='r', shape=(self.num_rows,))
+        return self._scales
+
+    def rows(self, texts):
+        return np.array([self.index.get(text, -1) for text in texts], dtype=np.int64)
+
+    def get(self, text):
+        row = self.index.get(text)
+        if row is None:
+            return None
+        return self.get_many([text])
+
+    def _existing_rows(self, texts):
+        rows = self.rows(texts)
+        if (rows < 0).any():
+            missing = [t for t, r in zip(texts, rows) if r < 0]
+            raise KeyError(f"{len(missing)} texts not in embedding store, e.g. {missing[0]!r}")
+        return rows
+
+    def get_many(self, texts):
+        """float32 rows; compact stores are dequantized."""
+        rows = self._existing_rows(texts)
+        if self.dtype == 'float32':
+            return np.asarray(self.matrix[rows])
+        return np.asarray(self.matrix[rows], dtype=np.float32) * np.asarray(self.scales[rows])[:, None]
+
+    def get_compact(self, texts):
+        """Rows in the store dtype as QuantizedEmbeddings, for the reduced-precision cosine kernel."""
+        if not len(texts):
+            return QuantizedEmbeddings(np.zeros((0, self.dim or 0), dtype=self.dtype))
+        rows = self._existing_rows(texts)
+        return QuantizedEmbeddings(np.asarray(self.matrix[rows]), np.asarray(self.scales[rows]))
+
+    def add(self, texts, vectors):
+        """Append vectors for texts that are not stored yet. Returns the number of new rows."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+        with StoreLock(self.lock_path):
+            self.refresh()
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self.meta_path, 'w') as f:
+                    json.dump({'model': self.model_name, 'normalize': bool(self.normalize_embeddings),
+                               'dtype': self.dtype, 'dim': self.dim}, f)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dim {vectors.shape[1]} does not match store dim {self.dim}")
+
+            new_texts, new_rows, seen = [], [], set()
+            for i, text in enumerate(texts):
+                if text not in self.index and text not in seen:
+                    seen.add(text)
+                    new_texts.append(text)
+                    new_rows.append(i)
+            if not new_texts:
+                return 0
+
+            # Vectors first; truncating drops rows left behind by a writer that died before its index write
+            data, scales = quantize(vectors[new_rows], self.dtype)
+            files = [(self.vectors_path, data, self.dim * data.itemsize)]
+            if self.dtype == 'int8':
+                files.append((self.scales_path, scales, scales.itemsize))
+            for path, values, row_bytes in files:
+                mode = 'r+b' if os.path.exists(path) else 'wb'
+                with open(path, mode) as f:
+                    f.seek(self.num_rows * row_bytes)
+                    f.truncate()
+                    f.write(values.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            with open(self.index_path, 'ab') as f:
+                f.write(b''.join(json.dumps(t).encode('utf-8') + b'\n' for t in new_texts))
+                f.flush()
+                os.fsync(f.fileno())
+            self.refresh()
+        return len(new_texts)
+
+    def seed_from(self, source, batch_rows=50000):
+        """Append every row of source, a store of the same model in another dtype, quantized to this dtype.
+
+        Lets a new float16/int8 store start from the float32 vectors already encoded instead of
+        re-encoding them. Returns the number of new rows.
+        """
+        source.refresh()
+        added, start = 0, 0
+        if not source.num_rows:
+            return 0
+        with open(source.index_path, 'rb') as f:
+            while start < source.num_rows:
+                texts = [json.loads(f.readline()) for _ in range(min(batch_rows, source.num_rows - start))]
+                stop = start + len(texts)
+                vectors = np.asarray(source.matrix[start:stop], dtype=np.float32) * np.asarray(source.scales[start:stop])[:, None]
+                added += self.add(texts, vectors)
+                start = stop
+        return added
+
+    def encode_missing(self, texts, encode_fn):
+        """Encode only texts not in the store, in one encode_fn call. Returns the number encoded."""
+        unique = list(dict.fromkeys(texts))
+        missing = [t for t in unique if t not in self.index]
+        if missing:
+            self.refresh()
+            missing = [t for t in missing if t not in self.index]
+        recorder.count('embedding_store_hits', len(unique) - len(missing))
+        recorder.count('embedding_store_misses', len(missing))
+        if not missing:
+            return 0
+        self.add(missing, encode_fn(missing))
+        return len(missing)
+
+    def get_or_encode(self, texts, encode_fn, compact=False):
+        self.encode_missing(texts, encode_fn)
+        return self.get_compact(texts) if compact else self.get_many(texts)
+
+
+# === Bounded In-Memory Cache ===
+class BoundedEmbeddingCache:
+    """In-memory LRU of the float32 embeddings of the last max_texts distinct texts, for long-running processes.
+
+    Misses are read from store when it has them and encoded in one encode_fn call otherwise. New
+    vectors are appended to the store only with persist, so by default the store is read, never
+    grown. A store opened with disk_index keeps its text lookup off the heap as well.
+    """
+
+    def __init__(self, encode_fn, store=None, persist=False, max_texts=max_cached_texts):
+        self.encode_fn = encode_fn
+        self.store = store
+        self.persist = persist
+        self.max_texts = max_texts
+        self.vectors = OrderedDict()
+        self.dim = None
+
+    def get_or_encode(self, texts):
+        unique = list(dict.fromkeys(texts))
+        missing = []
+        for text in unique:
+            if text in self.vectors:
+                self.vectors.move_to_end(text)
+            else:
+                missing.append(text)
+        recorder.count('embedding_lru_hits', len(unique) - len(missing))
+        recorder.count('embedding_lru_misses', len(missing))
+
+        if missing:
+            found = {}
+            if self.store is not None:
+                self.store.refresh()
+                stored = [text for text, row in zip(missing, self.store.rows(missing)) if row >= 0]
+                # Copies, so an evicted row does not keep the whole lookup result alive
+                found.update((text, row.copy()) for text, row in zip(stored, self.store.get_many(stored)))
+            unseen = [text for text in missing if text not in found]
+            if unseen:
+                encoded = np.asarray(self.encode_fn(unseen), dtype=np.float32).reshape(len(unseen), -1)
+                found.update((text, row.copy()) for text, row in zip(unseen, encoded))
+                if self.persist and self.store is not None:
+                    self.store.add(unseen, encoded)
+            self.vectors.update((text, found[text]) for text in missing)
+            self.dim = len(found[missing[0]])
+
+        if texts:
+            results = np.stack([self.vectors[text] for text in texts])
+        else:
+            results = np.zeros((0, self.dim or 0), dtype=np.float32)
+        while len(self.vectors) > self.max_texts:
+            self.vectors.popitem(last=False)
+        return results
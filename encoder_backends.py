@@ -0,0 +1,182 @@
+import os
+import json
+import numpy as np
+
+# === Parameters ===
+encoder_backends = ('torch', 'onnx', 'onnx-int8')
+onnx_dir = './cache/onnx'
+onnx_opset = 14
+onnx_threads = 0  # ONNX Runtime intra-op threads, 0 lets it use every core
+
+_model_files = {'onnx': 'model.onnx', 'onnx-int8': 'model.int8.onnx'}
+
+
+def check_backend(backend):
+    if backend not in encoder_backends:
+        raise ValueError(f"Unknown encoder backend {backend!r}, expected one of {encoder_backends}")
+    return backend
+
+
+def backend_model_key(model_name, backend):
+    """Model name used for caches; the PyTorch backend keeps the plain name so existing stores stay valid."""
+    return model_name if check_backend(backend) == 'torch' else f"{model_name}@{backend}"
+
+
+def onnx_model_dir(model_name):
+    return os.path.join(onnx_dir, model_name.replace('/', '_'))
+
+
+def onnx_model_path(model_name, backend):
+    return os.path.join(onnx_model_dir(model_name), _model_files[backend])
+
+
+# === Export ===
+def export_onnx(model_name, directory):
+    """Export the transformer of a SentenceTransformer to ONNX, with its tokenizer and pooling settings.
+
+    Only the transformer runs in ONNX Runtime; pooling and normalization are a few numpy lines in
+    OnnxEncoder, so torch is needed only for the export.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    st_model = SentenceTransformer(model_name, device='cpu')
+    transformer, pooling = st_model[0], st_model[1]
+    tokenizer = transformer.tokenizer
+    dummy = tokenizer(["a dog barks in the distance"], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in dummy]
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    os.makedirs(directory, exist_ok=True)
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names + ['last_hidden_state']}
+    with torch.no_grad():
+        torch.onnx.export(LastHiddenState(transformer.auto_model).eval(), tuple(dummy[name] for name in input_names),
+                          os.path.join(directory, _model_files['onnx']), input_names=input_names,
+                          output_names=['last_hidden_state'], dynamic_axes=dynamic_axes, opset_version=onnx_opset)
+    tokenizer.save_pretrained(directory)
+
+    if pooling.pooling_mode_cls_token:
+        pooling_mode = 'cls'
+    elif pooling.pooling_mode_max_tokens:
+        pooling_mode = 'max'
+    else:
+        pooling_mode = 'mean'
+    with open(os.path.join(directory, 'encoder.json'), 'w') as f:
+        json.dump({
+            'model': model_name,
+            'pooling': pooling_mode,
+            'normalize': any(type(module).__name__ == 'Normalize' for module in st_model),
+            'max_seq_length': st_model.max_seq_length,
+        }, f)
+
+
+def quantize_onnx(directory):
+    """int8 dynamic quantization: weights stored as int8, activations quantized per batch at run time."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(os.path.join(directory, _model_files['onnx']), os.path.join(directory, _model_files['onnx-int8']),
+                     weight_type=QuantType.QInt8)
+
+
+# === ONNX Runtime Encoder ===
+def pool(hidden, attention_mask, mode='mean', normalize=False):
+    mask = attention_mask[..., None].astype(np.float32)
+    if mode == 'cls':
+        out = hidden[:, 0]
+    elif mode == 'max':
+        out = np.where(mask > 0, hidden, -np.inf).max(axis=1)
+    else:
+        out = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+    if normalize:
+        out = out / np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+    return out.astype(np.float32)
+
+
+class OnnxEncoder:
+    """encode(), tokenizer and max_seq_length like a SentenceTransformer, running the exported graph."""
+
+    def __init__(self, directory, backend='onnx'):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(directory, 'encoder.json'), 'r') as f:
+            settings = json.load(f)
+        self.pooling = settings['pooling']
+        self.normalize = settings['normalize']
+        self.max_seq_length = settings['max_seq_length']
+        self.tokenizer = AutoTokenizer.from_pretrained(directory)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = onnx_threads
+        self.session = ort.InferenceSession(os.path.join(directory, _model_files[backend]), options,
+                                            providers=['CPUExecutionProvider'])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False):
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer(list(texts[start:start + batch_size]), padding=True, truncation=True,
+                                     max_length=self.max_seq_length, return_tensors='np')
+            feeds = {name: np.asarray(encoded.get(name, np.zeros_like(encoded['input_ids'])), dtype=np.int64)
+                     for name in self.input_names}
+            hidden = self.session.run(None, feeds)[0]
+            outputs.append(pool(hidden, encoded['attention_mask'], self.pooling, self.normalize))
+        if not outputs:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(outputs)
+
+
+def load_encoder(model_name, backend):
+    """A SentenceTransformer for 'torch', otherwise an OnnxEncoder, exporting and quantizing on first use."""
+    if check_backend(backend) == 'torch':
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name, device='cpu')
+    directory = onnx_model_dir(model_name)
+    if not os.path.exists(onnx_model_path(model_name, 'onnx')):
+        export_onnx(model_name, directory)
+    if backend == 'onnx-int8' and not os.path.exists(onnx_model_path(model_name, 'onnx-int8')):
+        quantize_onnx(directory)
+    return OnnxEncoder(directory, backend)
+
+
+# === Parity Check ===
+def backend_parity(batch, ground_truth_lists, reference_embed, candidate_embed, alpha_values, confidence_thresholds,
+                   caption_similarity_thresholds):
+    """Compare embeddings and grid search results of two encoder backends on one batch.
+
+    Returns the mean and largest cosine drift (1 - cosine between both embeddings of a text), the
+    largest pair similarity difference, the largest macro F1 change over the grid and the best F1
+    reached by each backend.
+    """
+    from batch_boost import compute_pair_similarities
+    from grid_search import grid_search
+
+    texts = batch.tag_vocab + batch.phrase_vocab
+    reference = np.asarray(reference_embed(texts), dtype=np.float32)
+    candidate = np.asarray(candidate_embed(texts), dtype=np.float32)
+    norms = np.maximum(np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1), 1e-12)
+    drift = np.maximum(1 - (reference * candidate).sum(axis=1) / norms, 0)
+
+    reference_pairs = compute_pair_similarities(batch, lambda _: reference)
+    candidate_pairs = compute_pair_similarities(batch, lambda _: candidate)
+    grid = (alpha_values, confidence_thresholds, caption_similarity_thresholds)
+    reference_rows = grid_search(batch, ground_truth_lists, *grid, pair_similarities=reference_pairs)
+    candidate_rows = grid_search(batch, ground_truth_lists, *grid, pair_similarities=candidate_pairs)
+    best_reference = max((row['f1'] for row in reference_rows), default=0.0)
+    best_candidate = max((row['f1'] for row in candidate_rows), default=0.0)
+
+    return {
+        'texts': len(texts),
+        'mean_cosine_drift': float(drift.mean()) if len(drift) else 0.0,
+        'max_cosine_drift': float(drift.max()) if len(drift) else 0.0,
+        'max_similarity_diff': float(np.abs(reference_pairs[0] - candidate_pairs[0]).max()) if len(reference_pairs[0]) else 0.0,
+        'max_f1_delta': max((abs(c['f1'] - r['f1']) for r, c in zip(reference_rows, candidate_rows)), default=0.0),
+        'best_f1_reference': best_reference,
+        'best_f1_candidate': best_candidate,
+        'best_f1_delta': best_candidate - best_reference,
+    }
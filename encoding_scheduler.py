@@ -0,0 +1,114 @@
+import threading
+import numpy as np
+from instrumentation import recorder
+
+# === Parameters ===
+max_batch_tokens = 16384  # padded tokens (texts x bucket length) per encoder call
+max_batch_size = 512
+bucket_width = 8  # token lengths are rounded up to a multiple of this
+
+
+def approximate_token_lengths(texts):
+    """Word-piece count estimate for when no tokenizer is at hand: about 4/3 pieces per word plus [CLS]/[SEP]."""
+    return [len(text.split()) * 4 // 3 + 2 for text in texts]
+
+
+def plan_batches(lengths, max_tokens=max_batch_tokens, max_size=max_batch_size, width=bucket_width):
+    """Index arrays of the texts to encode together, shortest bucket first.
+
+    Texts are grouped by token length rounded up to width, so a batch pads every text by fewer than
+    width tokens. Each bucket is cut into batches of at most max_tokens padded tokens.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    padded = -(-np.maximum(lengths, 1) // width) * width
+    order = np.argsort(padded, kind='stable')
+    bucket_starts = np.r_[0, np.flatnonzero(np.diff(padded[order])) + 1, len(order)]
+    batches = []
+    for start, stop in zip(bucket_starts[:-1], bucket_starts[1:]):
+        per_batch = max(1, min(max_size, max_tokens // int(padded[order[start]])))
+        batches.extend(order[i:min(i + per_batch, stop)] for i in range(start, stop, per_batch))
+    return batches
+
+
+class EncodingTicket:
+    def __init__(self, texts):
+        self.texts = texts
+        self.vectors = None
+
+    @property
+    def done(self):
+        return self.vectors is not None
+
+
+# === Scheduler ===
+class EncodingScheduler:
+    """Collects texts from many callers and encodes each distinct text once, in length buckets.
+
+    submit() queues texts and returns a ticket; flush() encodes everything pending that is not in
+    the store yet, adds the new vectors to the store in one write and fills in every ticket. With
+    a single caller, encode() does both and can be used wherever an encode_fn is expected.
+
+    encode_batch(texts) must encode exactly the texts it is given; length_fn(texts) returns their
+    token counts, used only to plan the batches.
+    """
+
+    def __init__(self, encode_batch, length_fn=approximate_token_lengths, store=None,
+                 max_tokens=max_batch_tokens, max_size=max_batch_size, width=bucket_width):
+        self.encode_batch = encode_batch
+        self.length_fn = length_fn
+        self.store = store
+        self.max_tokens = max_tokens
+        self.max_size = max_size
+        self.width = width
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def submit(self, texts):
+        ticket = EncodingTicket(list(texts))
+        with self._lock:
+            self._pending.append(ticket)
+        return ticket
+
+    def _encode_unique(self, texts):
+        lengths = np.asarray(self.length_fn(texts), dtype=np.int64)
+        vectors = None
+        for rows in plan_batches(lengths, self.max_tokens, self.max_size, self.width):
+            recorder.observe('encoder_batch_size', len(rows))
+            recorder.observe('encoder_batch_tokens', len(rows) * int(lengths[rows].max()))
+            out = np.asarray(self.encode_batch([texts[i] for i in rows]), dtype=np.float32)
+            if vectors is None:
+                vectors = np.empty((len(texts), out.shape[1]), dtype=np.float32)
+            vectors[rows] = out
+        return vectors
+
+    def flush(self):
+        """Encode all pending texts. Returns the number of texts that went through the encoder."""
+        with self._lock:
+            tickets, self._pending = self._pending, []
+            unique = list(dict.fromkeys(text for ticket in tickets for text in ticket.texts))
+            if self.store is not None:
+                self.store.refresh()
+                new = [text for text in unique if text not in self.store]
+            else:
+                new = unique
+            vectors = self._encode_unique(new) if new else None
+
+            if self.store is not None:
+                if new:
+                    self.store.add(new, vectors)
+                for ticket in tickets:
+                    ticket.vectors = self.store.get_many(ticket.texts)
+            else:
+                rows = {text: i for i, text in enumerate(new)}
+                dim = vectors.shape[1] if vectors is not None else 0
+                for ticket in tickets:
+                    if ticket.texts:
+                        ticket.vectors = vectors[[rows[text] for text in ticket.texts]]
+                    else:
+                        ticket.vectors = np.zeros((0, dim), dtype=np.float32)
+            return len(new)
+
+    def encode(self, texts):
+        ticket = self.submit(texts)
+        self.flush()
+        return ticket.vectors
@@ -1,21 +1,131 @@
 import os
-from moviepy.editor import VideoFileClip
+import sys
+import json
+import time
+import hashlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from audio_tagging import sr as target_sr
 
 video_folder = "./data/test_videos"
 output_folder = "./data/audio_output"
 
-for filename in os.listdir(video_folder):
-    if filename.endswith(".mp4"):
-        video_path = os.path.join(video_folder, filename)
-        
-        # Define output audio path (replace .mp4 with .wav)
-        audio_filename = os.path.splitext(filename)[0] + ".wav"
-        audio_path = os.path.join(output_folder, audio_filename)
-
-        # Extract audio
-        print(f"Processing {filename}...")
-        clip = VideoFileClip(video_path)
-        clip.audio.write_audiofile(audio_path)
-        clip.close()
-
-        print(f"Audio saved to {audio_path}")
\ No newline at end of file
+# === Parameters ===
+num_workers = os.cpu_count() or 4  # each worker drives one ffmpeg process
+target_channels = 1  # tagger input is mono
+skip_mode = "mtime"  # "mtime", "hash" (re-hashed only when size or mtime changed) or "none"
+manifest_name = ".export_manifest.json"
+
+
+def get_ffmpeg():
+    # moviepy ships ffmpeg through imageio-ffmpeg
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except ImportError:
+        return "ffmpeg"
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_stat(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def export_settings():
+    return f"{target_sr}Hz-{target_channels}ch-pcm_s16le"
+
+
+def is_up_to_date(video_path, audio_path, manifest, filename):
+    if skip_mode == "none" or not os.path.exists(audio_path):
+        return False
+    # A WAV without a manifest entry, or from other settings (e.g. the old 44.1 kHz stereo export), is redone
+    entry = manifest.get(filename, {})
+    if entry.get('settings') != export_settings():
+        return False
+    if skip_mode == "hash":
+        if 'sha1' not in entry:
+            return False
+        # The video is only re-hashed when its size or mtime changed since the sha1 was recorded
+        stat = file_stat(video_path)
+        if all(entry.get(key) == value for key, value in stat.items()):
+            return True
+        if entry['sha1'] != file_hash(video_path):
+            return False
+        entry.update(stat)  # touched but unchanged, e.g. copied: the next run skips the hash
+        return True
+    return os.path.getmtime(audio_path) >= os.path.getmtime(video_path)
+
+
+def extract_audio(ffmpeg, video_path, audio_path):
+    """Decode only the audio stream, resampled and downmixed for the tagger."""
+    tmp_path = audio_path + ".tmp.wav"
+    command = [
+        ffmpeg, "-nostdin", "-v", "error", "-y", "-i", video_path,
+        "-vn", "-ac", str(target_channels), "-ar", str(target_sr), "-c:a", "pcm_s16le", tmp_path,
+    ]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise RuntimeError(result.stderr.strip() or f"ffmpeg exited with {result.returncode}")
+    os.replace(tmp_path, audio_path)
+
+
+def export_one(ffmpeg, filename, manifest):
+    video_path = os.path.join(video_folder, filename)
+    audio_path = os.path.join(output_folder, os.path.splitext(filename)[0] + ".wav")
+    start = time.perf_counter()
+    if is_up_to_date(video_path, audio_path, manifest, filename):
+        return filename, "skipped", time.perf_counter() - start, None
+    try:
+        extract_audio(ffmpeg, video_path, audio_path)
+    except Exception as exc:  # report and keep going with the rest of the batch
+        return filename, "failed", time.perf_counter() - start, str(exc)
+    entry = {'settings': export_settings()}
+    if skip_mode == "hash":
+        # Stat before hashing, so a video changed in between is re-hashed next time
+        entry.update(file_stat(video_path))
+        entry['sha1'] = file_hash(video_path)
+    manifest[filename] = entry
+    return filename, "exported", time.perf_counter() - start, None
+
+
+def export_all():
+    os.makedirs(output_folder, exist_ok=True)
+    manifest_path = os.path.join(output_folder, manifest_name)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+    ffmpeg = get_ffmpeg()
+    filenames = sorted(f for f in os.listdir(video_folder) if f.endswith(".mp4"))
+    results = []
+    batch_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        futures = [pool.submit(export_one, ffmpeg, filename, manifest) for filename in filenames]
+        for future in as_completed(futures):
+            filename, status, seconds, error = future.result()
+            results.append((filename, status, seconds, error))
+            print(f"{status:<9} {filename} ({seconds:.2f}s)" + (f": {error}" if error else ""))
+
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    counts = {status: sum(1 for r in results if r[1] == status) for status in ("exported", "skipped", "failed")}
+    print(f"\n{counts['exported']} exported, {counts['skipped']} up to date, {counts['failed']} failed "
+          f"in {time.perf_counter() - batch_start:.1f}s")
+    return results
+
+
+if __name__ == "__main__":
+    results = export_all()
+    sys.exit(1 if any(status == "failed" for _, status, _, _ in results) else 0)
@@ -0,0 +1,176 @@
+from collections import namedtuple
+import numpy as np
+from batch_boost import compute_pair_similarities, pair_index, segment_sum, match_ratios, tag_clip_index
+from instrumentation import recorder
+from multihot_metrics import prf_from_counts
+from ontology_index import selection_hierarchical_prf
+
+
+# === Ground Truth Alignment ===
+def ground_truth_arrays(batch, ground_truth_lists):
+    """Per tag entry: how often the tag occurs in its clip's ground truth. Per clip: ground truth length."""
+    tag_clip = tag_clip_index(batch)
+    gt_multiplicity = np.array([
+        ground_truth_lists[c].count(batch.tag_vocab[tag_id]) for c, tag_id in zip(tag_clip, batch.tag_ids)
+    ], dtype=np.int64)
+    gt_counts = np.array([len(gt) for gt in ground_truth_lists], dtype=np.int64)
+    return gt_multiplicity, gt_counts
+
+
+# === Semantic Ground Truth Matching ===
+# Similarity of every (tag entry, ground truth label) pair within a clip, in two reduction orders:
+#   entry_best[e]        best similarity of tag entry e to any ground truth label of its clip
+#   pair_sims[gt_order]  the pairs grouped by ground truth item, segments given by gt_pair_offsets
+#   gt_offsets           CSR offsets of each clip's ground truth items
+SemanticPairs = namedtuple('SemanticPairs', [
+    'entry_best', 'pair_sims', 'pair_entry', 'gt_order', 'gt_pair_offsets', 'gt_offsets',
+])
+
+
+def semantic_pairs(batch, ground_truth_lists, embed_fn):
+    """Tag/ground-truth similarities for the whole batch from one embed_fn call over the distinct labels."""
+    gt_vocab = list(dict.fromkeys(label for gt in ground_truth_lists for label in gt))
+    gt_lookup = {label: i for i, label in enumerate(gt_vocab)}
+    gt_offsets = np.zeros(len(ground_truth_lists) + 1, dtype=np.int64)
+    np.cumsum([len(gt) for gt in ground_truth_lists], out=gt_offsets[1:])
+    gt_ids = np.array([gt_lookup[label] for gt in ground_truth_lists for label in gt], dtype=np.int64)
+
+    # Ground truth takes the place of the caption phrases, so the tag x phrase pair machinery applies
+    gt_batch = batch._replace(phrase_offsets=gt_offsets, phrase_ids=gt_ids, phrase_vocab=gt_vocab)
+    pair_sims, entry_pair_offsets = compute_pair_similarities(gt_batch, embed_fn)
+    pair_entry, pair_gt, _ = pair_index(gt_batch)
+
+    entry_best = np.full(len(batch.tag_ids), -np.inf, dtype=np.float32)
+    nonempty = np.diff(entry_pair_offsets) > 0
+    if nonempty.any():
+        entry_best[nonempty] = np.maximum.reduceat(pair_sims, entry_pair_offsets[:-1][nonempty])
+    gt_order = np.lexsort((pair_entry, pair_gt))
+    gt_pair_offsets = np.zeros(len(gt_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pair_gt, minlength=len(gt_ids)), out=gt_pair_offsets[1:])
+    return SemanticPairs(entry_best, pair_sims, pair_entry, gt_order, gt_pair_offsets, gt_offsets)
+
+
+def semantic_counts(selected, batch, semantic, thresholds):
+    """Semantic TP/FP/FN per clip for boolean selections of shape (..., num_tag_entries).
+
+    Returns arrays of shape (..., num_thresholds, num_clips). As in is_semantic_match, a selected tag
+    is a true positive when its best similarity to the clip's ground truth reaches the threshold;
+    a ground truth label is a false negative when no selected tag of the clip reaches it.
+    """
+    selected = np.asarray(selected, dtype=bool)
+    # float64 like boost_grid, so a similarity compares with the threshold as float(sim) >= t does
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    hit = semantic.entry_best >= thresholds[:, None]  # (T, E)
+    chosen = selected[..., None, :]
+    true_positives = segment_sum(chosen & hit, batch.tag_offsets)
+    false_positives = segment_sum(chosen & ~hit, batch.tag_offsets)
+
+    # Best selected-tag similarity of every ground truth item, for all selections at once
+    masked = np.where(selected[..., semantic.pair_entry], semantic.pair_sims, -np.inf)[..., semantic.gt_order]
+    gt_best = np.full(selected.shape[:-1] + (len(semantic.gt_pair_offsets) - 1,), -np.inf, dtype=np.float32)
+    nonempty = np.diff(semantic.gt_pair_offsets) > 0
+    if nonempty.any():
+        gt_best[..., nonempty] = np.maximum.reduceat(masked, semantic.gt_pair_offsets[:-1][nonempty], axis=-1)
+    false_negatives = segment_sum(gt_best[..., None, :] < thresholds[:, None], semantic.gt_offsets)
+    return true_positives, false_positives, false_negatives
+
+
+# === Metrics ===
+def clip_metrics(selected, batch, gt_multiplicity, gt_counts):
+    """Per-clip precision/recall/F1 for boolean selections of shape (..., num_tag_entries).
+
+    Same counting as evaluate_combination: TP/FP over selected tags, FN over ground truth tags not selected.
+    """
+    true_positives = segment_sum(selected & (gt_multiplicity > 0), batch.tag_offsets)
+    false_positives = segment_sum(selected & (gt_multiplicity == 0), batch.tag_offsets)
+    false_negatives = gt_counts - segment_sum(selected * gt_multiplicity, batch.tag_offsets)
+    return prf_from_counts(true_positives, false_positives, false_negatives)
+
+
+# === Grid Search ===
+def macro_rows(macro, alpha_values, confidence_thresholds, caption_similarity_thresholds,
+               metric_names=('precision', 'recall', 'f1')):
+    """One row per grid point, in alpha -> confidence -> similarity order, from macro metrics.
+
+    macro has shape (len(metric_names), num_alpha, num_conf, num_sim); each metric becomes a column.
+    """
+    results_combinations = []
+    for a, alpha in enumerate(alpha_values):
+        for k, conf_thresh in enumerate(confidence_thresholds):
+            for s, cap_sim_thresh in enumerate(caption_similarity_thresholds):
+                row = {'alpha': alpha, 'conf_thresh': conf_thresh, 'caption_sim_thresh': cap_sim_thresh}
+                for m, name in enumerate(metric_names):
+                    row[name] = float(macro[m, a, k, s])
+                results_combinations.append(row)
+    return results_combinations
+
+
+def boost_grid(batch, pair_similarities, alpha_values, caption_similarity_thresholds):
+    """Boosted confidences for every alpha and similarity threshold, shape (num_alpha, num_sim, num_entries).
+
+    Match counts for all similarity thresholds come from one comparison and all alphas are boosted
+    in one broadcast. The result is float64, 8 bytes per entry and grid point: float32 would move
+    boosts that tie with a confidence threshold to either side of it, unlike evaluate_combination.
+    """
+    pair_sims, tag_pair_offsets = pair_similarities
+    alphas = np.asarray(alpha_values, dtype=np.float64)
+    sim_thresholds = np.asarray(caption_similarity_thresholds, dtype=np.float64)
+    tag_num_captions = batch.num_captions[tag_clip_index(batch)]
+    with recorder.stage('boosting', len(alphas) * len(sim_thresholds) * len(batch.tag_ids)):
+        # (num_sim, num_entries)
+        above = pair_sims.astype(np.float64)[None, :] > sim_thresholds[:, None]
+        ratios = match_ratios(segment_sum(above, tag_pair_offsets), tag_num_captions[None, :])
+        # (num_alpha, num_sim, num_entries)
+        return np.minimum(1.0, alphas[:, None, None] * ratios[None] + (1 - alphas)[:, None, None] * batch.tag_confs)
+
+
+def grid_search(batch, ground_truth_lists, alpha_values, confidence_thresholds, caption_similarity_thresholds,
+                embed_fn=None, pair_similarities=None, ontology_index=None, semantic_thresholds=None, semantic=None,
+                boosted=None):
+    """Macro precision/recall/F1 for every (alpha, confidence, similarity threshold) combination.
+
+    Tag/phrase similarities are computed once and boost_grid boosts the whole grid at once. Rows are
+    returned in the order of the original alpha -> confidence -> similarity loops. With an OntologyIndex, hierarchical (ancestor
+    closed) h_precision/h_recall/h_f1 are added to every row. semantic_thresholds add semantic-match
+    sem_precision@t/sem_recall@t/sem_f1@t columns for each threshold t (semantic_pairs is computed with
+    embed_fn unless passed as semantic). A boost_grid result of the same grid can be passed as boosted.
+    """
+    if not batch.clip_ids:
+        return []
+    if pair_similarities is None:
+        pair_similarities = compute_pair_similarities(batch, embed_fn)
+
+    gt_multiplicity, gt_counts = ground_truth_arrays(batch, ground_truth_lists)
+    semantic_thresholds = list(semantic_thresholds or [])
+    if semantic_thresholds and semantic is None:
+        semantic = semantic_pairs(batch, ground_truth_lists, embed_fn)
+    if boosted is None:
+        boosted = boost_grid(batch, pair_similarities, alpha_values, caption_similarity_thresholds)
+
+    # One confidence threshold at a time keeps the selection tensor at num_alpha x num_sim x num_entries
+    num_metrics = 3 if ontology_index is None else 6
+    macro = np.empty((num_metrics, len(alpha_values), len(confidence_thresholds), len(caption_similarity_thresholds)))
+    semantic_macro = np.empty((3, len(semantic_thresholds)) + macro.shape[1:])
+    with recorder.stage('metrics', macro[0].size * len(batch.clip_ids)):
+        for k, conf_thresh in enumerate(confidence_thresholds):
+            selected = boosted >= conf_thresh
+            metrics = clip_metrics(selected, batch, gt_multiplicity, gt_counts)
+            if ontology_index is not None:
+                metrics += selection_hierarchical_prf(ontology_index, selected, batch, ground_truth_lists)
+            for m, values in enumerate(metrics):
+                macro[m, :, k, :] = values.mean(axis=-1)
+            if semantic_thresholds:
+                # (num_alpha, num_sim, num_thresholds, num_clips)
+                semantic_metrics = prf_from_counts(*semantic_counts(selected, batch, semantic, semantic_thresholds))
+                for m, values in enumerate(semantic_metrics):
+                    semantic_macro[m, :, :, k, :] = values.mean(axis=-1).transpose(2, 0, 1)
+
+    metric_names = ['precision', 'recall', 'f1']
+    if ontology_index is not None:
+        metric_names += ['h_precision', 'h_recall', 'h_f1']
+    for sem_thresh in semantic_thresholds:
+        metric_names += [f'sem_precision@{sem_thresh}', f'sem_recall@{sem_thresh}', f'sem_f1@{sem_thresh}']
+    # (num_thresholds * 3, ...) with the three semantic metrics of each threshold together
+    semantic_macro = semantic_macro.swapaxes(0, 1).reshape((-1,) + macro.shape[1:])
+    return macro_rows(np.concatenate([macro, semantic_macro]), alpha_values, confidence_thresholds,
+                      caption_similarity_thresholds, metric_names)
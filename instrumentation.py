@@ -0,0 +1,196 @@
+import os
+import sys
+import csv
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# === Parameters ===
+progress_interval = 10  # seconds between progress lines on stderr, once start_progress is called
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process in MB, or None where it cannot be read."""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 2 ** 20
+        except (ImportError, AttributeError):
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+# === Recorder ===
+class Recorder:
+    """Wall time, CPU time and item counts per named stage, plus counters and value summaries.
+
+    Stages may nest (encoding runs inside similarity); self_seconds is a stage's wall time minus
+    the stages nested inside it, so the self times of all stages add up to the instrumented time.
+    CPU time is process-wide and includes worker threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stacks = {}  # thread id -> open stage frames, innermost last
+        self._progress = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.counters = {}
+            self.observations = {}
+            self.started = time.perf_counter()
+
+    def _stage_stats(self, name):
+        if name not in self.stages:
+            self.stages[name] = {'calls': 0, 'items': 0, 'wall_seconds': 0.0, 'self_seconds': 0.0, 'cpu_seconds': 0.0}
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name, items=0):
+        frame = {'name': name, 'child_seconds': 0.0}
+        # Stacks change under the lock, progress_line reads all of them from another thread
+        with self._lock:
+            stack = self._stacks.setdefault(threading.get_ident(), [])
+            stack.append(frame)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            with self._lock:
+                stack.pop()
+                if stack:
+                    stack[-1]['child_seconds'] += wall
+                else:
+                    # Finished threads leave no entry behind
+                    del self._stacks[threading.get_ident()]
+                stats = self._stage_stats(name)
+                stats['calls'] += 1
+                stats['items'] += items
+                stats['wall_seconds'] += wall
+                stats['self_seconds'] += wall - frame['child_seconds']
+                stats['cpu_seconds'] += cpu
+
+    def add_items(self, name, items):
+        """Add items to a stage after the fact, e.g. when the count is only known at the end."""
+        with self._lock:
+            self._stage_stats(name)['items'] += items
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        """Track count/total/min/max of a value, e.g. encoder batch sizes."""
+        with self._lock:
+            summary = self.observations.get(name)
+            if summary is None:
+                self.observations[name] = {'count': 1, 'total': value, 'min': value, 'max': value}
+            else:
+                summary['count'] += 1
+                summary['total'] += value
+                summary['min'] = min(summary['min'], value)
+                summary['max'] = max(summary['max'], value)
+
+    # === Reports ===
+    def report(self):
+        with self._lock:
+            stages = {name: dict(stats) for name, stats in self.stages.items()}
+            counters = dict(self.counters)
+            observations = {name: dict(summary) for name, summary in self.observations.items()}
+        for stats in stages.values():
+            stats['items_per_second'] = stats['items'] / stats['wall_seconds'] if stats['wall_seconds'] > 0 else None
+        for summary in observations.values():
+            summary['mean'] = summary['total'] / summary['count']
+        # Every <name>_hits / <name>_misses counter pair also gets a hit rate
+        hit_rates = {}
+        for name in counters:
+            if name.endswith('_hits'):
+                prefix = name[:-len('_hits')]
+                total = counters[name] + counters.get(prefix + '_misses', 0)
+                hit_rates[prefix + '_hit_rate'] = counters[name] / total if total else None
+        return {
+            'elapsed_seconds': time.perf_counter() - self.started,
+            'peak_memory_mb': peak_memory_mb(),
+            'stages': stages,
+            'counters': counters,
+            'hit_rates': hit_rates,
+            'observations': observations,
+        }
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+
+    def write_csv(self, path):
+        """One row per stage, counter, hit rate and observation: kind, name, metric, value."""
+        report = self.report()
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['kind', 'name', 'metric', 'value'])
+            writer.writerow(['run', 'run', 'elapsed_seconds', report['elapsed_seconds']])
+            writer.writerow(['run', 'run', 'peak_memory_mb', report['peak_memory_mb']])
+            for name, stats in report['stages'].items():
+                for metric, value in stats.items():
+                    writer.writerow(['stage', name, metric, value])
+            for name, value in report['counters'].items():
+                writer.writerow(['counter', name, 'value', value])
+            for name, value in report['hit_rates'].items():
+                writer.writerow(['hit_rate', name, 'value', value])
+            for name, summary in report['observations'].items():
+                for metric, value in summary.items():
+                    writer.writerow(['observation', name, metric, value])
+
+    def write_report(self, path):
+        """JSON at path and the CSV form next to it."""
+        self.write_json(path)
+        self.write_csv(os.path.splitext(path)[0] + '.csv')
+
+    def progress_line(self):
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda item: -item[1]['self_seconds'])
+            counters = dict(self.counters)
+            active = [frame['name'] for stack in self._stacks.values() for frame in stack]
+        parts = [f"{time.perf_counter() - self.started:7.1f}s"]
+        parts += [f"{name} {stats['self_seconds']:.1f}s/{stats['items']}" for name, stats in stages[:4]]
+        if 'embedding_cache_hits' in counters:
+            parts.append(f"cache {counters['embedding_cache_hits']}h/{counters.get('embedding_cache_misses', 0)}m")
+        memory = peak_memory_mb()
+        if memory is not None:
+            parts.append(f"peak {memory:.0f}MB")
+        return " | ".join(parts + ([f"in {'/'.join(active)}"] if active else []))
+
+    # === Progress ===
+    def start_progress(self, interval=progress_interval, stream=None):
+        """Print progress_line every interval seconds from a daemon thread until stop_progress."""
+        if interval <= 0 or self._progress is not None:
+            return
+        stream = sys.stderr if stream is None else stream
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                print(self.progress_line(), file=stream, flush=True)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self._progress = (thread, stop)
+
+    def stop_progress(self):
+        if self._progress is not None:
+            thread, stop = self._progress
+            stop.set()
+            thread.join()
+            self._progress = None
+
+
+# The recorder every module reports to
+recorder = Recorder()
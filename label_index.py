@@ -0,0 +1,106 @@
+import os
+import json
+import hashlib
+import numpy as np
+from predictions_loader import ontology_path, load_label_vocabulary
+
+# === Paths ===
+label_index_dir = './cache/label_index'
+
+# === Parameters ===
+label_fields = ('name',)  # add 'description' to embed "name. description" from the ontology
+alignment_threshold = 0.5  # same cut-off as the ontology alignment in doc.txt
+
+
+def load_index_labels(source='panns'):
+    """The 527 PANNs labels, or every node name of audioset_ontology.json."""
+    if source == 'panns':
+        from panns_inference import labels
+        return list(labels)
+    return load_label_vocabulary()
+
+
+def label_texts(labels, fields=label_fields, path=ontology_path):
+    if tuple(fields) == ('name',):
+        return list(labels)
+    with open(path, 'r') as f:
+        nodes = {node['name']: node for node in json.load(f)}
+    texts = []
+    for label in labels:
+        node = nodes.get(label, {'name': label})
+        texts.append(". ".join(node[field].strip() for field in fields if node.get(field, '').strip()))
+    return texts
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+# === Label Index ===
+class LabelIndex:
+    """Unit-normalized label embeddings, so a phrase's best labels are one matrix-vector product."""
+
+    def __init__(self, labels, matrix):
+        self.labels = list(labels)
+        self.matrix = matrix
+        self._rows = None
+
+    def embeddings(self, labels, embed_fn):
+        """Unit-normalized float32 row per label: the index row for indexed labels, embed_fn for the rest."""
+        if self._rows is None:
+            self._rows = {label: i for i, label in enumerate(self.labels)}
+        rows = np.array([self._rows.get(label, -1) for label in labels], dtype=np.int64)
+        out = np.empty((len(rows), self.matrix.shape[1]), dtype=np.float32)
+        found = rows >= 0
+        out[found] = self.matrix[rows[found]]
+        if not found.all():
+            vectors = embed_fn([label for label, row in zip(labels, rows) if row < 0])
+            out[~found] = normalize_rows(vectors.dequantize() if hasattr(vectors, 'dequantize') else vectors)
+        return out
+
+    def top_k(self, query_embeddings, k=5):
+        """(indices, scores) of the k most similar labels per query row, best first."""
+        queries = normalize_rows(np.atleast_2d(query_embeddings))
+        scores = queries @ self.matrix.T
+        k = min(k, scores.shape[1])
+        if k == 0:
+            return np.zeros((len(queries), 0), dtype=np.int64), np.zeros((len(queries), 0), dtype=np.float32)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def query(self, phrases, embed_fn, k=5):
+        """[(label, score), ...] for every phrase, with phrases embedded in one embed_fn call."""
+        if not phrases:
+            return []
+        indices, scores = self.top_k(embed_fn(list(phrases)), k)
+        return [[(self.labels[i], float(s)) for i, s in zip(row_i, row_s)] for row_i, row_s in zip(indices, scores)]
+
+    def align(self, phrases, embed_fn, threshold=alignment_threshold):
+        """Best label per phrase when it clears the threshold, like compute_similarity in doc.txt."""
+        return [matches[0] for matches in self.query(phrases, embed_fn, k=1) if matches and matches[0][1] > threshold]
+
+
+def build_label_index(embed_fn, model_name, source='panns', fields=label_fields, root=label_index_dir):
+    """Load the index from ./cache, or embed the labels once and save it there.
+
+    A cached index is loaded without importing panns_inference.
+    """
+    key = hashlib.sha1(json.dumps([model_name, source, list(fields)]).encode('utf-8')).hexdigest()[:16]
+    matrix_path = os.path.join(root, f'{key}.npy')
+    labels_path = os.path.join(root, f'{key}.json')
+
+    if os.path.exists(matrix_path) and os.path.exists(labels_path):
+        with open(labels_path, 'r') as f:
+            return LabelIndex(json.load(f), np.load(matrix_path, mmap_mode='r'))
+
+    labels = load_index_labels(source)
+    matrix = normalize_rows(embed_fn(label_texts(labels, fields)))
+    os.makedirs(root, exist_ok=True)
+    np.save(matrix_path + '.tmp.npy', matrix)
+    os.replace(matrix_path + '.tmp.npy', matrix_path)
+    with open(labels_path, 'w') as f:
+        json.dump(labels, f)
+    return LabelIndex(labels, matrix)
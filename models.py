@@ -0,0 +1,129 @@
+import os
+from importlib import metadata
+
+# === Parameters ===
+sbert_model_name = 'all-MiniLM-L6-v2'
+spacy_model_name = 'en_core_web_trf'
+
+# Cache-only mode: evaluate from ./cache without importing torch or spaCy.
+# Enabled with RUN_FROM_CACHE=1 or the --from-cache flag of the scripts.
+cache_only = os.environ.get('RUN_FROM_CACHE', '') == '1'
+
+# Sentence encoder backend: 'torch', 'onnx' or 'onnx-int8' (see encoder_backends.py).
+# Set with SBERT_BACKEND or the --encoder-backend= flag of the scripts.
+encoder_backend = os.environ.get('SBERT_BACKEND', 'torch')
+
+_loaded = {}
+
+
+def set_cache_only(enabled=True):
+    global cache_only
+    cache_only = enabled
+
+
+def set_encoder_backend(backend):
+    global encoder_backend
+    from encoder_backends import check_backend
+    encoder_backend = check_backend(backend)
+
+
+def _check_not_cache_only(what):
+    if cache_only:
+        raise RuntimeError(f"Cache-only mode needs {what}, which is not cached. Run once without --from-cache.")
+
+
+def package_version(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+# === Lazy Models ===
+def get_sbert_model(model_name=sbert_model_name, backend=None):
+    backend = backend or encoder_backend
+    key = ('sbert', model_name) if backend == 'torch' else ('sbert', model_name, backend)
+    if key not in _loaded:
+        _check_not_cache_only(f"the SentenceTransformer '{model_name}' ({backend})")
+        from encoder_backends import load_encoder
+        _loaded[key] = load_encoder(model_name, backend)
+    return _loaded[key]
+
+
+def get_nlp(model_name=spacy_model_name):
+    key = ('spacy', model_name)
+    if key not in _loaded:
+        _check_not_cache_only(f"the spaCy model '{model_name}'")
+        from phrase_extraction import load_phrase_nlp
+        _loaded[key] = load_phrase_nlp(model_name)
+    return _loaded[key]
+
+
+def get_encoding_scheduler(model_name=sbert_model_name, backend=None):
+    backend = backend or encoder_backend
+    key = ('encoding_scheduler', model_name, backend)
+    if key not in _loaded:
+        from encoding_scheduler import EncodingScheduler
+
+        def encode_batch(texts):
+            # The scheduler already sized the batch, so it goes through the model in one forward pass
+            return get_sbert_model(model_name, backend).encode(texts, batch_size=len(texts), show_progress_bar=False)
+
+        def token_lengths(texts):
+            model = get_sbert_model(model_name, backend)
+            input_ids = model.tokenizer(texts, truncation=True, max_length=model.max_seq_length)['input_ids']
+            return [len(ids) for ids in input_ids]
+
+        _loaded[key] = EncodingScheduler(encode_batch, token_lengths)
+    return _loaded[key]
+
+
+def sbert_encoder(model_name=sbert_model_name, backend=None):
+    # Without a backend, the one configured at call time is used
+    def encode_texts(texts):
+        from instrumentation import recorder
+        with recorder.stage('encoding', len(texts)):
+            return get_encoding_scheduler(model_name, backend).encode(texts)
+    return encode_texts
+
+
+# === Lazy Caches ===
+def get_embedding_store(model_name=sbert_model_name, dtype='float32', backend=None, disk_index=False):
+    from encoder_backends import backend_model_key
+    # Each backend gets its own store, so vectors of different backends never mix
+    # disk_index: look texts up in index.sqlite instead of a dict, for corpora that must stream
+    model_key = backend_model_key(model_name, backend or encoder_backend)
+    key = ('embedding_store', model_key, dtype, disk_index)
+    if key not in _loaded:
+        from embedding_store import EmbeddingStore, embedding_store_dir, store_key
+        store = EmbeddingStore(model_key, dtype=dtype, disk_index=disk_index)
+        # A new compact store starts from the float32 vectors already encoded, quantized instead of re-encoded
+        if dtype != 'float32' and not len(store) and os.path.exists(
+                os.path.join(embedding_store_dir, store_key(model_key), 'index.jsonl')):
+            store.seed_from(EmbeddingStore(model_key, disk_index=True))
+        _loaded[key] = store
+    return _loaded[key]
+
+
+def get_label_index(model_name=sbert_model_name, source='panns', fields=('name',)):
+    from encoder_backends import backend_model_key
+    model_key = backend_model_key(model_name, encoder_backend)
+    key = ('label_index', model_key, source, tuple(fields))
+    if key not in _loaded:
+        from label_index import build_label_index
+        store = get_embedding_store(model_name, backend=encoder_backend)
+        encode_texts = sbert_encoder(model_name, encoder_backend)
+        _loaded[key] = build_label_index(lambda texts: store.get_or_encode(texts, encode_texts), model_key, source, fields)
+    return _loaded[key]
+
+
+def get_phrase_cache(model_name=spacy_model_name, shared_token_idxs=False, bounded=False):
+    # bounded: an in-memory LRU that never touches ./cache, for long-running processes
+    key = ('phrase_cache', model_name, shared_token_idxs, bounded)
+    if key not in _loaded:
+        from phrase_cache import PhraseCache, BoundedPhraseCache
+        if bounded:
+            _loaded[key] = BoundedPhraseCache(lambda: get_nlp(model_name), shared_token_idxs=shared_token_idxs)
+        else:
+            _loaded[key] = PhraseCache(model_name, lambda: get_nlp(model_name), shared_token_idxs=shared_token_idxs)
+    return _loaded[key]
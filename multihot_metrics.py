@@ -0,0 +1,105 @@
+import json
+import numpy as np
+from batch_boost import tag_clip_index
+
+# === Paths ===
+ground_truth_path = './ground_truth_tags.json'
+
+
+def load_ground_truth(path=ground_truth_path):
+    """{filename: [AudioSet labels]} for the annotated clips."""
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+# === Multi-hot Encoding ===
+def label_lookup(vocab):
+    return {label: i for i, label in enumerate(vocab)}
+
+
+def multi_hot(label_lists, vocab):
+    """Boolean (clips, len(vocab)) matrix. Labels missing from vocab are appended to it, like the predictions parser.
+
+    Repeated labels in one list collapse to a single True.
+    """
+    lookup = label_lookup(vocab)
+    rows, cols = [], []
+    for c, labels in enumerate(label_lists):
+        for label in labels:
+            if label not in lookup:
+                lookup[label] = len(vocab)
+                vocab.append(label)
+            rows.append(c)
+            cols.append(lookup[label])
+    out = np.zeros((len(label_lists), len(vocab)), dtype=bool)
+    out[rows, cols] = True
+    return out
+
+
+def selection_multi_hot(selected, batch, vocab):
+    """Boolean selections of shape (..., num_tag_entries) over a RaggedBatch as (..., clips, len(vocab))."""
+    selected = np.asarray(selected, dtype=bool)
+    lookup = label_lookup(vocab)
+    for label in batch.tag_vocab:
+        if label not in lookup:
+            lookup[label] = len(vocab)
+            vocab.append(label)
+    entry_labels = np.array([lookup[label] for label in batch.tag_vocab], dtype=np.int64)[batch.tag_ids]
+    out = np.zeros(selected.shape[:-1] + (len(batch.clip_ids), len(vocab)), dtype=bool)
+    out[..., tag_clip_index(batch), entry_labels] = selected
+    return out
+
+
+# === Metrics ===
+def prf_from_counts(true_positives, false_positives, false_negatives):
+    """Precision/recall/F1 from count arrays; zero denominators give 0 like evaluate_combination."""
+    # Plain Python ints would raise on a zero denominator instead of going through np.where
+    true_positives, false_positives, false_negatives = map(np.asarray, (true_positives, false_positives, false_negatives))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        predicted = true_positives + false_positives
+        precision = np.where(predicted > 0, true_positives / predicted, 0.0)
+        relevant = true_positives + false_negatives
+        recall = np.where(relevant > 0, true_positives / relevant, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * (precision * recall) / (precision + recall), 0.0)
+    return precision, recall, f1
+
+
+def pad_labels(matrix, num_labels):
+    """Widen a multi-hot matrix built before labels were appended to the vocab."""
+    missing = num_labels - matrix.shape[-1]
+    if missing <= 0:
+        return matrix
+    return np.concatenate([matrix, np.zeros(matrix.shape[:-1] + (missing,), dtype=bool)], axis=-1)
+
+
+def multi_hot_counts(predicted, truth):
+    """Elementwise TP/FP/FN masks. predicted may carry leading parameter axes, (..., clips, labels)."""
+    predicted = np.asarray(predicted, dtype=bool)
+    truth = np.asarray(truth, dtype=bool)
+    num_labels = max(predicted.shape[-1], truth.shape[-1])
+    predicted, truth = pad_labels(predicted, num_labels), pad_labels(truth, num_labels)
+    return predicted & truth, predicted & ~truth, ~predicted & truth
+
+
+def evaluate_multi_hot(predicted, truth):
+    """Per-clip, macro, micro and per-label precision/recall/F1 for multi-hot predictions.
+
+    predicted is (..., clips, labels) and truth (clips, labels); every result keeps the leading
+    axes, so a stack of selections for many parameter combinations is scored in one call.
+    Per-clip values match evaluate_combination only when each clip's ground truth labels are
+    unique and its predicted tags are collapsed to one entry per label (as build_ragged_batch
+    does): a multi-hot row cannot count a repeated label twice, while evaluate_combination
+    credits every ground truth occurrence. Macro is the mean of the per-clip values over clips and
+    micro pools the counts of all clips. Per-label scores use the clips as samples.
+    """
+    true_positives, false_positives, false_negatives = multi_hot_counts(predicted, truth)
+    clip_counts = [m.sum(axis=-1) for m in (true_positives, false_positives, false_negatives)]
+    label_counts = [m.sum(axis=-2) for m in (true_positives, false_positives, false_negatives)]
+    per_clip = prf_from_counts(*clip_counts)
+    return {
+        'per_clip': per_clip,
+        'macro': tuple(values.mean(axis=-1) for values in per_clip),
+        'micro': prf_from_counts(*(counts.sum(axis=-1) for counts in clip_counts)),
+        'per_label': prf_from_counts(*label_counts),
+        'label_support': label_counts[0] + label_counts[2],
+    }
@@ -0,0 +1,180 @@
+import json
+from collections import deque
+import numpy as np
+from predictions_loader import ontology_path
+
+# Popcount of every byte value, for counting set bits in packed label sets
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+
+def popcount(bits):
+    """Number of set bits along the last axis of a packed uint8 bitset array."""
+    return _POPCOUNT[bits].sum(axis=-1)
+
+
+def segment_or(bits, offsets):
+    """Bitwise OR of packed rows (axis -2) over CSR segments; empty segments give an all-zero row."""
+    out = np.zeros(bits.shape[:-2] + (len(offsets) - 1, bits.shape[-1]), dtype=np.uint8)
+    nonempty = offsets[1:] > offsets[:-1]
+    if nonempty.any():
+        out[..., nonempty, :] = np.bitwise_or.reduceat(bits, offsets[:-1][nonempty], axis=-2)
+    return out
+
+
+def prf_from_bits(pred_bits, true_bits):
+    """Precision, recall and F1 of packed label sets; zero denominators give 0, as in evaluate_combination."""
+    overlap = popcount(pred_bits & true_bits)
+    predicted = popcount(pred_bits)
+    relevant = popcount(true_bits)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(predicted > 0, overlap / predicted, 0.0)
+        recall = np.where(relevant > 0, overlap / relevant, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * (precision * recall) / (precision + recall), 0.0)
+    return precision, recall, f1
+
+
+# === Ontology Index ===
+class OntologyIndex:
+    """Transitive ancestor/descendant closure of audioset_ontology.json over label ids.
+
+    Label ids follow the ontology order, the same order as the predictions vocabulary, and any
+    extra labels in vocab become isolated nodes. ancestors[i, j] is True when j is i or one of its
+    ancestors; ancestor_bits holds the same rows packed into bitsets. up_distance[i, j] is the
+    shortest number of child->parent steps from i to j (inf when j is not an ancestor).
+    """
+
+    def __init__(self, vocab=None, path=ontology_path):
+        with open(path, 'r') as f:
+            nodes = json.load(f)
+        self.labels = [node['name'] for node in nodes]
+        if vocab is not None:
+            if list(vocab[:len(self.labels)]) != self.labels:
+                raise ValueError("vocab must start with the ontology names in ontology order")
+            self.labels = list(vocab)
+        self.label_to_id = {label: i for i, label in enumerate(self.labels)}
+        n = len(self.labels)
+
+        id_to_index = {node['id']: i for i, node in enumerate(nodes)}
+        parents = [[] for _ in range(n)]
+        for i, node in enumerate(nodes):
+            for child_id in node['child_ids']:
+                parents[id_to_index[child_id]].append(i)
+        self.parents = parents
+
+        # BFS upwards from every node; the ontology is a small DAG (some nodes have several parents)
+        up_distance = np.full((n, n), np.inf, dtype=np.float32)
+        for i in range(n):
+            up_distance[i, i] = 0
+            todo = deque([i])
+            while todo:
+                node = todo.popleft()
+                for parent in parents[node]:
+                    if up_distance[i, parent] == np.inf:
+                        up_distance[i, parent] = up_distance[i, node] + 1
+                        todo.append(parent)
+        self.up_distance = up_distance
+        self.ancestors = np.isfinite(up_distance)
+        self.descendants = self.ancestors.T.copy()
+        self.ancestor_bits = np.packbits(self.ancestors, axis=1)
+        self.descendant_bits = np.packbits(self.descendants, axis=1)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def ids_for(self, labels, extra_labels=()):
+        """Label ids for names. Names outside the index get len(self) + their position in extra_labels,
+        or -1 when they are not there either.
+        """
+        extra_lookup = {label: len(self) + i for i, label in enumerate(extra_labels)}
+        return np.array([self.label_to_id.get(label, extra_lookup.get(label, -1)) for label in labels], dtype=np.int64)
+
+    # === Expansion ===
+    def _expand(self, closure_bits, offsets, label_ids, num_labels):
+        label_ids = np.asarray(label_ids, dtype=np.int64)
+        if (label_ids < 0).any():
+            raise ValueError("label ids < 0; give names outside the index ids with ids_for(labels, extra_labels)")
+        if num_labels is None:
+            num_labels = max(len(self), int(label_ids.max()) + 1 if len(label_ids) else 0)
+        rows = np.zeros((len(label_ids), (num_labels + 7) // 8), dtype=np.uint8)
+        known = label_ids < len(self)
+        rows[known, :closure_bits.shape[1]] = closure_bits[label_ids[known]]
+        # Ids from len(self) on are isolated nodes: the closure is the label itself, in packbits bit order
+        extra = np.flatnonzero(~known)
+        rows[extra, label_ids[extra] // 8] |= (128 >> (label_ids[extra] % 8)).astype(np.uint8)
+        return segment_or(rows, np.asarray(offsets, dtype=np.int64))
+
+    def expand_ancestors(self, offsets, label_ids, num_labels=None):
+        """Packed ancestor-closed label set per clip from CSR label lists.
+
+        Ids from len(self) on (extra labels from ids_for) are isolated nodes that only match
+        themselves, as in selection_hierarchical_prf; the sets span num_labels bits, by default
+        enough for the largest id.
+        """
+        return self._expand(self.ancestor_bits, offsets, label_ids, num_labels)
+
+    def expand_descendants(self, offsets, label_ids, num_labels=None):
+        return self._expand(self.descendant_bits, offsets, label_ids, num_labels)
+
+    def unpack(self, bits):
+        """Packed label sets back to a boolean (clips, num_labels) matrix."""
+        return np.unpackbits(bits, axis=-1, count=len(self)).astype(bool)
+
+    # === Metrics ===
+    def hierarchical_prf(self, pred_offsets, pred_ids, true_offsets, true_ids):
+        """Per-clip hierarchical precision, recall and F1 (both sets closed under ancestors).
+
+        Ids for labels outside the index come from ids_for(labels, extra_labels) with the same
+        extra_labels on both sides. Zero denominators give 0, as in evaluate_combination.
+        """
+        num_labels = max([len(self)] + [int(np.max(ids)) + 1 for ids in (pred_ids, true_ids) if len(ids)])
+        return prf_from_bits(self.expand_ancestors(pred_offsets, pred_ids, num_labels),
+                             self.expand_ancestors(true_offsets, true_ids, num_labels))
+
+    def closure_bits(self, labels, extra_labels=()):
+        """Packed ancestor closure of every label name, over the index labels followed by extra_labels.
+
+        Names outside the index must be in extra_labels; they are isolated nodes that only match
+        themselves.
+        """
+        extra_lookup = {label: len(self) + i for i, label in enumerate(extra_labels)}
+        ids = self.ids_for(labels)
+        rows = np.zeros((len(labels), len(self) + len(extra_lookup)), dtype=bool)
+        known = ids >= 0
+        rows[known, :len(self)] = self.ancestors[ids[known]]
+        unknown = np.flatnonzero(~known)
+        rows[unknown, [extra_lookup[labels[i]] for i in unknown]] = True
+        return np.packbits(rows, axis=1)
+
+    def lca_distance(self, a_ids, b_ids):
+        """Path length through the closest common ancestor for each (a, b) pair; inf if none."""
+        a_ids = np.asarray(a_ids, dtype=np.int64)
+        b_ids = np.asarray(b_ids, dtype=np.int64)
+        return (self.up_distance[a_ids] + self.up_distance[b_ids]).min(axis=-1)
+
+    def lca(self, a_ids, b_ids):
+        """Closest common ancestor id for each (a, b) pair; -1 if none."""
+        total = self.up_distance[np.asarray(a_ids, dtype=np.int64)] + self.up_distance[np.asarray(b_ids, dtype=np.int64)]
+        best = total.argmin(axis=-1)
+        return np.where(np.isfinite(total.min(axis=-1)), best, -1)
+
+
+# === Batch Helpers ===
+def selection_hierarchical_prf(index, selected, batch, ground_truth_lists):
+    """Per-clip hierarchical P/R/F1 for boolean selections of shape (..., num_tag_entries) over a RaggedBatch.
+
+    All selections are evaluated at once on packed label sets. Tags and ground truth labels outside
+    the ontology count as isolated labels: unmatched unless the same name is on the other side.
+    """
+    gt_vocab = list(dict.fromkeys(label for gt in ground_truth_lists for label in gt))
+    extra_labels = [label for label in dict.fromkeys(batch.tag_vocab + gt_vocab) if label not in index.label_to_id]
+    gt_lookup = {label: i for i, label in enumerate(gt_vocab)}
+    true_offsets = np.zeros(len(ground_truth_lists) + 1, dtype=np.int64)
+    np.cumsum([len(gt) for gt in ground_truth_lists], out=true_offsets[1:])
+    gt_ids = np.array([gt_lookup[label] for gt in ground_truth_lists for label in gt], dtype=np.int64)
+    true_bits = segment_or(index.closure_bits(gt_vocab, extra_labels)[gt_ids], true_offsets)
+
+    # (..., num_entries, num_bytes): each entry's closure where it is selected, zeros elsewhere
+    entry_bits = index.closure_bits(batch.tag_vocab, extra_labels)[batch.tag_ids]
+    selected = np.asarray(selected, dtype=bool)
+    pred_bits = segment_or(np.where(selected[..., None], entry_bits, np.uint8(0)), batch.tag_offsets)
+    return prf_from_bits(pred_bits, true_bits)
@@ -0,0 +1,121 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from batch_boost import RaggedBatch, compute_pair_similarities
+from grid_search import boost_grid, clip_metrics, ground_truth_arrays, macro_rows
+
+# === Parameters ===
+grid_workers = os.cpu_count() or 1
+tiles_per_worker = 4  # grid tiles per worker, so uneven tiles still balance out
+
+# Arrays the workers read, all placed in shared memory once
+_shared_keys = ('tag_offsets', 'tag_confs', 'num_captions', 'pair_sims', 'tag_pair_offsets',
+                'gt_multiplicity', 'gt_counts')
+
+
+# === Shared Memory ===
+def share_arrays(arrays):
+    """Copy arrays into new shared memory blocks. Returns (blocks, specs); specs are what workers attach to."""
+    blocks, specs = [], {}
+    for key, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        blocks.append(shm)
+        specs[key] = (shm.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+
+def attach_arrays(specs):
+    """Read-only views of shared arrays, plus the blocks that keep them alive."""
+    blocks, arrays = [], {}
+    for key, (name, shape, dtype) in specs.items():
+        # Workers share the parent's resource tracker, and the parent unlinks the blocks
+        shm = shared_memory.SharedMemory(name=name)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        array.flags.writeable = False
+        blocks.append(shm)
+        arrays[key] = array
+    return blocks, arrays
+
+
+# === Worker ===
+_worker = {}
+
+
+def _init_worker(specs, num_clips):
+    blocks, arrays = attach_arrays(specs)
+    # Only the tag side of the batch is needed once the pair similarities are known
+    batch = RaggedBatch(
+        clip_ids=range(num_clips), tag_offsets=arrays['tag_offsets'], tag_ids=np.zeros(len(arrays['tag_confs']), dtype=np.int64),
+        tag_confs=arrays['tag_confs'], phrase_offsets=None, phrase_ids=None,
+        num_captions=arrays['num_captions'], tag_vocab=[], phrase_vocab=[],
+    )
+    _worker.update(blocks=blocks, arrays=arrays, batch=batch)
+
+
+def _evaluate_tile(alpha_values, confidence_thresholds, caption_similarity_thresholds):
+    """Macro P/R/F1 of one tile of the grid, shape (3, num_alpha, num_conf, num_sim)."""
+    arrays, batch = _worker['arrays'], _worker['batch']
+    boosted = boost_grid(batch, (arrays['pair_sims'], arrays['tag_pair_offsets']), alpha_values, caption_similarity_thresholds)
+    macro = np.empty((3, len(alpha_values), len(confidence_thresholds), len(caption_similarity_thresholds)))
+    for k, conf_thresh in enumerate(confidence_thresholds):
+        metrics = clip_metrics(boosted >= conf_thresh, batch, arrays['gt_multiplicity'], arrays['gt_counts'])
+        for m, values in enumerate(metrics):
+            macro[m, :, k, :] = values.mean(axis=-1)
+    return macro
+
+
+def _split(count, parts):
+    bounds = np.linspace(0, count, min(count, parts) + 1).round().astype(int)
+    return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+# === Parallel Grid Search ===
+def parallel_grid_search(batch, ground_truth_lists, alpha_values, confidence_thresholds, caption_similarity_thresholds,
+                         embed_fn=None, pair_similarities=None, workers=grid_workers):
+    """grid_search spread over a process pool; returns the same rows in the same order.
+
+    Tag arrays, pair similarities and ground truth go into shared memory once and every worker
+    attaches to them at start-up. The alpha x similarity-threshold plane is cut into tiles that
+    are evaluated for all confidence thresholds at once, and the tiles are written back into one
+    grid by position, so the output does not depend on which worker finishes first.
+    """
+    if not batch.clip_ids:
+        return []
+    alpha_values, caption_similarity_thresholds = list(alpha_values), list(caption_similarity_thresholds)
+    if pair_similarities is None:
+        pair_similarities = compute_pair_similarities(batch, embed_fn)
+    gt_multiplicity, gt_counts = ground_truth_arrays(batch, ground_truth_lists)
+    pair_sims, tag_pair_offsets = pair_similarities
+    arrays = {
+        'tag_offsets': batch.tag_offsets, 'tag_confs': batch.tag_confs, 'num_captions': batch.num_captions,
+        'pair_sims': pair_sims, 'tag_pair_offsets': tag_pair_offsets,
+        'gt_multiplicity': gt_multiplicity, 'gt_counts': gt_counts,
+    }
+
+    # Tiles over alphas first, then over similarity thresholds when there are few alphas
+    num_tiles = max(1, workers * tiles_per_worker)
+    alpha_parts = _split(len(alpha_values), num_tiles)
+    sim_parts = _split(len(caption_similarity_thresholds), -(-num_tiles // len(alpha_parts)))
+    tiles = [(a, s) for a in alpha_parts for s in sim_parts]
+
+    macro = np.empty((3, len(alpha_values), len(confidence_thresholds), len(caption_similarity_thresholds)))
+    blocks, specs = share_arrays({key: arrays[key] for key in _shared_keys})
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(specs, len(batch.clip_ids))) as pool:
+            futures = [
+                pool.submit(_evaluate_tile, list(alpha_values[a0:a1]), list(confidence_thresholds),
+                            list(caption_similarity_thresholds[s0:s1]))
+                for (a0, a1), (s0, s1) in tiles
+            ]
+            for ((a0, a1), (s0, s1)), future in zip(tiles, futures):
+                macro[:, a0:a1, :, s0:s1] = future.result()
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    return macro_rows(macro, alpha_values, confidence_thresholds, caption_similarity_thresholds)
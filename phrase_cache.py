@@ -0,0 +1,194 @@
+import os
+import json
+import uuid
+import hashlib
+import inspect
+from collections import OrderedDict
+from embedding_store import StoreLock
+from instrumentation import recorder
+from models import package_version
+from phrase_extraction import add_doc_phrases, phrases_from_docs, extract_phrase_lists, unused_components
+
+# === Paths ===
+phrase_cache_dir = './cache/phrases'
+
+# === Parameters ===
+max_cached_clips = 50000  # clips whose phrases a BoundedPhraseCache keeps in memory
+
+
+def _digest(*parts):
+    return hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+def rules_fingerprint():
+    """Changes whenever the phrase rules in phrase_extraction.add_doc_phrases are edited."""
+    return _digest(inspect.getsource(add_doc_phrases))
+
+
+def _read_jsonl(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        data = f.read()
+    return [json.loads(line) for line in data[:data.rfind(b'\n') + 1].splitlines()]
+
+
+def _append_jsonl(path, records):
+    with open(path, 'ab') as f:
+        f.write(b''.join(json.dumps(r).encode('utf-8') + b'\n' for r in records))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# === Phrase Cache ===
+class PhraseCache:
+    """Content-addressed cache of parsed captions (DocBin shards) and of the phrases extracted from them.
+
+    A caption's Doc is keyed by its text plus the spaCy and model versions, so only new or
+    edited captions are parsed. A clip's phrases are keyed by its caption Doc keys plus a
+    fingerprint of the phrase rules, so editing the rules rebuilds phrases from cached Docs.
+    Versions are read from package metadata, and nlp_loader is only called when a Doc has
+    to be parsed or deserialized, so fully cached runs never import spaCy.
+    """
+
+    def __init__(self, model_name, nlp_loader, shared_token_idxs=False, root=phrase_cache_dir):
+        self.model_name = model_name
+        self.nlp_loader = nlp_loader
+        self.shared_token_idxs = shared_token_idxs
+        self.path = root
+        self.docs_dir = os.path.join(root, 'docs')
+        os.makedirs(self.docs_dir, exist_ok=True)
+        self.doc_index_path = os.path.join(root, 'doc_index.jsonl')
+        self.phrase_index_path = os.path.join(root, 'phrases.jsonl')
+        self.lock_path = os.path.join(root, 'lock')
+
+        self.model_id = (package_version('spacy'), model_name, package_version(model_name), list(unused_components))
+        self.rules_id = rules_fingerprint()
+        self.stats = {'phrase_hits': 0, 'doc_hits': 0, 'parsed': 0}
+        self.doc_index = {}
+        self.phrase_index = {}
+        self.refresh()
+
+    @property
+    def nlp(self):
+        return self.nlp_loader()
+
+    def refresh(self):
+        self.doc_index = {r['key']: (r['shard'], r['i']) for r in _read_jsonl(self.doc_index_path)}
+        self.phrase_index = {r['key']: r['phrases'] for r in _read_jsonl(self.phrase_index_path)}
+
+    def caption_key(self, caption):
+        return _digest(self.model_id, caption)
+
+    def clip_key(self, doc_keys):
+        return _digest(self.rules_id, self.shared_token_idxs, doc_keys)
+
+    def _load_docs(self, doc_keys):
+        from spacy.tokens import DocBin
+        by_shard = {}
+        for key in doc_keys:
+            shard, i = self.doc_index[key]
+            by_shard.setdefault(shard, []).append((i, key))
+        docs = {}
+        for shard, entries in by_shard.items():
+            doc_bin = DocBin().from_disk(os.path.join(self.docs_dir, shard))
+            shard_docs = list(doc_bin.get_docs(self.nlp.vocab))
+            for i, key in entries:
+                docs[key] = shard_docs[i]
+        return docs
+
+    def _parse(self, texts_by_key, batch_size, n_process):
+        from spacy.tokens import DocBin
+        nlp = self.nlp
+        keys = list(texts_by_key)
+        disable = [name for name in nlp.pipe_names if name in unused_components]
+        with recorder.stage('parsing', len(keys)):
+            docs = list(nlp.pipe([texts_by_key[k] for k in keys], batch_size=batch_size, n_process=n_process, disable=disable))
+
+        shard = f"{uuid.uuid4().hex}.spacy"
+        doc_bin = DocBin(docs=docs)
+        tmp_path = os.path.join(self.docs_dir, shard + '.tmp')
+        doc_bin.to_disk(tmp_path)
+        os.replace(tmp_path, os.path.join(self.docs_dir, shard))
+        with StoreLock(self.lock_path):
+            _append_jsonl(self.doc_index_path, [{'key': k, 'shard': shard, 'i': i} for i, k in enumerate(keys)])
+        for i, key in enumerate(keys):
+            self.doc_index[key] = (shard, i)
+        self.stats['parsed'] += len(keys)
+        return dict(zip(keys, docs))
+
+    def extract(self, caption_lists, batch_size=64, n_process=1):
+        """Same result as phrase_extraction.extract_phrase_lists, parsing only uncached captions."""
+        doc_keys = [[self.caption_key(caption) for caption in audio_captions] for audio_captions in caption_lists]
+        clip_keys = [self.clip_key(keys) for keys in doc_keys]
+        missing = [c for c, key in enumerate(clip_keys) if key not in self.phrase_index]
+        self.stats['phrase_hits'] += len(caption_lists) - len(missing)
+        recorder.count('phrase_cache_hits', len(caption_lists) - len(missing))
+        recorder.count('phrase_cache_misses', len(missing))
+
+        if missing:
+            texts_by_key = {}
+            for c in missing:
+                for key, caption in zip(doc_keys[c], caption_lists[c]):
+                    texts_by_key[key] = caption
+            cached = [k for k in texts_by_key if k in self.doc_index]
+            self.stats['doc_hits'] += len(cached)
+            docs = self._load_docs(cached)
+            new = {k: t for k, t in texts_by_key.items() if k not in docs}
+            if new:
+                docs.update(self._parse(new, batch_size, n_process))
+
+            missing_lists = [caption_lists[c] for c in missing]
+            missing_docs = [docs[key] for c in missing for key in doc_keys[c]]
+            phrase_lists = phrases_from_docs(missing_lists, missing_docs, self.shared_token_idxs)
+            records = [{'key': clip_keys[c], 'phrases': phrases} for c, phrases in zip(missing, phrase_lists)]
+            with StoreLock(self.lock_path):
+                _append_jsonl(self.phrase_index_path, records)
+            for record in records:
+                self.phrase_index[record['key']] = record['phrases']
+
+        return [list(self.phrase_index[key]) for key in clip_keys]
+
+
+# === Bounded In-Memory Cache ===
+class BoundedPhraseCache:
+    """In-memory LRU of the phrases of the last max_clips distinct clips, for long-running processes.
+
+    Unlike PhraseCache nothing is written to disk and memory stays bounded: misses are parsed with
+    one nlp.pipe stream and the least recently used clips are dropped. extract gives the same
+    phrases as phrase_extraction.extract_phrase_lists.
+    """
+
+    def __init__(self, nlp_loader, shared_token_idxs=False, max_clips=max_cached_clips):
+        self.nlp_loader = nlp_loader
+        self.shared_token_idxs = shared_token_idxs
+        self.max_clips = max_clips
+        self.phrases = OrderedDict()
+        self.stats = {'phrase_hits': 0, 'parsed': 0}
+
+    def extract(self, caption_lists, batch_size=64, n_process=1):
+        clip_keys = [_digest(list(audio_captions)) for audio_captions in caption_lists]
+        missing = {}
+        for key, audio_captions in zip(clip_keys, caption_lists):
+            if key in self.phrases:
+                self.phrases.move_to_end(key)
+            else:
+                missing.setdefault(key, audio_captions)
+        hits = sum(1 for key in clip_keys if key not in missing)
+        self.stats['phrase_hits'] += hits
+        recorder.count('phrase_cache_hits', hits)
+        recorder.count('phrase_cache_misses', len(caption_lists) - hits)
+
+        if missing:
+            missing_lists = list(missing.values())
+            num_captions = sum(len(audio_captions) for audio_captions in missing_lists)
+            with recorder.stage('parsing', num_captions):
+                phrase_lists = extract_phrase_lists(missing_lists, self.nlp_loader(), batch_size, n_process,
+                                                    self.shared_token_idxs)
+            self.stats['parsed'] += num_captions
+            self.phrases.update(zip(missing, phrase_lists))
+
+        results = [list(self.phrases[key]) for key in clip_keys]
+        while len(self.phrases) > self.max_clips:
+            self.phrases.popitem(last=False)
+        return results
@@ -0,0 +1,84 @@
+# === Parameters ===
+# Phrase rules only read tokens, POS tags, dependencies and noun_chunks
+unused_components = ('ner', 'lemmatizer', 'textcat', 'entity_ruler', 'senter')
+
+
+def load_phrase_nlp(model_name='en_core_web_trf'):
+    import spacy
+    return spacy.load(model_name, exclude=list(unused_components))
+
+
+# === Phrase Rules ===
+def add_doc_phrases(doc, unique_phrases, used_token_idxs):
+    # Step 1: SVO triplets
+    for token in doc:
+        if token.pos_ == "VERB":
+            subj = [child for child in token.children if child.dep_ in ("nsubj", "nsubjpass")]
+            obj = [child for child in token.children if child.dep_ in ("dobj", "attr", "prep", "pobj")]
+            if subj and obj:
+                all_tokens = subj + [token] + obj
+            elif subj:
+                all_tokens = subj + [token]
+            elif obj:
+                all_tokens = [token] + obj
+            else:
+                continue
+
+            token_idxs = {t.i for t in all_tokens}
+            if not token_idxs & used_token_idxs:
+                phrase = " ".join(
+                    t.text.lower() for t in all_tokens
+                    if not t.is_stop and not t.is_punct
+                ).strip()
+                if phrase:
+                    unique_phrases.add(phrase)
+                    used_token_idxs.update(token_idxs)
+
+    # Step 2: Noun chunks
+    for chunk in doc.noun_chunks:
+        token_idxs = {t.i for t in chunk}
+        if not token_idxs & used_token_idxs:
+            filtered = [t.text.lower() for t in chunk if not t.is_stop and not t.is_punct]
+            phrase = " ".join(filtered).strip()
+            if phrase:
+                unique_phrases.add(phrase)
+                used_token_idxs.update(token_idxs)
+
+    # Step 3: Compound noun phrases
+    for token in doc:
+        if token.dep_ == "compound" and token.head.pos_ == "NOUN":
+            token_idxs = {token.i, token.head.i}
+            if not token_idxs & used_token_idxs:
+                if not token.is_stop and not token.is_punct and not token.head.is_stop and not token.head.is_punct:
+                    phrase = f"{token.text.lower()} {token.head.text.lower()}".strip()
+                    if phrase:
+                        unique_phrases.add(phrase)
+                        used_token_idxs.update(token_idxs)
+
+
+# === Batched Extraction ===
+def phrases_from_docs(caption_lists, docs, shared_token_idxs=False):
+    """Group docs (one per caption, in order) back into one phrase list per clip."""
+    docs = iter(docs)
+    phrase_lists = []
+    for audio_captions in caption_lists:
+        unique_phrases = set()
+        used_token_idxs = set()
+        for _ in audio_captions:
+            if not shared_token_idxs:
+                used_token_idxs = set()
+            add_doc_phrases(next(docs), unique_phrases, used_token_idxs)
+        phrase_lists.append(list(unique_phrases))
+    return phrase_lists
+
+
+def extract_phrase_lists(caption_lists, nlp, batch_size=64, n_process=1, shared_token_idxs=False):
+    """Parse every caption of every clip with one nlp.pipe stream and return one phrase list per clip.
+
+    shared_token_idxs keeps a single used-token set across all captions of a clip, which is
+    what clip_specific_eval.py does; phrase_f1.py resets it for each caption.
+    """
+    texts = [caption for audio_captions in caption_lists for caption in audio_captions]
+    disable = [name for name in nlp.pipe_names if name in unused_components]
+    docs = nlp.pipe(texts, batch_size=batch_size, n_process=n_process, disable=disable)
+    return phrases_from_docs(caption_lists, docs, shared_token_idxs)
@@ -0,0 +1,143 @@
+import os
+import json
+import hashlib
+from collections import namedtuple
+import numpy as np
+from batch_boost import RaggedBatch
+
+# === Paths ===
+ontology_path = './audioset_ontology.json'
+predictions_cache_dir = './cache/predictions'
+
+# === Parameters ===
+max_tags = 10  # tag1..tag10 in mturk_audio_tags_dynamic.csv
+
+# Row r of the predictions holds counts[r] valid tags, left-aligned:
+#   label_ids[r, :counts[r]] (int16 ids into vocab, -1 padding) and probs[r, :counts[r]] (float32)
+PredictionArrays = namedtuple('PredictionArrays', ['filenames', 'row_index', 'label_ids', 'probs', 'counts', 'vocab'])
+
+
+def load_label_vocabulary(path=ontology_path):
+    """AudioSet label names in ontology order."""
+    with open(path, 'r') as f:
+        return [node['name'] for node in json.load(f)]
+
+
+# === Parsing ===
+def parse_predictions_csv(csv_path, vocab):
+    """Parse the wide tag{i}/tag{i}prob layout once. Labels missing from vocab are appended to it."""
+    import pandas as pd
+    df = pd.read_csv(csv_path)
+    label_to_id = {label: i for i, label in enumerate(vocab)}
+    vocab = list(vocab)
+
+    label_ids = np.full((len(df), max_tags), -1, dtype=np.int16)
+    probs = np.zeros((len(df), max_tags), dtype=np.float32)
+    counts = np.zeros(len(df), dtype=np.int16)
+    tag_columns = [(f'tag{i}', f'tag{i}prob') for i in range(1, max_tags + 1)]
+    columns = {name: df[name].tolist() if name in df.columns else [None] * len(df) for pair in tag_columns for name in pair}
+
+    for r in range(len(df)):
+        # Same validity rule as the per-row loop, repeated tags collapse like a dict
+        row_tags = {}
+        for tag_col, prob_col in tag_columns:
+            tag, prob = columns[tag_col][r], columns[prob_col][r]
+            if isinstance(tag, str) and not pd.isna(prob):
+                row_tags[tag] = float(prob)
+        for i, (tag, prob) in enumerate(row_tags.items()):
+            if tag not in label_to_id:
+                label_to_id[tag] = len(vocab)
+                vocab.append(tag)
+            label_ids[r, i] = label_to_id[tag]
+            probs[r, i] = prob
+        counts[r] = len(row_tags)
+
+    filenames = df['filename'].astype(str).tolist()
+    return PredictionArrays(filenames, {f: r for r, f in enumerate(filenames)}, label_ids, probs, counts, vocab)
+
+
+# === Binary Cache ===
+def _source_signature(csv_path, vocab):
+    stat = os.stat(csv_path)
+    vocab_digest = hashlib.sha1('\n'.join(vocab).encode('utf-8')).hexdigest()
+    return {'path': os.path.abspath(csv_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'vocab': vocab_digest}
+
+
+def _cache_path(csv_path, root):
+    return os.path.join(root, hashlib.sha1(os.path.abspath(csv_path).encode('utf-8')).hexdigest()[:12])
+
+
+def _save_predictions(path, predictions, signature):
+    os.makedirs(path, exist_ok=True)
+    for name in ('label_ids', 'probs', 'counts'):
+        tmp_path = os.path.join(path, f'{name}.tmp.npy')
+        np.save(tmp_path, getattr(predictions, name))
+        os.replace(tmp_path, os.path.join(path, f'{name}.npy'))
+    meta = {'signature': signature, 'filenames': predictions.filenames, 'vocab': predictions.vocab}
+    with open(os.path.join(path, 'meta.json.tmp'), 'w') as f:
+        json.dump(meta, f)
+    os.replace(os.path.join(path, 'meta.json.tmp'), os.path.join(path, 'meta.json'))
+
+
+def load_predictions(csv_path, vocab=None, root=predictions_cache_dir):
+    """Predictions as PredictionArrays, memory-mapped from ./cache once the CSV has been parsed."""
+    vocab = load_label_vocabulary() if vocab is None else vocab
+    signature = _source_signature(csv_path, vocab)
+    path = _cache_path(csv_path, root)
+    meta_path = os.path.join(path, 'meta.json')
+
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta['signature'] == signature:
+            arrays = [np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in ('label_ids', 'probs', 'counts')]
+            filenames = meta['filenames']
+            return PredictionArrays(filenames, {f: r for r, f in enumerate(filenames)}, *arrays, meta['vocab'])
+
+    predictions = parse_predictions_csv(csv_path, vocab)
+    _save_predictions(path, predictions, signature)
+    return predictions
+
+
+# === Access ===
+def clip_tags(predictions, filename):
+    """(tag, probability) list of one clip, as the per-clip functions expect."""
+    r = predictions.row_index[filename]
+    count = int(predictions.counts[r])
+    return [(predictions.vocab[i], float(p)) for i, p in zip(predictions.label_ids[r, :count], predictions.probs[r, :count])]
+
+
+def build_prediction_batch(predictions, filenames, caption_elements_list, num_captions):
+    """RaggedBatch straight from the prediction arrays, without building per-clip tag lists.
+
+    tag_confs are the float32 probabilities widened to float64, as float(p) in clip_tags does, so
+    batch boosts and threshold comparisons match evaluate_combination exactly.
+    """
+    rows = np.array([predictions.row_index[f] for f in filenames], dtype=np.int64)
+    counts = np.asarray(predictions.counts)[rows].astype(np.int64)
+    valid = np.arange(max_tags)[None, :] < counts[:, None]
+    label_ids = np.asarray(predictions.label_ids)[rows][valid].astype(np.int64)
+    tag_confs = np.asarray(predictions.probs)[rows][valid].astype(np.float64)
+
+    # Only the labels that occur are embedded
+    used_labels, tag_ids = np.unique(label_ids, return_inverse=True)
+    tag_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(counts, out=tag_offsets[1:])
+
+    phrase_vocab, phrase_ids, phrase_offsets = {}, [], [0]
+    for caption_elements in caption_elements_list:
+        for phrase in caption_elements:
+            phrase_ids.append(phrase_vocab.setdefault(phrase, len(phrase_vocab)))
+        phrase_offsets.append(len(phrase_ids))
+
+    return RaggedBatch(
+        clip_ids=list(filenames),
+        tag_offsets=tag_offsets,
+        tag_ids=tag_ids.reshape(-1).astype(np.int64),
+        tag_confs=tag_confs,
+        phrase_offsets=np.array(phrase_offsets, dtype=np.int64),
+        phrase_ids=np.array(phrase_ids, dtype=np.int64),
+        num_captions=np.array(num_captions, dtype=np.int64),
+        tag_vocab=[predictions.vocab[i] for i in used_labels],
+        phrase_vocab=list(phrase_vocab),
+    )
@@ -0,0 +1,136 @@
+import numpy as np
+
+# === Parameters ===
+embedding_dtypes = ('float32', 'float16', 'int8')
+block_rows = 8192  # rows widened to float32 at a time by the cosine kernel
+
+# File suffix of each storage dtype in the embedding store
+dtype_suffixes = {'float32': 'f32', 'float16': 'f16', 'int8': 'i8'}
+
+
+def quantize(vectors, dtype):
+    """Compact (data, scales) for float32 vectors.
+
+    int8 uses one scale per vector (max |x| / 127), so row i is approximately data[i] * scales[i].
+    float16 and float32 rows need no scale and get scales of 1.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype not in embedding_dtypes:
+        raise ValueError(f"Unknown embedding dtype {dtype!r}, expected one of {embedding_dtypes}")
+    if dtype != 'int8':
+        return vectors.astype(dtype), np.ones(len(vectors), dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales = np.where(scales > 0, scales, 1).astype(np.float32)
+    data = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return data, scales
+
+
+def _row_norms(data):
+    norms = np.empty(len(data), dtype=np.float32)
+    for start in range(0, len(data), block_rows):
+        block = np.asarray(data[start:start + block_rows], dtype=np.float32)
+        norms[start:start + block_rows] = np.linalg.norm(block, axis=1)
+    return norms
+
+
+# === Compact Embeddings ===
+class QuantizedEmbeddings:
+    """A float32, float16 or int8 embedding matrix with row scales, usable as cosine_similarity_matrix input.
+
+    The saving is storage and memory, not arithmetic: numpy has no int8 matrix product, so cosine()
+    widens one block of rows at a time to float32 and multiplies with BLAS at float32 speed.
+    """
+
+    def __init__(self, data, scales=None, norms=None):
+        self.data = data
+        self.scales = np.ones(len(data), dtype=np.float32) if scales is None else np.asarray(scales, dtype=np.float32)
+        self.norms = _row_norms(data) if norms is None else norms
+
+    @classmethod
+    def from_float32(cls, vectors, dtype):
+        return cls(*quantize(vectors, dtype))
+
+    @property
+    def dtype(self):
+        return self.data.dtype.name
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + (self.scales.nbytes if self.dtype == 'int8' else 0)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, rows):
+        return QuantizedEmbeddings(np.asarray(self.data[rows]), self.scales[rows], self.norms[rows])
+
+    def dequantize(self):
+        return np.asarray(self.data, dtype=np.float32) * self.scales[:, None]
+
+    def _widened_block(self, start, stop):
+        return np.asarray(self.data[start:stop], dtype=np.float32)
+
+    def cosine(self, other):
+        """(len(self), len(other)) cosine similarities, as float32.
+
+        Dot products of the stored values come first, divided by both row norms afterwards; the row
+        scales cancel out of a cosine. For int8 rows of up to 1040 dims every product and partial
+        sum is an integer below 2**24, so the float32 product is the exact integer dot product.
+        """
+        out = np.empty((len(self), len(other)), dtype=np.float32)
+        left = self._widened_block(0, len(self))
+        left_norms = np.maximum(self.norms, 1e-12)[:, None]
+        for start in range(0, len(other), block_rows):
+            stop = start + block_rows
+            dots = left @ other._widened_block(start, stop).T
+            out[:, start:stop] = dots / left_norms / np.maximum(other.norms[start:stop], 1e-12)[None, :]
+        return out
+
+
+def as_quantized(embeddings):
+    if isinstance(embeddings, QuantizedEmbeddings):
+        return embeddings
+    return QuantizedEmbeddings(np.asarray(embeddings, dtype=np.float32))
+
+
+# === Parity Check ===
+def precision_parity(batch, ground_truth_lists, embed_fn, dtype, alpha_values, confidence_thresholds,
+                     caption_similarity_thresholds):
+    """Compare a reduced-precision similarity path against float32 on one batch.
+
+    embed_fn must return float32 embeddings; they are quantized to dtype here, so both paths see
+    the same vectors. Returns the largest similarity, boosted confidence and macro F1 differences,
+    how many tag selections flip, and the embedding memory of both forms.
+    """
+    from batch_boost import compute_pair_similarities, boost_confidence_batch
+    from grid_search import grid_search
+
+    vectors = np.asarray(embed_fn(batch.tag_vocab + batch.phrase_vocab), dtype=np.float32)
+    compact = QuantizedEmbeddings.from_float32(vectors, dtype)
+    reference = compute_pair_similarities(batch, lambda texts: vectors)
+    reduced = compute_pair_similarities(batch, lambda texts: compact)
+
+    boosted_diff, flips = 0.0, 0
+    for alpha in alpha_values:
+        for sim_thresh in caption_similarity_thresholds:
+            ref = boost_confidence_batch(batch, None, alpha, sim_thresh, pair_similarities=reference)['boosted']
+            red = boost_confidence_batch(batch, None, alpha, sim_thresh, pair_similarities=reduced)['boosted']
+            if len(ref):
+                boosted_diff = max(boosted_diff, float(np.abs(ref - red).max()))
+            for conf_thresh in confidence_thresholds:
+                flips += int(((ref >= conf_thresh) != (red >= conf_thresh)).sum())
+
+    grid = (alpha_values, confidence_thresholds, caption_similarity_thresholds)
+    ref_rows = grid_search(batch, ground_truth_lists, *grid, pair_similarities=reference)
+    red_rows = grid_search(batch, ground_truth_lists, *grid, pair_similarities=reduced)
+    f1_diff = max((abs(r['f1'] - q['f1']) for r, q in zip(ref_rows, red_rows)), default=0.0)
+
+    return {
+        'dtype': dtype,
+        'max_similarity_diff': float(np.abs(reference[0] - reduced[0]).max()) if len(reference[0]) else 0.0,
+        'max_boosted_diff': boosted_diff,
+        'selection_flips': flips,
+        'max_f1_diff': f1_diff,
+        'float32_bytes': int(vectors.nbytes),
+        'compact_bytes': int(compact.nbytes),
+    }
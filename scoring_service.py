@@ -0,0 +1,337 @@
+import os
+import json
+import math
+import time
+import asyncio
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from embedding_store import BoundedEmbeddingCache
+from batch_boost import build_ragged_batch, compute_pair_similarities, boost_confidence_batch, unpack_boosted_results
+from instrumentation import recorder
+from encoder_backends import encoder_backends
+import models
+from models import sbert_model_name, spacy_model_name, sbert_encoder, get_embedding_store, get_phrase_cache, set_cache_only, \
+    set_encoder_backend
+
+# === Parameters ===
+host = '127.0.0.1'
+port = 8765
+max_batch_clips = 64  # requests scored together at most
+max_wait_ms = 10  # how long the first request of a batch waits for company
+default_alpha = 0.5
+default_caption_similarity_threshold = 0.5
+latency_window = 10000  # most recent requests kept for the latency percentiles
+max_body_bytes = 1 << 20
+persist_embeddings = False  # or --persist-embeddings: append vectors of new texts to the embedding store
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def parse_request(payload):
+    """(captions, audio_tags, alpha, caption_similarity_threshold) from a request body.
+
+    tags may be [[label, probability], ...] as from clip_tags, or {label: probability}. Probabilities
+    must lie in [0, 1] and every number must be finite (json.loads accepts NaN and Infinity).
+    """
+    if not isinstance(payload, dict):
+        raise BadRequest("request body must be a JSON object")
+    captions = payload.get('captions')
+    tags = payload.get('tags')
+    if not isinstance(captions, list) or not all(isinstance(c, str) for c in captions):
+        raise BadRequest("'captions' must be a list of strings")
+    if isinstance(tags, dict):
+        tags = list(tags.items())
+    if not isinstance(tags, list):
+        raise BadRequest("'tags' must be a list of [label, probability] pairs or a {label: probability} object")
+    if not all(isinstance(tag, (list, tuple)) and len(tag) == 2 for tag in tags):
+        raise BadRequest("every tag must be a [label, probability] pair")
+    try:
+        audio_tags = [(str(label), float(prob)) for label, prob in tags]
+        alpha = float(payload.get('alpha', default_alpha))
+        threshold = float(payload.get('caption_similarity_threshold', default_caption_similarity_threshold))
+    except (TypeError, ValueError):
+        raise BadRequest("tags need numeric probabilities; alpha and caption_similarity_threshold must be numbers")
+    if not all(math.isfinite(value) for value in [alpha, threshold] + [prob for _, prob in audio_tags]):
+        raise BadRequest("probabilities, alpha and caption_similarity_threshold must be finite")
+    if not all(0.0 <= prob <= 1.0 for _, prob in audio_tags):
+        raise BadRequest("tag probabilities must be between 0 and 1")
+    return captions, audio_tags, alpha, threshold
+
+
+# === Scorer ===
+class Scorer:
+    """Warm models and caches, scoring many requests with one parse and one encode call.
+
+    Memory stays bounded however many distinct requests arrive. Request captions are parsed into a
+    BoundedPhraseCache. Embeddings are served from a BoundedEmbeddingCache in front of the float32
+    embedding store, which is looked up through its on-disk index and, unless persist is set, only
+    read: vectors of new texts live in the LRU alone, so ./cache does not grow either.
+    """
+
+    def __init__(self, persist=persist_embeddings):
+        # In cache-only mode nothing can be parsed, so phrases come from the on-disk phrase cache
+        self.phrase_cache = get_phrase_cache(spacy_model_name, bounded=not models.cache_only)
+        self.store = get_embedding_store(sbert_model_name, disk_index=True)
+        self.encode_texts = sbert_encoder(sbert_model_name)
+        self.embeddings = BoundedEmbeddingCache(self.encode_texts, self.store, persist=persist)
+
+    def embed(self, texts):
+        return self.embeddings.get_or_encode(texts)
+
+    def warm_up(self):
+        # Loads spaCy and SBERT now instead of on the first request
+        self.phrase_cache.extract([["a dog barks in the distance"]])
+        self.embed(["dog barking"])
+
+    def score(self, requests):
+        """boost_confidence_ratio results for every (captions, audio_tags, alpha, threshold) request."""
+        with recorder.stage('service_batch', len(requests)):
+            phrase_lists = self.phrase_cache.extract([captions for captions, _, _, _ in requests])
+            batch = build_ragged_batch(
+                (i, audio_tags, phrases, len(captions))
+                for i, ((captions, audio_tags, _, _), phrases) in enumerate(zip(requests, phrase_lists))
+            )
+            pair_similarities = compute_pair_similarities(batch, self.embed)
+
+            results = [None] * len(requests)
+            settings = {(alpha, threshold) for _, _, alpha, threshold in requests}
+            for alpha, threshold in sorted(settings):
+                boosted = boost_confidence_batch(batch, None, alpha, threshold, pair_similarities=pair_similarities)
+                per_clip = unpack_boosted_results(batch, boosted)
+                for i, (_, _, req_alpha, req_threshold) in enumerate(requests):
+                    if (req_alpha, req_threshold) == (alpha, threshold):
+                        results[i] = per_clip[i]
+            return results
+
+
+# === Micro-batching ===
+class MicroBatcher:
+    """Queues requests and scores them in batches of up to max_batch_clips.
+
+    A batch is sent once it is full or max_wait_ms after its first request arrived; requests that
+    arrive while a batch is being scored form the next one. Scoring runs on one worker thread so
+    the event loop keeps accepting connections.
+    """
+
+    def __init__(self, scorer, max_batch=max_batch_clips, max_wait=max_wait_ms / 1000):
+        self.scorer = scorer
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.latencies = deque(maxlen=latency_window)
+        self.completed = deque(maxlen=latency_window)  # finish times, for recent throughput
+        self.batch_sizes = deque(maxlen=latency_window)
+        self.total_requests = 0
+        self.started = time.perf_counter()
+
+    async def submit(self, request):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((request, future, time.perf_counter()))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            deadline = items[0][2] + self.max_wait
+            while len(items) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            requests = [request for request, _, _ in items]
+            try:
+                results = await loop.run_in_executor(self.executor, self.scorer.score, requests)
+            except Exception as exc:
+                for _, future, _ in items:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            finished = time.perf_counter()
+            self.batch_sizes.append(len(items))
+            for (_, future, arrived), result in zip(items, results):
+                self.latencies.append(finished - arrived)
+                self.completed.append(finished)
+                self.total_requests += 1
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self):
+        latencies_ms = np.array(self.latencies) * 1000
+        now = time.perf_counter()
+        uptime = now - self.started
+        window = min(60.0, uptime)
+        recent = sum(1 for t in self.completed if now - t <= window)
+        percentiles = {}
+        if len(latencies_ms):
+            percentiles = {f'p{q}': float(np.percentile(latencies_ms, q)) for q in (50, 90, 95, 99)}
+            percentiles['max'] = float(latencies_ms.max())
+        return {
+            'requests': self.total_requests,
+            'uptime_seconds': uptime,
+            'throughput_rps': self.total_requests / uptime,
+            'recent_throughput_rps': recent / window,  # over the last minute
+            'latency_ms': percentiles,
+            'batches': len(self.batch_sizes),
+            'mean_batch_size': float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+            'queued': self.queue.qsize(),
+            'max_batch_clips': self.max_batch,
+            'max_wait_ms': self.max_wait * 1000,
+            'cache': recorder.report()['hit_rates'],
+        }
+
+
+# === HTTP ===
+_reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+            500: 'Internal Server Error'}
+
+
+async def _write_response(writer, status, payload, keep_alive):
+    body = json.dumps(payload).encode('utf-8')
+    head = (f"HTTP/1.1 {status} {_reasons[status]}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode('ascii') + body)
+    await writer.drain()
+
+
+async def _route(batcher, method, path, body):
+    if path == '/score':
+        if method != 'POST':
+            return 405, {'error': "use POST /score"}
+        try:
+            request = parse_request(json.loads(body or b'null'))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return 400, {'error': "body is not valid JSON"}
+        except BadRequest as exc:
+            return 400, {'error': str(exc)}
+        try:
+            return 200, await batcher.submit(request)
+        except Exception as exc:
+            return 500, {'error': f"{type(exc).__name__}: {exc}"}
+    if path == '/stats':
+        return 200, batcher.stats()
+    if path == '/health':
+        return 200, {'status': 'ok'}
+    return 404, {'error': f"unknown path {path}"}
+
+
+async def _read_line(reader):
+    try:
+        return await reader.readline()
+    except ValueError:  # over the stream limit
+        raise BadRequest("request line or header too long")
+
+
+async def _read_head(reader):
+    """(method, path, version, headers, content_length) of the next request, or None once the client is done.
+
+    Raises BadRequest for a malformed request line or Content-Length.
+    """
+    request_line = await _read_line(reader)
+    if not request_line.strip():
+        return None
+    parts = request_line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise BadRequest("malformed request line, expected: METHOD PATH HTTP/1.1")
+    method, path, version = parts
+    headers = {}
+    while True:
+        line = await _read_line(reader)
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = headers.get('content-length', '') or '0'
+    # int() alone would also take '-1', '+1' and '1_000'
+    if not (length.isascii() and length.isdigit()):
+        raise BadRequest(f"Content-Length must be a non-negative integer, got {length!r}")
+    return method, path, version, headers, int(length)
+
+
+def make_handler(batcher):
+    """Minimal HTTP/1.1 with keep-alive: POST /score, GET /stats, GET /health.
+
+    A malformed request head gets a 400 and the connection is closed, since the rest of the stream
+    cannot be framed; only connection errors close it without a response.
+    """
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                try:
+                    head = await _read_head(reader)
+                except BadRequest as exc:
+                    await _write_response(writer, 400, {'error': str(exc)}, False)
+                    break
+                if head is None:
+                    break
+                method, path, version, headers, length = head
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+
+                if length > max_body_bytes:
+                    await _write_response(writer, 413, {'error': f"body over {max_body_bytes} bytes"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                status, payload = await _route(batcher, method.upper(), path.split('?')[0], body)
+                await _write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return handle
+
+
+async def serve(scorer, unix_path=None, bind_host=host, bind_port=port, max_batch=max_batch_clips, max_wait=max_wait_ms):
+    batcher = MicroBatcher(scorer, max_batch, max_wait / 1000)
+    batch_task = asyncio.create_task(batcher.run())
+    if unix_path:
+        server = await asyncio.start_unix_server(make_handler(batcher), path=unix_path)
+        print(f"Scoring service on unix:{unix_path}")
+    else:
+        server = await asyncio.start_server(make_handler(batcher), bind_host, bind_port)
+        print(f"Scoring service on http://{bind_host}:{bind_port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batch_task.cancel()
+        if unix_path and os.path.exists(unix_path):
+            os.remove(unix_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep SBERT, spaCy and the caches warm and boost tag confidences on request")
+    parser.add_argument('--host', default=host)
+    parser.add_argument('--port', type=int, default=port)
+    parser.add_argument('--unix', help="serve on this Unix socket path instead of TCP")
+    parser.add_argument('--max-batch', type=int, default=max_batch_clips)
+    parser.add_argument('--max-wait-ms', type=float, default=max_wait_ms)
+    parser.add_argument('--from-cache', action='store_true', help="only answer from ./cache, never load the models")
+    parser.add_argument('--persist-embeddings', action='store_true',
+                        help="append embeddings of new texts to the store in ./cache (it grows with the texts seen)")
+    parser.add_argument('--encoder-backend', choices=encoder_backends, help="default: SBERT_BACKEND or torch")
+    args = parser.parse_args()
+
+    if args.from_cache:
+        set_cache_only(True)
+    if args.encoder_backend:
+        set_encoder_backend(args.encoder_backend)
+    scorer = Scorer(persist_embeddings or args.persist_embeddings)
+    if not args.from_cache:
+        scorer.warm_up()
+    try:
+        asyncio.run(serve(scorer, args.unix, args.host, args.port, args.max_batch, args.max_wait_ms))
+    except KeyboardInterrupt:
+        pass
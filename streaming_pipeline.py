@@ -0,0 +1,323 @@
+import json
+import queue
+import threading
+from collections import namedtuple
+from itertools import islice
+import numpy as np
+from batch_boost import compute_pair_similarities, count_matches
+from grid_search import boost_grid, clip_metrics, ground_truth_arrays, macro_rows
+from instrumentation import recorder
+from predictions_loader import build_prediction_batch
+
+# === Parameters ===
+stream_chunk_clips = 256  # clips parsed, encoded and scored together
+max_in_flight_chunks = 2  # parsed chunks waiting for the encoder at most
+read_block_chars = 1 << 16
+stream_output_path = './evaluation_val_4.1_clips.jsonl'
+
+_whitespace = ' \t\r\n'
+
+
+# === Incremental Readers ===
+def iter_json_object(path, block_chars=read_block_chars):
+    """(key, value) pairs of a top-level JSON object, reading one block at a time.
+
+    Only the current record and one block are held in memory, so the reader itself does not grow
+    with the size of the captions file.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer, pos, eof = '', 0, False
+
+        def refill():
+            nonlocal buffer, pos, eof
+            block = f.read(block_chars)
+            eof = not block
+            buffer, pos = buffer[pos:] + block, 0
+            return not eof
+
+        def next_char():
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in _whitespace:
+                    pos += 1
+                if pos < len(buffer):
+                    return buffer[pos]
+                if not refill():
+                    raise ValueError(f"{path}: unexpected end of JSON")
+
+        def decode():
+            nonlocal pos
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                    # A number ending at the block boundary may continue in the next block
+                    if end < len(buffer) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                refill()
+
+        if next_char() != '{':
+            raise ValueError(f"{path}: expected a JSON object at the top level")
+        pos += 1
+        if next_char() == '}':
+            return
+        while True:
+            key = decode()
+            if next_char() != ':':
+                raise ValueError(f"{path}: expected ':' after key {key!r}")
+            pos += 1
+            next_char()
+            yield key, decode()
+            separator = next_char()
+            pos += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise ValueError(f"{path}: expected ',' or '}}' after the record of {key!r}")
+            next_char()
+
+
+def iter_json_lines(path):
+    """(clip_id, record) from JSON Lines, one {"id": ..., "audio_captions": [...]} or {clip_id: record} per line."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'id' in record:
+                yield str(record['id']), record
+            elif len(record) == 1:
+                yield next(iter(record.items()))
+            else:
+                raise ValueError(f"{path}:{line_number}: expected an 'id' field or a single {{clip_id: record}} pair")
+
+
+def iter_caption_records(path):
+    if path.endswith(('.jsonl', '.ndjson')):
+        return iter_json_lines(path)
+    return iter_json_object(path)
+
+
+# === Pipeline Stages ===
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _Failure:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def bounded_prefetch(iterable, max_in_flight=max_in_flight_chunks):
+    """Run iterable on a background thread, at most max_in_flight items ahead of the consumer.
+
+    Exceptions of the producer are raised in the consumer; closing the generator stops the producer.
+    """
+    items = queue.Queue(maxsize=max_in_flight)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(done)
+        except Exception as exc:
+            put(_Failure(exc))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, _Failure):
+                raise item.exc
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def batch_slices(batch, ground_truth_lists, pair_similarities, boosted=None, chunk_clips=stream_chunk_clips):
+    """(batch, ground_truth_lists, pair_similarities, boosted) of consecutive chunk_clips clips of a batch.
+
+    Offsets are rebased and arrays are views, so a whole dataset batch can be scored and written
+    chunk by chunk without recomputing similarities. boosted is a boost_grid result or None.
+    """
+    pair_sims, tag_pair_offsets = pair_similarities
+    for c0 in range(0, len(batch.clip_ids), chunk_clips):
+        c1 = min(c0 + chunk_clips, len(batch.clip_ids))
+        e0, e1 = batch.tag_offsets[c0], batch.tag_offsets[c1]
+        p0, p1 = batch.phrase_offsets[c0], batch.phrase_offsets[c1]
+        q0, q1 = tag_pair_offsets[e0], tag_pair_offsets[e1]
+        chunk = batch._replace(
+            clip_ids=batch.clip_ids[c0:c1],
+            tag_offsets=batch.tag_offsets[c0:c1 + 1] - e0,
+            tag_ids=batch.tag_ids[e0:e1],
+            tag_confs=batch.tag_confs[e0:e1],
+            phrase_offsets=batch.phrase_offsets[c0:c1 + 1] - p0,
+            phrase_ids=batch.phrase_ids[p0:p1],
+            num_captions=batch.num_captions[c0:c1],
+        )
+        yield (chunk, ground_truth_lists[c0:c1], (pair_sims[q0:q1], tag_pair_offsets[e0:e1 + 1] - q0),
+               None if boosted is None else boosted[..., e0:e1])
+
+
+def select_clips(records, predictions, ground_truth):
+    """(filename, captions) of the clips build_dataset_batch evaluates: with predictions and ground truth."""
+    for raw_fname, record in records:
+        fname = f"{raw_fname}.wav"
+        if fname in predictions.row_index and ground_truth.get(fname):
+            yield fname, record.get("audio_captions", [])
+
+
+def parse_chunks(clip_chunks, phrase_cache):
+    for chunk in clip_chunks:
+        fnames = [fname for fname, _ in chunk]
+        caption_lists = [captions for _, captions in chunk]
+        with recorder.stage('phrase_extraction', len(chunk)):
+            phrase_lists = phrase_cache.extract(caption_lists)
+        yield fnames, caption_lists, phrase_lists
+
+
+# Per-clip results of one chunk:
+#   boosted  (num_alpha, num_sim, num_entries) boosted confidences
+#   matches  (num_sim, num_entries) matching caption phrases per tag entry
+#   metrics  (3, num_alpha, num_conf, num_sim, num_clips) per-clip P/R/F1
+ChunkResult = namedtuple('ChunkResult', ['batch', 'ground_truth_lists', 'boosted', 'matches', 'metrics'])
+
+
+def score_batch(batch, ground_truth_lists, pair_similarities, alpha_values, confidence_thresholds,
+                caption_similarity_thresholds, boosted=None):
+    """ChunkResult of one RaggedBatch, boosting it unless a boost_grid result is passed as boosted."""
+    if boosted is None:
+        boosted = boost_grid(batch, pair_similarities, alpha_values, caption_similarity_thresholds)
+    matches = np.stack([count_matches(*pair_similarities, t) for t in caption_similarity_thresholds]) \
+        if len(caption_similarity_thresholds) else np.zeros((0, len(batch.tag_ids)), dtype=np.int64)
+    gt_multiplicity, gt_counts = ground_truth_arrays(batch, ground_truth_lists)
+    metrics = np.empty((3, len(alpha_values), len(confidence_thresholds), len(caption_similarity_thresholds),
+                        len(batch.clip_ids)))
+    with recorder.stage('metrics', metrics[0].size):
+        for k, conf_thresh in enumerate(confidence_thresholds):
+            for m, values in enumerate(clip_metrics(boosted >= conf_thresh, batch, gt_multiplicity, gt_counts)):
+                metrics[m, :, k] = values
+    return ChunkResult(batch, ground_truth_lists, boosted, matches, metrics)
+
+
+def score_chunks(parsed_chunks, predictions, ground_truth, embed_fn, alpha_values, confidence_thresholds,
+                 caption_similarity_thresholds):
+    for fnames, caption_lists, phrase_lists in parsed_chunks:
+        batch = build_prediction_batch(predictions, fnames, phrase_lists, [len(c) for c in caption_lists])
+        ground_truth_lists = [ground_truth[f] for f in fnames]
+        pair_similarities = compute_pair_similarities(batch, embed_fn)
+        yield score_batch(batch, ground_truth_lists, pair_similarities, alpha_values, confidence_thresholds,
+                          caption_similarity_thresholds)
+
+
+# === Results ===
+class StreamingGrid:
+    """Running macro precision/recall/F1 over the chunks seen so far; rows() matches grid_search."""
+
+    def __init__(self, alpha_values, confidence_thresholds, caption_similarity_thresholds):
+        self.alpha_values = list(alpha_values)
+        self.confidence_thresholds = list(confidence_thresholds)
+        self.caption_similarity_thresholds = list(caption_similarity_thresholds)
+        self.sums = np.zeros((3, len(self.alpha_values), len(self.confidence_thresholds),
+                              len(self.caption_similarity_thresholds)))
+        self.num_clips = 0
+
+    def add(self, chunk):
+        self.sums += chunk.metrics.sum(axis=-1)
+        self.num_clips += chunk.metrics.shape[-1]
+
+    def rows(self):
+        if not self.num_clips:
+            return []
+        return macro_rows(self.sums / self.num_clips, self.alpha_values, self.confidence_thresholds,
+                          self.caption_similarity_thresholds)
+
+    def best(self):
+        rows = self.rows()
+        return max(rows, key=lambda row: row['f1']) if rows else None
+
+
+def write_clip_records(f, chunk):
+    """One JSON line per clip: tags with original and boosted confidences, and P/R/F1 over the grid.
+
+    boosted is indexed [alpha][caption_sim_thresh] and the metrics [alpha][conf_thresh][caption_sim_thresh],
+    following the grid in the header line.
+    """
+    batch = chunk.batch
+    for c, fname in enumerate(batch.clip_ids):
+        start, stop = batch.tag_offsets[c], batch.tag_offsets[c + 1]
+        f.write(json.dumps({
+            'clip': fname,
+            'num_captions': int(batch.num_captions[c]),
+            'ground_truth': chunk.ground_truth_lists[c],
+            'tags': [batch.tag_vocab[i] for i in batch.tag_ids[start:stop]],
+            'original': batch.tag_confs[start:stop].tolist(),
+            'boosted': np.round(chunk.boosted[:, :, start:stop], 6).tolist(),
+            'precision': np.round(chunk.metrics[0, ..., c], 6).tolist(),
+            'recall': np.round(chunk.metrics[1, ..., c], 6).tolist(),
+            'f1': np.round(chunk.metrics[2, ..., c], 6).tolist(),
+        }) + '\n')
+    f.flush()
+
+
+# === Streaming Evaluation ===
+def stream_evaluate(captions_path, predictions, ground_truth, phrase_cache, embed_fn, alpha_values,
+                    confidence_thresholds, caption_similarity_thresholds, output_path=stream_output_path,
+                    chunk_clips=stream_chunk_clips, max_in_flight=max_in_flight_chunks, on_chunk=None):
+    """grid_search over a captions file that is never loaded whole.
+
+    Reading, clip selection and phrase extraction run on a background thread at most max_in_flight
+    chunks ahead; encoding, boosting and scoring follow chunk by chunk. Every scored chunk is
+    appended to output_path as JSON lines and passed to on_chunk(grid, chunk), so results arrive
+    while the rest of the corpus is still being read. Returns the grid_search rows for all clips.
+
+    Captions, batches and scores are bounded by the chunks in flight. Memory stays flat when the
+    caches are bounded too: a BoundedPhraseCache and an embed_fn over an EmbeddingStore with
+    disk_index, as phrase_f1 --stream passes. A PhraseCache or a dict-indexed store keeps an index
+    entry per caption, clip and text seen.
+    """
+    grid = StreamingGrid(alpha_values, confidence_thresholds, caption_similarity_thresholds)
+    clips = select_clips(iter_caption_records(captions_path), predictions, ground_truth)
+    parsed = bounded_prefetch(parse_chunks(chunked(clips, chunk_clips), phrase_cache), max_in_flight)
+    try:
+        with open(output_path, 'w') as f:
+            f.write(json.dumps({'grid': {
+                'alpha': grid.alpha_values,
+                'conf_thresh': grid.confidence_thresholds,
+                'caption_sim_thresh': grid.caption_similarity_thresholds,
+            }}) + '\n')
+            for chunk in score_chunks(parsed, predictions, ground_truth, embed_fn, alpha_values, confidence_thresholds,
+                                      caption_similarity_thresholds):
+                grid.add(chunk)
+                write_clip_records(f, chunk)
+                if on_chunk is not None:
+                    on_chunk(grid, chunk)
+    finally:
+        # Stops the reader thread if scoring failed part way
+        parsed.close()
+    return grid.rows()
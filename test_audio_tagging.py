@@ -0,0 +1,58 @@
+import unittest
+import numpy as np
+from audio_tagging import frame_windows, iter_batches, pcm_to_float, window_params
+
+# === Parameters ===
+seed = 5
+batch_size = 4
+
+
+def loop_windows(audio):
+    # The per-segment loop frame_windows replaces
+    segment_length, hop_length = window_params()
+    return [audio[start_idx:start_idx + segment_length]
+            for start_idx in range(0, len(audio) - segment_length + 1, hop_length)]
+
+
+class WindowingTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(seed)
+        self.segment_length, self.hop_length = window_params()
+
+    def test_frame_windows_matches_loop(self):
+        for length in (self.segment_length, self.segment_length + self.hop_length - 1,
+                       self.segment_length + 3 * self.hop_length, 7 * self.segment_length + 123):
+            audio = self.rng.normal(size=length).astype(np.float32)
+            windows = frame_windows(audio)
+            self.assertEqual(windows.shape, (len(loop_windows(audio)), self.segment_length))
+            np.testing.assert_array_equal(windows, np.stack(loop_windows(audio)))
+            self.assertTrue(np.shares_memory(windows, audio))
+
+            stereo = self.rng.integers(-32768, 32768, size=(length, 2)).astype(np.int16)
+            np.testing.assert_array_equal(frame_windows(stereo), np.stack([w.T for w in loop_windows(stereo)]))
+
+    def test_short_audio_has_no_windows(self):
+        self.assertEqual(frame_windows(np.zeros(self.segment_length - 1, dtype=np.float32)).shape,
+                         (0, self.segment_length))
+        self.assertEqual(frame_windows(np.zeros((10, 2), dtype=np.int16)).shape, (0, 2, self.segment_length))
+
+    def test_iter_batches_matches_all_windows(self):
+        views = [frame_windows(self.rng.integers(-32768, 32768, size=n).astype(np.int16))
+                 for n in (3 * self.segment_length, self.segment_length - 1, 5 * self.segment_length + 17)]
+        batches = list(iter_batches(views, batch_size))
+        total = sum(len(view) for view in views)
+        self.assertEqual([len(batch) for batch in batches], [batch_size] * (total // batch_size) + [total % batch_size])
+        self.assertTrue(all(batch.dtype == np.float32 for batch in batches))
+        np.testing.assert_array_equal(np.concatenate(batches), pcm_to_float(np.concatenate([view for view in views if len(view)])))
+        self.assertEqual(list(iter_batches([frame_windows(np.zeros(10, dtype=np.float32))])), [])
+
+    def test_pcm_scaling(self):
+        pcm = np.array([[-32768, 0, 16384]], dtype=np.int16)
+        np.testing.assert_array_equal(pcm_to_float(pcm), [[-1.0, 0.0, 0.5]])
+        np.testing.assert_array_equal(pcm_to_float(np.array([[0, 128, 255]], dtype=np.uint8)), [[-1.0, 0.0, 127 / 128]])
+        stereo = np.array([[[0.5, 1.0], [0.0, -1.0]]], dtype=np.float32)
+        np.testing.assert_array_equal(pcm_to_float(stereo), [[0.25, 0.0]])
+
+
+if __name__ == "__main__":
+    unittest.main()
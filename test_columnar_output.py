@@ -0,0 +1,56 @@
+import random
+import unittest
+import numpy as np
+import pandas as pd
+from batch_boost import build_ragged_batch, compute_pair_similarities
+from columnar_output import chunk_columns, grid_rows_from_records
+from grid_search import grid_search
+from streaming_pipeline import score_batch
+from test_grid_search import make_clips, random_embedding, embedding_dim, seed
+
+# === Parameters ===
+# float32 grid values are not the float64 values parsed back from their directory names
+alpha_values = [np.float32(0.1), np.float32(0.7), 1]
+confidence_thresholds = [0.3, 0.5]
+caption_similarity_thresholds = [np.float32(0.3), 0.6]
+
+
+class GridRowsFromRecordsTest(unittest.TestCase):
+    def test_matches_grid_search(self):
+        vectors = {}
+        embed_fn = lambda texts: np.stack([random_embedding(vectors, text) for text in texts]) if texts else \
+            np.zeros((0, embedding_dim), dtype=np.float32)
+        clips, ground_truth_lists = make_clips(random.Random(seed))
+        batch = build_ragged_batch(clips)
+        pair_similarities = compute_pair_similarities(batch, embed_fn)
+        chunk = score_batch(batch, ground_truth_lists, pair_similarities, alpha_values, confidence_thresholds,
+                            caption_similarity_thresholds)
+
+        # Partition columns as a hive dataset reader gives them: float64 parsed from the directory names
+        frames = []
+        for (alpha, cap_sim_thresh), columns in chunk_columns(chunk, alpha_values, confidence_thresholds,
+                                                              caption_similarity_thresholds):
+            frame = pd.DataFrame(columns)
+            frame['alpha'] = float(f'{alpha}')
+            frame['caption_sim_thresh'] = float(f'{cap_sim_thresh}')
+            frames.append(frame)
+        rows = grid_rows_from_records(pd.concat(frames, ignore_index=True), alpha_values, confidence_thresholds,
+                                      caption_similarity_thresholds, len(clips))
+
+        expected = grid_search(batch, ground_truth_lists, alpha_values, confidence_thresholds,
+                               caption_similarity_thresholds, pair_similarities=pair_similarities)
+        self.assertEqual(len(rows), len(expected))
+        for row, expected_row in zip(rows, expected):
+            for name in ('precision', 'recall', 'f1'):
+                self.assertAlmostEqual(row[name], expected_row[name], places=12)
+        self.assertGreater(sum(row['f1'] for row in rows), 0)
+
+    def test_records_outside_the_grid(self):
+        records = pd.DataFrame({'alpha': [0.2], 'caption_sim_thresh': [0.3], 'clip': ['0.wav'], 'gt_multiplicity': [1],
+                                'gt_count': [1], 'selected@0.5': [True]})
+        with self.assertRaises(ValueError):
+            grid_rows_from_records(records, [0.1], [0.5], [0.3], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import multiprocessing
+import os
+import tempfile
+import unittest
+import numpy as np
+import models
+from batch_boost import cosine_similarity_matrix
+from embedding_store import EmbeddingStore, BoundedEmbeddingCache
+
+# === Parameters ===
+embedding_dim = 8
+num_writers = 4
+texts_per_writer = 40
+quantization_atol = {'float16': 1e-2, 'int8': 5e-2}  # largest element/cosine difference against float32
+
+
+class CountingEncoder:
+    """Seeded vector per text, remembering every text it was asked to encode."""
+
+    def __init__(self):
+        self.encoded = []
+
+    def __call__(self, texts):
+        self.encoded.extend(texts)
+        return np.stack([np.random.default_rng(sum(map(ord, text))).normal(size=embedding_dim) for text in texts])
+
+
+def add_overlapping_texts(root, writer):
+    # Every writer adds half of its texts in common with the next writer, in small appends
+    store = EmbeddingStore('test-concurrent', root=root)
+    texts = [f"text {i}" for i in range(writer * texts_per_writer // 2, (writer + 2) * texts_per_writer // 2)]
+    for start in range(0, len(texts), 5):
+        store.add(texts[start:start + 5], CountingEncoder()(texts[start:start + 5]))
+
+
+class BoundedEmbeddingCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def test_lru_without_store(self):
+        encode = CountingEncoder()
+        cache = BoundedEmbeddingCache(encode, max_texts=3)
+        texts = ["dog", "car", "dog", "rain"]
+        np.testing.assert_array_equal(cache.get_or_encode(texts), CountingEncoder()(texts).astype(np.float32))
+        self.assertEqual(encode.encoded, ["dog", "car", "rain"])
+        cache.get_or_encode(["dog"])
+        cache.get_or_encode(["bell"])  # evicts "car", the least recently used
+        self.assertEqual(list(cache.vectors), ["rain", "dog", "bell"])
+        cache.get_or_encode(["car", "rain"])
+        self.assertEqual(encode.encoded, ["dog", "car", "rain", "bell", "car"])
+        self.assertEqual(cache.get_or_encode([]).shape, (0, embedding_dim))
+
+    def test_store_is_read_and_written_only_with_persist(self):
+        store = EmbeddingStore('test-lru', root=self.root.name, disk_index=True)
+        store.add(["dog"], CountingEncoder()(["dog"]))
+
+        encode = CountingEncoder()
+        cache = BoundedEmbeddingCache(encode, store)
+        np.testing.assert_array_equal(cache.get_or_encode(["dog", "car"]), store.get_or_encode(["dog", "car"], CountingEncoder()))
+        self.assertEqual(encode.encoded, ["car"])
+
+        store = EmbeddingStore('test-lru-2', root=self.root.name, disk_index=True)
+        BoundedEmbeddingCache(CountingEncoder(), store).get_or_encode(["dog", "car"])
+        self.assertEqual(len(store), 0)
+        BoundedEmbeddingCache(CountingEncoder(), store, persist=True).get_or_encode(["dog", "car"])
+        self.assertEqual(len(store), 2)
+
+
+class SeedFromFloat32Test(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.texts = [f"text {i}" for i in range(25)]
+        self.vectors = CountingEncoder()(self.texts)
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def test_seeded_rows_match_direct_quantization(self):
+        source = EmbeddingStore('test-seed', root=self.root.name)
+        source.add(self.texts, self.vectors)
+        for dtype in ('float16', 'int8'):
+            direct = EmbeddingStore('test-direct', root=self.root.name, dtype=dtype)
+            direct.add(self.texts, self.vectors)
+            seeded = EmbeddingStore('test-seed', root=self.root.name, dtype=dtype)
+            self.assertEqual(seeded.seed_from(source, batch_rows=10), len(self.texts))
+            self.assertEqual(seeded.seed_from(source), 0)
+            np.testing.assert_array_equal(np.asarray(seeded.matrix), np.asarray(direct.matrix))
+            np.testing.assert_array_equal(seeded.scales, direct.scales)
+            np.testing.assert_array_equal(seeded.rows(self.texts[::-1]), direct.rows(self.texts[::-1]))
+
+    def test_get_embedding_store_seeds_missing_dtype(self):
+        cwd, saved = os.getcwd(), dict(models._loaded)
+        os.chdir(self.root.name)
+        try:
+            models.get_embedding_store('test-model').add(self.texts, self.vectors)
+            encode = CountingEncoder()
+            store = models.get_embedding_store('test-model', dtype='int8')
+            store.get_or_encode(self.texts + ["new text"], encode)
+            self.assertEqual(encode.encoded, ["new text"])
+        finally:
+            os.chdir(cwd)
+            models._loaded.clear()
+            models._loaded.update(saved)
+
+
+class QuantizedStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.texts = [f"text {i}" for i in range(30)]
+        self.vectors = CountingEncoder()(self.texts).astype(np.float32)
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def test_compact_rows_and_cosine_close_to_float32(self):
+        expected = cosine_similarity_matrix(self.vectors[:10], self.vectors)
+        for dtype, atol in quantization_atol.items():
+            store = EmbeddingStore('test-quantized', root=self.root.name, dtype=dtype)
+            store.add(self.texts, self.vectors)
+            reopened = EmbeddingStore('test-quantized', root=self.root.name, dtype=dtype)
+            np.testing.assert_allclose(reopened.get_many(self.texts), self.vectors,
+                                       atol=atol * np.abs(self.vectors).max())
+            compact = reopened.get_compact(self.texts)
+            self.assertEqual(compact.dtype, dtype)
+            np.testing.assert_allclose(cosine_similarity_matrix(compact[np.arange(10)], compact), expected, atol=atol)
+
+
+class ConcurrentAddTest(unittest.TestCase):
+    def test_overlapping_writers_store_each_text_once(self):
+        with tempfile.TemporaryDirectory() as root:
+            workers = [multiprocessing.Process(target=add_overlapping_texts, args=(root, writer))
+                       for writer in range(num_writers)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            self.assertEqual([worker.exitcode for worker in workers], [0] * num_writers)
+
+            store = EmbeddingStore('test-concurrent', root=root)
+            texts = [f"text {i}" for i in range((num_writers + 1) * texts_per_writer // 2)]
+            self.assertEqual(len(store), len(texts))
+            self.assertEqual(sorted(store.rows(texts)), list(range(len(texts))))
+            np.testing.assert_array_equal(store.get_many(texts), CountingEncoder()(texts).astype(np.float32))
+
+
+if __name__ == "__main__":
+    unittest.main()
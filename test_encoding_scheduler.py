@@ -0,0 +1,72 @@
+import random
+import tempfile
+import unittest
+import numpy as np
+from embedding_store import EmbeddingStore
+from encoding_scheduler import EncodingScheduler, plan_batches
+
+# === Parameters ===
+seed = 3
+embedding_dim = 8
+
+
+def seeded_encode(texts):
+    return np.stack([np.random.default_rng(sum(map(ord, text))).normal(size=embedding_dim) for text in texts])
+
+
+class RecordingEncoder:
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        return seeded_encode(texts)
+
+
+class PlanBatchesTest(unittest.TestCase):
+    def test_every_index_once_within_limits(self):
+        rng = random.Random(seed)
+        lengths = [rng.randint(0, 70) for _ in range(500)]
+        for max_tokens, max_size, width in [(256, 64, 8), (100, 7, 1), (16, 512, 32)]:
+            batches = plan_batches(lengths, max_tokens, max_size, width)
+            self.assertEqual(sorted(np.concatenate(batches)), list(range(len(lengths))))
+            for rows in batches:
+                padded = {-(-max(lengths[i], 1) // width) * width for i in rows}
+                self.assertEqual(len(padded), 1)  # one bucket per batch
+                self.assertLessEqual(len(rows), max_size)
+                # A single text longer than max_tokens still gets a batch of its own
+                self.assertTrue(len(rows) == 1 or len(rows) * padded.pop() <= max_tokens)
+
+
+class EncodingSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(seed)
+        words = ["dog", "rain", "engine", "bird", "a", "the", "loud", "distant"]
+        self.texts = [" ".join(rng.choice(words) for _ in range(rng.randint(1, 12))) for _ in range(200)]
+
+    def test_encode_matches_direct_encoding(self):
+        encode = RecordingEncoder()
+        scheduler = EncodingScheduler(encode, max_tokens=64, max_size=16)
+        np.testing.assert_array_equal(scheduler.encode(self.texts), seeded_encode(self.texts).astype(np.float32))
+        encoded = [text for batch in encode.batches for text in batch]
+        self.assertEqual(sorted(encoded), sorted(set(self.texts)))
+        self.assertTrue(all(len(batch) <= 16 for batch in encode.batches))
+        self.assertEqual(scheduler.encode([]).shape, (0, 0))
+
+    def test_tickets_share_one_flush_through_store(self):
+        with tempfile.TemporaryDirectory() as root:
+            store = EmbeddingStore('test-scheduler', root=root)
+            store.add(self.texts[:50], seeded_encode(self.texts[:50]))
+            encode = RecordingEncoder()
+            scheduler = EncodingScheduler(encode, store=store)
+            tickets = [scheduler.submit(self.texts[i:i + 80]) for i in range(0, 200, 40)]
+            self.assertFalse(any(ticket.done for ticket in tickets))
+            self.assertEqual(scheduler.flush(), len(set(self.texts) - set(self.texts[:50])))
+            for i, ticket in zip(range(0, 200, 40), tickets):
+                np.testing.assert_array_equal(ticket.vectors, seeded_encode(self.texts[i:i + 80]).astype(np.float32))
+            self.assertEqual(scheduler.flush(), 0)
+            self.assertEqual(len(store), len(set(self.texts)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+import export_mp4_to_wav
+
+
+class HashSkipTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.video_path = os.path.join(self.workdir.name, "clip.mp4")
+        self.audio_path = os.path.join(self.workdir.name, "clip.wav")
+        for path in (self.video_path, self.audio_path):
+            with open(path, 'wb') as f:
+                f.write(b"data")
+        self.hashed = []
+        self.saved = export_mp4_to_wav.skip_mode, export_mp4_to_wav.file_hash
+        export_mp4_to_wav.skip_mode = "hash"
+        export_mp4_to_wav.file_hash = lambda path: self.hashed.append(path) or self.saved[1](path)
+
+    def tearDown(self):
+        export_mp4_to_wav.skip_mode, export_mp4_to_wav.file_hash = self.saved
+        self.workdir.cleanup()
+
+    def is_up_to_date(self, manifest):
+        return export_mp4_to_wav.is_up_to_date(self.video_path, self.audio_path, manifest, "clip.mp4")
+
+    def test_hash_only_when_stat_changes(self):
+        manifest = {"clip.mp4": dict(export_mp4_to_wav.file_stat(self.video_path), settings=export_mp4_to_wav.export_settings(),
+                                     sha1=self.saved[1](self.video_path))}
+        self.assertTrue(self.is_up_to_date(manifest))
+        self.assertEqual(self.hashed, [])
+
+        # Touched but unchanged: hashed once, then skipped on the recorded stat
+        os.utime(self.video_path, ns=(0, 10 ** 9))
+        self.assertTrue(self.is_up_to_date(manifest))
+        self.assertTrue(self.is_up_to_date(manifest))
+        self.assertEqual(len(self.hashed), 1)
+
+        with open(self.video_path, 'wb') as f:
+            f.write(b"other")
+        self.assertFalse(self.is_up_to_date(manifest))
+
+    def test_entry_without_sha1_is_redone(self):
+        manifest = {"clip.mp4": {'settings': export_mp4_to_wav.export_settings()}}
+        self.assertFalse(self.is_up_to_date(manifest))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import random
+import unittest
+import numpy as np
+import phrase_f1
+from batch_boost import build_ragged_batch
+from grid_search import grid_search
+
+# === Parameters ===
+seed = 7
+num_clips = 40
+embedding_dim = 16
+words = ["dog", "bark", "car", "engine", "music", "guitar", "rain", "wind", "bird", "speech", "crowd", "bell"]
+alpha_values = [0.0, 0.3, 0.7, 1.0]
+confidence_thresholds = [0.2, 0.5, 0.8]
+caption_similarity_thresholds = [0.0, 0.3, 0.6]
+semantic_thresholds = [0.0, 0.3]
+
+
+def make_clips(rng):
+    """(clip_id, audio_tags, caption_elements, num_captions) and a ground truth list per clip."""
+    clips, ground_truth_lists = [], []
+    for c in range(num_clips):
+        audio_tags = [(tag, round(rng.random(), 6)) for tag in rng.sample(words, rng.randint(0, 5))]
+        phrases = [" ".join(rng.sample(words, rng.randint(1, 2))) for _ in range(rng.randint(0, 6))]
+        clips.append((f"{c}.wav", audio_tags, phrases, rng.randint(0, 5)))
+        # Repeated labels are allowed in the ground truth
+        ground_truth_lists.append([rng.choice(words) for _ in range(rng.randint(0, 4))])
+    return clips, ground_truth_lists
+
+
+def make_tie_clips(rng):
+    """Clips whose boosts and similarities land exactly on the grid thresholds.
+
+    Probabilities are float32 values widened to float64 as clip_tags gives them, plus exact grid
+    values; with one-hot embeddings every similarity is exactly 0 or 1.
+    """
+    probabilities = confidence_thresholds + [0.0, 1.0, 0.3, 0.7] + [float(np.float32(p)) for p in (0.2, 0.5, 0.7, 0.8)]
+    clips, ground_truth_lists = [], []
+    for c in range(num_clips):
+        audio_tags = [(tag, rng.choice(probabilities)) for tag in rng.sample(words, rng.randint(1, 4))]
+        phrases = rng.sample(words, rng.randint(0, 5))
+        clips.append((f"{c}.wav", audio_tags, phrases, rng.choice([1, 2, 4, 5])))
+        ground_truth_lists.append(rng.sample(words, rng.randint(1, 3)))
+    return clips, ground_truth_lists
+
+
+def semantic_prf(true_positives, false_positives, false_negatives):
+    precision = true_positives / (true_positives + false_positives) if true_positives + false_positives else 0.0
+    recall = true_positives / (true_positives + false_negatives) if true_positives + false_negatives else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+def random_embedding(vectors, text):
+    # One seeded random vector per text, so equal texts are identical and others are not
+    if text not in vectors:
+        vectors[text] = np.random.default_rng(len(vectors) + seed).normal(size=embedding_dim).astype(np.float32)
+    return vectors[text]
+
+
+def one_hot_embedding(vectors, text):
+    # Equal texts have similarity exactly 1, different ones exactly 0
+    if text not in vectors:
+        vectors[text] = np.eye(embedding_dim, dtype=np.float32)[len(vectors)]
+    return vectors[text]
+
+
+class GridSearchTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = phrase_f1.get_embedding_with_cache, phrase_f1.get_embeddings_with_cache, phrase_f1.prefetch_embeddings
+        self.use_embeddings(random_embedding)
+
+    def tearDown(self):
+        phrase_f1.get_embedding_with_cache, phrase_f1.get_embeddings_with_cache, phrase_f1.prefetch_embeddings = self.saved
+
+    def use_embeddings(self, make_embedding):
+        vectors = {}
+        embed = lambda text: make_embedding(vectors, text)
+        self.embed_fn = lambda texts: np.stack([embed(text) for text in texts]) if texts else \
+            np.zeros((0, embedding_dim), dtype=np.float32)
+        # evaluate_combination looks embeddings up one text at a time; no model or store is loaded
+        phrase_f1.get_embedding_with_cache = lambda text: embed(text)[None, :]
+        phrase_f1.get_embeddings_with_cache = self.embed_fn
+        phrase_f1.prefetch_embeddings = lambda texts: None
+
+    def test_matches_evaluate_combination(self):
+        self.check_against_evaluate_combination(*make_clips(random.Random(seed)))
+
+    def test_threshold_ties(self):
+        self.use_embeddings(one_hot_embedding)
+        self.check_against_evaluate_combination(*make_tie_clips(random.Random(seed)))
+
+    def test_semantic_columns_match_is_semantic_match(self):
+        clips, ground_truth_lists = make_clips(random.Random(seed))
+        rows = grid_search(build_ragged_batch(clips), ground_truth_lists, alpha_values, confidence_thresholds,
+                           caption_similarity_thresholds, embed_fn=self.embed_fn, semantic_thresholds=semantic_thresholds)
+        rows = iter(rows)
+        for alpha in alpha_values:
+            for conf_thresh in confidence_thresholds:
+                for cap_sim_thresh in caption_similarity_thresholds:
+                    row = next(rows)
+                    for sem_thresh in semantic_thresholds:
+                        scores = []
+                        for (_, audio_tags, phrases, num_captions), ground_truth in zip(clips, ground_truth_lists):
+                            selected = phrase_f1.evaluate_combination(audio_tags, ground_truth, phrases, [None] * num_captions,
+                                                                      alpha, conf_thresh, cap_sim_thresh)[3]
+                            # A selected tag hits when it matches some ground truth label, and a ground truth
+                            # label is missed when no selected tag matches it
+                            tp = sum(phrase_f1.is_semantic_match(tag, ground_truth, sem_thresh) for tag in selected)
+                            fn = sum(not phrase_f1.is_semantic_match(label, selected, sem_thresh) for label in ground_truth)
+                            scores.append(semantic_prf(tp, len(selected) - tp, fn))
+                        precision, recall, f1 = np.mean(scores, axis=0)
+                        self.assertAlmostEqual(row[f'sem_precision@{sem_thresh}'], precision, places=12)
+                        self.assertAlmostEqual(row[f'sem_recall@{sem_thresh}'], recall, places=12)
+                        self.assertAlmostEqual(row[f'sem_f1@{sem_thresh}'], f1, places=12)
+
+    def check_against_evaluate_combination(self, clips, ground_truth_lists):
+        rows = grid_search(build_ragged_batch(clips), ground_truth_lists, alpha_values, confidence_thresholds,
+                           caption_similarity_thresholds, embed_fn=self.embed_fn)
+
+        expected = []
+        for alpha in alpha_values:
+            for conf_thresh in confidence_thresholds:
+                for cap_sim_thresh in caption_similarity_thresholds:
+                    scores = [
+                        phrase_f1.evaluate_combination(audio_tags, ground_truth, phrases, [None] * num_captions,
+                                                       alpha, conf_thresh, cap_sim_thresh)[:3]
+                        for (_, audio_tags, phrases, num_captions), ground_truth in zip(clips, ground_truth_lists)
+                    ]
+                    expected.append((alpha, conf_thresh, cap_sim_thresh, np.mean(scores, axis=0)))
+
+        self.assertEqual(len(rows), len(expected))
+        for row, (alpha, conf_thresh, cap_sim_thresh, (precision, recall, f1)) in zip(rows, expected):
+            self.assertEqual((row['alpha'], row['conf_thresh'], row['caption_sim_thresh']),
+                             (alpha, conf_thresh, cap_sim_thresh))
+            self.assertAlmostEqual(row['precision'], precision, places=12)
+            self.assertAlmostEqual(row['recall'], recall, places=12)
+            self.assertAlmostEqual(row['f1'], f1, places=12)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import sys
+import threading
+import unittest
+from instrumentation import Recorder
+
+# === Parameters ===
+num_threads = 8
+stages_per_thread = 2000
+
+
+class RecorderThreadingTest(unittest.TestCase):
+    def test_stage_while_progress_line(self):
+        recorder = Recorder()
+        errors = []
+        done = threading.Event()
+
+        def work():
+            try:
+                for _ in range(stages_per_thread):
+                    with recorder.stage('outer', 1):
+                        with recorder.stage('inner'):
+                            pass
+            except Exception as e:
+                errors.append(e)
+
+        def watch():
+            # Keeps reading every stack while the workers open and close stages
+            try:
+                while not done.is_set():
+                    recorder.progress_line()
+            except Exception as e:
+                errors.append(e)
+
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            watcher = threading.Thread(target=watch)
+            watcher.start()
+            workers = [threading.Thread(target=work) for _ in range(num_threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            done.set()
+            watcher.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(recorder.stages['outer']['calls'], num_threads * stages_per_thread)
+        self.assertEqual(recorder.stages['outer']['items'], num_threads * stages_per_thread)
+        self.assertEqual(recorder.stages['inner']['calls'], num_threads * stages_per_thread)
+        self.assertEqual(recorder._stacks, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import random
+import unittest
+import numpy as np
+import phrase_f1
+from batch_boost import build_ragged_batch, cosine_similarity_matrix
+from grid_search import semantic_pairs
+from label_index import LabelIndex, normalize_rows
+
+# === Parameters ===
+seed = 5
+embedding_dim = 16
+num_labels = 60
+labels = [f"label {i}" for i in range(num_labels)]
+
+
+class LabelIndexTest(unittest.TestCase):
+    def setUp(self):
+        vectors = {}
+
+        def embed(text):
+            if text not in vectors:
+                vectors[text] = np.random.default_rng(len(vectors) + seed).normal(size=embedding_dim).astype(np.float32)
+            return vectors[text]
+
+        self.embed_fn = lambda texts: np.stack([embed(text) for text in texts]) if texts else \
+            np.zeros((0, embedding_dim), dtype=np.float32)
+        self.index = LabelIndex(labels, normalize_rows(self.embed_fn(labels)))
+
+    def test_top_k_matches_brute_force(self):
+        queries = np.random.default_rng(seed).normal(size=(25, embedding_dim)).astype(np.float32)
+        similarities = cosine_similarity_matrix(queries, self.embed_fn(labels))
+        for k in (1, 5, num_labels, num_labels + 3):
+            indices, scores = self.index.top_k(queries, k)
+            expected = np.argsort(-similarities, axis=1, kind='stable')[:, :k]
+            np.testing.assert_array_equal(indices, expected)
+            np.testing.assert_allclose(scores, np.take_along_axis(similarities, expected, axis=1), rtol=0, atol=1e-6)
+
+    def test_align_matches_brute_force(self):
+        phrases = labels[:5] + ["dog", "car", "rain"]
+        similarities = cosine_similarity_matrix(self.embed_fn(phrases), self.embed_fn(labels))
+        expected = [(labels[row.argmax()], row.max()) for row in similarities if row.max() > 0.5]
+        aligned = self.index.align(phrases, self.embed_fn)
+        self.assertEqual([label for label, _ in aligned], [label for label, _ in expected])
+        np.testing.assert_allclose([score for _, score in aligned], [score for _, score in expected], atol=1e-6)
+
+    def test_semantic_pairs_match_embed_fn(self):
+        rng = random.Random(seed)
+        outside = ["dog", "car"]  # not in the index, encoded through embed_fn
+        clips, ground_truth_lists = [], []
+        for c in range(30):
+            tags = [(tag, rng.random()) for tag in rng.sample(labels + outside, rng.randint(0, 4))]
+            clips.append((f"{c}.wav", tags, [], 1))
+            ground_truth_lists.append(rng.sample(labels + outside, rng.randint(0, 3)))
+        batch = build_ragged_batch(clips)
+
+        expected = semantic_pairs(batch, ground_truth_lists, self.embed_fn)
+        actual = semantic_pairs(batch, ground_truth_lists, lambda texts: self.index.embeddings(texts, self.embed_fn))
+        np.testing.assert_allclose(actual.entry_best, expected.entry_best, rtol=0, atol=1e-6)
+        np.testing.assert_allclose(actual.pair_sims, expected.pair_sims, rtol=0, atol=1e-6)
+
+    def test_is_semantic_match_with_label_index(self):
+        saved = (phrase_f1.get_embedding_with_cache, phrase_f1.get_embeddings_with_cache, phrase_f1.get_label_index,
+                 phrase_f1.label_index_semantic)
+        phrase_f1.get_embedding_with_cache = lambda text: self.embed_fn([text])
+        phrase_f1.get_embeddings_with_cache = self.embed_fn
+        phrase_f1.get_label_index = lambda *args, **kwargs: self.index
+        try:
+            rng = random.Random(seed)
+            for _ in range(50):
+                tag = rng.choice(labels + ["dog"])
+                ground_truth = rng.sample(labels + ["car"], rng.randint(0, 3))
+                threshold = rng.choice([0.0, 0.2, 0.4])
+                phrase_f1.label_index_semantic = False
+                expected = phrase_f1.is_semantic_match(tag, ground_truth, threshold)
+                phrase_f1.label_index_semantic = True
+                self.assertEqual(phrase_f1.is_semantic_match(tag, ground_truth, threshold), expected)
+        finally:
+            (phrase_f1.get_embedding_with_cache, phrase_f1.get_embeddings_with_cache, phrase_f1.get_label_index,
+             phrase_f1.label_index_semantic) = saved
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import random
+import unittest
+import numpy as np
+from batch_boost import build_ragged_batch
+from ontology_index import OntologyIndex, selection_hierarchical_prf
+from predictions_loader import load_label_vocabulary
+
+# === Parameters ===
+seed = 3
+num_clips = 30
+ontology_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audioset_ontology.json')
+unknown_labels = ["Kazoo solo", "Dial-up modem"]  # not in the ontology
+
+
+def closure(index, labels):
+    """Ancestor-closed label names; labels outside the ontology only stand for themselves."""
+    names = set()
+    for label in labels:
+        if label in index.label_to_id:
+            names.update(index.labels[j] for j in np.flatnonzero(index.ancestors[index.label_to_id[label]]))
+        else:
+            names.add(label)
+    return names
+
+
+def brute_force_prf(index, predicted, relevant):
+    predicted, relevant = closure(index, predicted), closure(index, relevant)
+    overlap = len(predicted & relevant)
+    precision = overlap / len(predicted) if predicted else 0.0
+    recall = overlap / len(relevant) if relevant else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+def csr(label_lists):
+    offsets = np.zeros(len(label_lists) + 1, dtype=np.int64)
+    np.cumsum([len(labels) for labels in label_lists], out=offsets[1:])
+    return offsets, [label for labels in label_lists for label in labels]
+
+
+class UnknownLabelTest(unittest.TestCase):
+    def setUp(self):
+        self.index = OntologyIndex(load_label_vocabulary(ontology_file), ontology_file)
+        rng = random.Random(seed)
+        pool = self.index.labels[:80] + unknown_labels
+        self.pred_lists = [rng.sample(pool, rng.randint(0, 4)) for _ in range(num_clips)]
+        self.true_lists = [rng.sample(pool, rng.randint(0, 3)) for _ in range(num_clips)]
+        # Clips where an unknown label is on both sides, on one side, and alone
+        self.pred_lists[:3] = [["Kazoo solo", "Speech"], ["Kazoo solo"], ["Dial-up modem"]]
+        self.true_lists[:3] = [["Kazoo solo"], ["Speech"], []]
+        self.expected = np.array([brute_force_prf(self.index, p, t) for p, t in zip(self.pred_lists, self.true_lists)]).T
+
+    def test_hierarchical_prf(self):
+        pred_offsets, pred_labels = csr(self.pred_lists)
+        true_offsets, true_labels = csr(self.true_lists)
+        metrics = self.index.hierarchical_prf(pred_offsets, self.index.ids_for(pred_labels, unknown_labels),
+                                              true_offsets, self.index.ids_for(true_labels, unknown_labels))
+        np.testing.assert_allclose(np.array(metrics), self.expected, rtol=0, atol=1e-12)
+        with self.assertRaises(ValueError):
+            self.index.hierarchical_prf(pred_offsets, self.index.ids_for(pred_labels), true_offsets,
+                                        self.index.ids_for(true_labels))
+
+    def test_selection_hierarchical_prf(self):
+        batch = build_ragged_batch((c, [(tag, 1.0) for tag in tags], [], 1) for c, tags in enumerate(self.pred_lists))
+        selected = np.ones((2, len(batch.tag_ids)), dtype=bool)
+        metrics = selection_hierarchical_prf(self.index, selected, batch, self.true_lists)
+        for selection in range(2):
+            np.testing.assert_allclose(np.array(metrics)[:, selection], self.expected, rtol=0, atol=1e-12)
+
+    def test_expand_unknown_is_isolated(self):
+        offsets, labels = csr([["Kazoo solo"], ["Speech", "Dial-up modem"]])
+        ids = self.index.ids_for(labels, unknown_labels)
+        for bits in (self.index.expand_ancestors(offsets, ids), self.index.expand_descendants(offsets, ids)):
+            members = np.unpackbits(bits, axis=-1, count=len(self.index) + len(unknown_labels)).astype(bool)
+            self.assertEqual(np.flatnonzero(members[0]).tolist(), [len(self.index)])
+            self.assertTrue(members[1, len(self.index) + 1])
+            self.assertFalse(members[1, len(self.index)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import json
+import asyncio
+import unittest
+from scoring_service import BadRequest, parse_request, make_handler
+
+
+class ParseRequestTest(unittest.TestCase):
+    def test_accepts_pairs_and_objects(self):
+        expected = (["a dog barks"], [("Dog", 0.9), ("Bark", 0.0)], 0.3, 1.0)
+        for tags in ([["Dog", 0.9], ["Bark", 0]], {"Dog": 0.9, "Bark": 0}):
+            payload = {"captions": ["a dog barks"], "tags": tags, "alpha": 0.3, "caption_similarity_threshold": 1}
+            self.assertEqual(parse_request(payload), expected)
+
+    def test_rejects_bad_values(self):
+        bad_payloads = [
+            '{"captions": [], "tags": [["Dog", NaN]]}',
+            '{"captions": [], "tags": [["Dog", Infinity]]}',
+            '{"captions": [], "tags": [["Dog", "-inf"]]}',
+            '{"captions": [], "tags": [], "alpha": NaN}',
+            '{"captions": [], "tags": [], "caption_similarity_threshold": -Infinity}',
+            '{"captions": [], "tags": [["Dog", 1.5]]}',
+            '{"captions": [], "tags": {"Dog": -0.1}}',
+            '{"captions": [], "tags": [["Dog", 0.5, 0.1]]}',
+            '{"captions": [], "tags": [["Dog"]]}',
+            '{"captions": [], "tags": ["Dog"]}',
+            '{"captions": [], "tags": [["Dog", "high"]]}',
+            '{"captions": "a dog", "tags": []}',
+            '[]',
+        ]
+        for body in bad_payloads:
+            with self.assertRaises(BadRequest, msg=body):
+                parse_request(json.loads(body))
+
+
+class StubBatcher:
+    async def submit(self, request):
+        captions, audio_tags, alpha, threshold = request
+        return {label: {'boosted': prob} for label, prob in audio_tags}
+
+    def stats(self):
+        return {'requests': 0}
+
+
+class HandlerTest(unittest.TestCase):
+    def exchange(self, raw):
+        """Status codes and bodies of the responses to raw, sent on one connection to a fresh server."""
+        async def run():
+            server = await asyncio.start_server(make_handler(StubBatcher()), '127.0.0.1', 0)
+            async with server:
+                reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+                writer.write(raw)
+                await writer.drain()
+                responses = []
+                while True:
+                    status_line = await reader.readline()
+                    if not status_line:
+                        break
+                    headers = {}
+                    while True:
+                        line = await reader.readline()
+                        if line in (b'\r\n', b''):
+                            break
+                        name, _, value = line.decode('latin-1').partition(':')
+                        headers[name.strip().lower()] = value.strip()
+                    body = await reader.readexactly(int(headers['content-length']))
+                    responses.append((int(status_line.split()[1]), json.loads(body)))
+                writer.close()
+                return responses
+        return asyncio.run(asyncio.wait_for(run(), 10))
+
+    def test_keep_alive_requests(self):
+        body = json.dumps({'captions': ['a dog barks'], 'tags': [['Dog', 0.5]]}).encode('utf-8')
+        raw = (b'GET /health HTTP/1.1\r\n\r\n'
+               b'POST /score HTTP/1.1\r\nContent-Length: ' + str(len(body)).encode('ascii') + b'\r\n\r\n' + body +
+               b'GET /stats HTTP/1.1\r\nConnection: close\r\n\r\n')
+        self.assertEqual(self.exchange(raw), [(200, {'status': 'ok'}), (200, {'Dog': {'boosted': 0.5}}),
+                                              (200, {'requests': 0})])
+
+    def test_bad_heads_get_400_and_close(self):
+        for raw in (b'GARBAGE\r\n\r\n',
+                    b'GET /health\r\n\r\n',
+                    b'POST /score HTTP/1.1\r\nContent-Length: abc\r\n\r\n{}',
+                    b'POST /score HTTP/1.1\r\nContent-Length: -2\r\n\r\n{}',
+                    b'POST /score HTTP/1.1\r\nContent-Length: 1.5\r\n\r\n{}'):
+            responses = self.exchange(raw + b'GET /health HTTP/1.1\r\n\r\n')
+            self.assertEqual(len(responses), 1, raw)
+            self.assertEqual(responses[0][0], 400, raw)
+            self.assertIn('error', responses[0][1])
+
+
+if __name__ == "__main__":
+    unittest.main()
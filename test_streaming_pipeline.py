@@ -0,0 +1,145 @@
+import os
+import json
+import random
+import tempfile
+import tracemalloc
+import unittest
+import numpy as np
+import benchmark
+from embedding_store import EmbeddingStore
+from grid_search import grid_search
+from phrase_cache import BoundedPhraseCache
+from phrase_extraction import extract_phrase_lists
+from predictions_loader import load_label_vocabulary, load_predictions, build_prediction_batch
+from streaming_pipeline import iter_json_object, iter_json_lines, stream_evaluate
+
+# === Parameters ===
+seed = 11
+corpus_sizes = [200, 1600]
+chunk_clips = 25
+cached_clips = 50
+alpha_values = [0.0, 0.5, 1.0]
+confidence_thresholds = [0.3, 0.5]
+caption_similarity_thresholds = [0.3, 0.5]
+ontology_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audioset_ontology.json')
+
+
+class JsonReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.data = {
+            "1": {"audio_captions": ["a dog barks", "rain on a roof"]},
+            "clé \"quoted\"": {"audio_captions": ["émigré \u2014 \\ back\\slash", "{not: json}"], "n": -1.5e-3},
+            "nested": {"audio_captions": [], "meta": {"list": [1, 2.5, True, None, [[]]], "empty": {}}},
+            "big": {"number": 123456789012345678901234567890, "audio_captions": ["x" * 100]},
+        }
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def write(self, name, text):
+        path = os.path.join(self.workdir.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def test_iter_json_object_matches_json_load(self):
+        for indent in (None, 2):
+            path = self.write('captions.json', json.dumps(self.data, indent=indent, ensure_ascii=indent is None))
+            with open(path, 'r', encoding='utf-8') as f:
+                expected = list(json.load(f).items())
+            # Tiny blocks split keys, strings, escapes and numbers across reads
+            for block_chars in (1, 3, 7, 64, 1 << 16):
+                self.assertEqual(list(iter_json_object(path, block_chars)), expected)
+        self.assertEqual(list(iter_json_object(self.write('empty.json', ' { } '))), [])
+
+    def test_iter_json_lines(self):
+        lines = [json.dumps({"id": 7, "audio_captions": ["a"]}), "", json.dumps({"8": {"audio_captions": ["b"]}})]
+        path = self.write('captions.jsonl', "\n".join(lines) + "\n")
+        self.assertEqual(list(iter_json_lines(path)), [("7", {"id": 7, "audio_captions": ["a"]}),
+                                                       ("8", {"audio_captions": ["b"]})])
+
+
+class StreamEvaluateTest(unittest.TestCase):
+    def test_matches_grid_search(self):
+        vocab = list(load_label_vocabulary(ontology_file))
+        rng = random.Random(seed)
+        captions_data = benchmark.make_captions(60, rng)
+        clip_ids = list(captions_data)
+        with tempfile.TemporaryDirectory() as path:
+            captions_path = os.path.join(path, 'captions.json')
+            with open(captions_path, 'w') as f:
+                json.dump(captions_data, f)
+            # Some clips lack predictions or ground truth and are skipped on both paths
+            benchmark.write_predictions_csv(os.path.join(path, 'predictions.csv'), clip_ids[5:], vocab, rng)
+            ground_truth = benchmark.make_ground_truth(clip_ids, vocab, rng)
+            for clip_id in clip_ids[-5:]:
+                ground_truth[f"{clip_id}.wav"] = []
+            predictions = load_predictions(os.path.join(path, 'predictions.csv'), vocab, root=path)
+            rows = stream_evaluate(captions_path, predictions, ground_truth, BoundedPhraseCache(benchmark.StubNlp),
+                                   benchmark.stub_encode, alpha_values, confidence_thresholds,
+                                   caption_similarity_thresholds, output_path=os.path.join(path, 'clips.jsonl'),
+                                   chunk_clips=7)
+
+            with open(captions_path, 'r') as f:
+                loaded = json.load(f)
+            fnames = [f"{c}.wav" for c in loaded if f"{c}.wav" in predictions.row_index and ground_truth[f"{c}.wav"]]
+            caption_lists = [loaded[fname[:-len('.wav')]]["audio_captions"] for fname in fnames]
+            batch = build_prediction_batch(predictions, fnames, extract_phrase_lists(caption_lists, benchmark.StubNlp()),
+                                           [len(captions) for captions in caption_lists])
+            expected = grid_search(batch, [ground_truth[fname] for fname in fnames], alpha_values,
+                                   confidence_thresholds, caption_similarity_thresholds, embed_fn=benchmark.stub_encode)
+
+        self.assertEqual(len(fnames), 50)
+        self.assertEqual(len(rows), len(expected))
+        for row, expected_row in zip(rows, expected):
+            self.assertEqual(row.keys(), expected_row.keys())
+            np.testing.assert_allclose(list(row.values()), list(expected_row.values()), rtol=0, atol=1e-12)
+
+
+class StreamMemoryTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.vocab = load_label_vocabulary(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audioset_ontology.json'))
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def traced_peak(self, size):
+        """tracemalloc peak of stream_evaluate over size clips whose texts are all distinct, with bounded caches."""
+        path = os.path.join(self.workdir.name, str(size))
+        os.makedirs(path)
+        rng = random.Random(seed + size)
+        captions_data = benchmark.make_unique_captions(size, rng)
+        with open(os.path.join(path, 'captions.json'), 'w') as f:
+            json.dump(captions_data, f)
+        benchmark.write_predictions_csv(os.path.join(path, 'predictions.csv'), list(captions_data), list(self.vocab), rng)
+        ground_truth = benchmark.make_ground_truth(list(captions_data), list(self.vocab), rng)
+        predictions = load_predictions(os.path.join(path, 'predictions.csv'), list(self.vocab), root=path)
+        phrase_cache = BoundedPhraseCache(benchmark.StubNlp, max_clips=cached_clips)
+        store = EmbeddingStore('test-stream', root=path, disk_index=True)
+        del captions_data
+
+        scored = []
+        tracemalloc.start()
+        try:
+            stream_evaluate(os.path.join(path, 'captions.json'), predictions, ground_truth, phrase_cache,
+                                   lambda texts: store.get_or_encode(texts, benchmark.stub_encode),
+                                   [0.0, 0.5], [0.3, 0.5], [0.3, 0.5], output_path=os.path.join(path, 'clips.jsonl'),
+                                   chunk_clips=chunk_clips, on_chunk=lambda grid, chunk: scored.append(grid.num_clips))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(scored[-1], size)
+        self.assertEqual(len(phrase_cache.phrases), cached_clips)
+        return peak
+
+    def test_memory_stays_flat(self):
+        small, large = (self.traced_peak(size) for size in corpus_sizes)
+        # Eight times the clips and distinct texts, the same chunks in flight; a dict index or an
+        # unbounded phrase cache grows this peak by about half
+        self.assertLess(large, small * 1.2, f"peak {small / 2 ** 20:.1f} MB -> {large / 2 ** 20:.1f} MB")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import random
+import unittest
+import numpy as np
+from batch_boost import build_ragged_batch
+from grid_search import ground_truth_arrays
+from threshold_sweep import sweep_thresholds, best_cutoff
+
+# === Parameters ===
+seed = 19
+num_clips = 30
+words = ["dog", "bark", "car", "engine", "music", "guitar", "rain", "wind"]
+
+
+def prf(true_positives, false_positives, false_negatives):
+    precision = true_positives / (true_positives + false_positives) if true_positives + false_positives else 0.0
+    recall = true_positives / (true_positives + false_negatives) if true_positives + false_negatives else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+def brute_force_point(clips, ground_truth_lists, cutoff):
+    """Macro and micro P/R/F1 of selecting every tag with confidence >= cutoff, one clip at a time."""
+    per_clip, totals = [], np.zeros(3)
+    for (_, tags, _, _), ground_truth in zip(clips, ground_truth_lists):
+        selected = [tag for tag, conf in tags if conf >= cutoff]
+        counts = (sum(1 for tag in selected if tag in ground_truth), sum(1 for tag in selected if tag not in ground_truth),
+                  sum(1 for label in ground_truth if label not in selected))
+        per_clip.append(prf(*counts))
+        totals += counts
+    return list(np.mean(per_clip, axis=0)) + list(prf(*totals))
+
+
+class SweepThresholdsTest(unittest.TestCase):
+    def check(self, clips, ground_truth_lists):
+        batch = build_ragged_batch(clips)
+        curve = sweep_thresholds(batch.tag_confs, batch, *ground_truth_arrays(batch, ground_truth_lists))
+        cutoffs = [np.inf] + sorted({conf for _, tags, _, _ in clips for _, conf in tags}, reverse=True)
+        np.testing.assert_array_equal(curve['threshold'], cutoffs)
+        expected = np.array([brute_force_point(clips, ground_truth_lists, cutoff) for cutoff in cutoffs]).T
+        names = ['precision', 'recall', 'f1', 'micro_precision', 'micro_recall', 'micro_f1']
+        np.testing.assert_allclose(np.array([curve[name] for name in names]), expected, rtol=0, atol=1e-12)
+        return curve
+
+    def test_matches_brute_force(self):
+        rng = random.Random(seed)
+        clips, ground_truth_lists = [], []
+        for c in range(num_clips):
+            # Rounded confidences, so cutoffs tie across and within clips
+            tags = [(tag, round(rng.random(), 1)) for tag in rng.sample(words, rng.randint(0, 5))]
+            clips.append((c, tags, [], 1))
+            ground_truth_lists.append([rng.choice(words) for _ in range(rng.randint(0, 3))])
+        curve = self.check(clips, ground_truth_lists)
+        self.assertEqual(curve['threshold'][0], np.inf)
+        self.assertTrue(all(curve[name][0] == 0.0 for name in curve if name != 'threshold'))
+
+    def test_select_nothing_is_best_without_hits(self):
+        clips = [(0, [("dog", 0.9), ("car", 0.4)], [], 1), (1, [("rain", 0.4)], [], 1)]
+        curve = self.check(clips, [["music"], ["wind"]])
+        self.assertEqual(curve['threshold'][best_cutoff(curve)], np.inf)
+
+    def test_clips_without_tags(self):
+        curve = self.check([(0, [], [], 1), (1, [], [], 1)], [["dog"], []])
+        self.assertEqual(len(curve['threshold']), 1)
+        self.assertEqual(best_cutoff(curve), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+from collections import Counter
+import numpy as np
+from batch_boost import compute_pair_similarities, tag_clip_index
+from grid_search import boost_grid, ground_truth_arrays, clip_metrics
+from multihot_metrics import prf_from_counts
+
+# Columns of a sweep_thresholds curve
+curve_names = ('threshold', 'precision', 'recall', 'f1', 'micro_precision', 'micro_recall', 'micro_f1')
+
+
+def _grouped_cumsums(groups, *values):
+    """Running sums of each values array within each group, in the given element order.
+
+    Groups need not be contiguous; the grouping sort is shared by all arrays.
+    """
+    by_group = np.lexsort((np.arange(len(groups)), groups))
+    starts = np.r_[True, groups[by_group][1:] != groups[by_group][:-1]]
+    group_of = np.cumsum(starts) - 1
+    results = []
+    for v in values:
+        sums = np.cumsum(v[by_group])
+        # Total of all earlier groups, subtracted so each group starts from zero
+        before = (sums - v[by_group])[starts][group_of]
+        out = np.empty_like(sums)
+        out[by_group] = sums - before
+        results.append(out)
+    return results
+
+
+def _tie_ends(sorted_values):
+    """Last index of each run of equal values; a cutoff has to take a whole run."""
+    return np.r_[np.flatnonzero(sorted_values[1:] != sorted_values[:-1]), len(sorted_values) - 1]
+
+
+# === Global Cutoff ===
+def sweep_thresholds(boosted, batch, gt_multiplicity, gt_counts):
+    """Precision/recall/F1 curve over every distinct cutoff of one boosted confidence vector.
+
+    Entries are sorted once; selecting boosted >= cutoff for a decreasing cutoff adds one entry at a
+    time, which changes only its own clip's counts. Macro values (as in grid_search) follow from
+    the running per-clip F1 changes, micro values from the running totals. Returns a dict of arrays
+    with one element per cutoff, from the highest cutoff to the lowest. The first point is the
+    select-nothing cutoff, an infinite threshold where every metric is 0, so a curve is never empty
+    and best_cutoff can prefer selecting nothing when every cutoff scores 0.
+    """
+    conf = np.asarray(boosted, dtype=np.float64)
+    order = np.argsort(-conf, kind='stable')
+    if len(order) == 0:
+        return {name: np.array([np.inf if name == 'threshold' else 0.0]) for name in curve_names}
+    clips = tag_clip_index(batch)[order]
+    hits = (gt_multiplicity[order] > 0).astype(np.int64)
+    credit = gt_multiplicity[order]
+
+    # Counts of each entry's clip once the entry is selected, and just before
+    true_positives, selected, credited = _grouped_cumsums(clips, hits, np.ones(len(order), dtype=np.int64), credit)
+    after = prf_from_counts(true_positives, selected - true_positives, gt_counts[clips] - credited)
+    before = prf_from_counts(true_positives - hits, selected - 1 - (true_positives - hits),
+                             gt_counts[clips] - (credited - credit))
+    # With nothing selected every clip scores 0, so the macro curves are running sums of the changes
+    macro = [np.cumsum(a - b) / len(batch.clip_ids) for a, b in zip(after, before)]
+
+    total_tp = np.cumsum(hits)
+    micro = prf_from_counts(total_tp, np.arange(1, len(order) + 1) - total_tp, gt_counts.sum() - np.cumsum(credit))
+
+    ends = _tie_ends(conf[order])
+    points = [conf[order], macro[0], macro[1], macro[2], micro[0], micro[1], micro[2]]
+    return {name: np.r_[np.inf if name == 'threshold' else 0.0, values[ends]] for name, values in zip(curve_names, points)}
+
+
+def best_cutoff(curve, metric='f1'):
+    """Index of the best point; ties go to the highest cutoff."""
+    return int(np.argmax(curve[metric])) if len(curve[metric]) else None
+
+
+# === Per-label Cutoffs ===
+def label_support(batch, ground_truth_lists):
+    """Ground truth occurrences of every tag label, aligned with batch.tag_vocab."""
+    occurrences = Counter(label for gt in ground_truth_lists for label in gt)
+    return np.array([occurrences.get(label, 0) for label in batch.tag_vocab], dtype=np.int64)
+
+
+def per_label_thresholds(boosted, batch, gt_multiplicity, support):
+    """F1-optimal cutoff of every tag label, each label scored over the clips as its samples.
+
+    Returns (thresholds, f1) aligned with batch.tag_vocab. Labels that cannot reach a positive F1
+    get an infinite threshold, so they are never selected.
+    """
+    conf = np.asarray(boosted, dtype=np.float64)
+    if len(conf) == 0:
+        return np.full(len(batch.tag_vocab), np.inf), np.zeros(len(batch.tag_vocab))
+    labels = batch.tag_ids
+    order = np.lexsort((-conf, labels))
+    sorted_labels = labels[order]
+    sorted_conf = conf[order]
+    hits = (gt_multiplicity[order] > 0).astype(np.int64)
+    true_positives, selected, credited = _grouped_cumsums(
+        sorted_labels, hits, np.ones(len(order), dtype=np.int64), gt_multiplicity[order])
+    _, _, f1 = prf_from_counts(true_positives, selected - true_positives, support[sorted_labels] - credited)
+
+    # Valid cutoffs end a run of equal confidences within a label
+    valid = np.r_[(sorted_conf[1:] != sorted_conf[:-1]) | (sorted_labels[1:] != sorted_labels[:-1]), True]
+    scores = np.where(valid, f1, -1.0)
+    # Best valid cutoff per label: highest F1 first, then the highest cutoff
+    ranked = np.lexsort((np.arange(len(order)), -scores, sorted_labels))
+    best = ranked[np.r_[True, sorted_labels[ranked][1:] != sorted_labels[ranked][:-1]]]
+    best = best[scores[best] > 0]
+
+    thresholds = np.full(len(batch.tag_vocab), np.inf)
+    best_f1 = np.zeros(len(batch.tag_vocab))
+    thresholds[sorted_labels[best]] = sorted_conf[best]
+    best_f1[sorted_labels[best]] = f1[best]
+    return thresholds, best_f1
+
+
+# === Sweep over the Boosting Grid ===
+def optimize_thresholds(batch, ground_truth_lists, alpha_values, caption_similarity_thresholds,
+                        embed_fn=None, pair_similarities=None, metric='f1'):
+    """Exact best confidence cutoffs for every (alpha, similarity threshold) pair.
+
+    Returns (rows, curves, label_thresholds). Each row holds the best global cutoff with its macro
+    and micro scores, followed by the macro/micro scores reached with per-label cutoffs. curves
+    maps (alpha, caption_sim_thresh) to the full sweep_thresholds curve, label_thresholds to the
+    per-label (thresholds, f1, support).
+    """
+    if not batch.clip_ids:
+        return [], {}, {}
+    if pair_similarities is None:
+        pair_similarities = compute_pair_similarities(batch, embed_fn)
+    gt_multiplicity, gt_counts = ground_truth_arrays(batch, ground_truth_lists)
+    boosted = boost_grid(batch, pair_similarities, alpha_values, caption_similarity_thresholds)
+    support = label_support(batch, ground_truth_lists)
+
+    rows, curves, label_thresholds = [], {}, {}
+    for a, alpha in enumerate(alpha_values):
+        for s, cap_sim_thresh in enumerate(caption_similarity_thresholds):
+            curve = sweep_thresholds(boosted[a, s], batch, gt_multiplicity, gt_counts)
+            # Never None: the curve starts with the select-nothing cutoff
+            best = best_cutoff(curve, metric)
+            best_point = {name: float(values[best]) for name, values in curve.items()}
+            thresholds, label_f1 = per_label_thresholds(boosted[a, s], batch, gt_multiplicity, support)
+            selected = boosted[a, s] >= thresholds[batch.tag_ids]
+            label_macro = [float(values.mean()) for values in clip_metrics(selected, batch, gt_multiplicity, gt_counts)]
+            tp = int((selected & (gt_multiplicity > 0)).sum())
+            label_micro = prf_from_counts(tp, int(selected.sum()) - tp, int(gt_counts.sum() - (selected * gt_multiplicity).sum()))
+
+            rows.append({
+                'alpha': alpha,
+                'caption_sim_thresh': cap_sim_thresh,
+                'best_conf_thresh': best_point['threshold'],
+                'precision': best_point['precision'],
+                'recall': best_point['recall'],
+                'f1': best_point['f1'],
+                'micro_precision': best_point['micro_precision'],
+                'micro_recall': best_point['micro_recall'],
+                'micro_f1': best_point['micro_f1'],
+                'per_label_precision': label_macro[0],
+                'per_label_recall': label_macro[1],
+                'per_label_f1': label_macro[2],
+                'per_label_micro_f1': float(label_micro[2]),
+            })
+            curves[(alpha, cap_sim_thresh)] = curve
+            label_thresholds[(alpha, cap_sim_thresh)] = (thresholds, label_f1, support)
+    return rows, curves, label_thresholds